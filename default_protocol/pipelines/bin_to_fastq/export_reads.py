@@ -0,0 +1,188 @@
+import argparse
+import gzip
+import io
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "demux_map", "rules"))
+
+from annotation_format import REPORT_EXTENSIONS, columnar_csv_lines
+from read_index import READ_INDEX_EXTENSION, load_read_index, open_fastq, read_report, scan_fastq
+
+# Bins the basecalled reads by read length and barcode, either one bin per barcode as
+# `binlorry --bin-by barcode --out-report` does ({output_prefix}_{barcode}.fastq and .csv), or,
+# with --sample, one bin per sample ({output_path}/binned_{sample}.fastq and .csv) for any number
+# of samples at once. Either way each FASTQ is read at most once, whatever the number of bins.
+#
+# For each report in annotated_path the read index written by the annotation pipeline
+# (config `index_reads`, {filename_stem}.fqi) gives the position in the FASTQ of every read
+# with its barcode and length, so only the records of the wanted reads are read, by seeking to
+# them. Reports without an index, or whose FASTQ has changed or moved since, are indexed here
+# from the FASTQ of the same name in the same subdirectory of basecalled_path.
+#
+# A FASTQ annotated in parts (config `chunk_reads`) has a report per part, {filename_stem}.partNNN,
+# and no index. The reports of its parts are exported together, indexing the FASTQ once.
+
+FASTQ_EXTENSIONS = (".fastq", ".fastq.gz", ".fq", ".fq.gz")
+
+# the suffix of the stem of the report of a part of a FASTQ, as in RAMPART's server/startUp.js
+PART_REGEX = re.compile(r"\.part\d+$")
+
+# the output files of a bin are written through buffers of this size
+BUFFER_SIZE = 1 << 20
+
+# favour speed over size for --gzip
+GZIP_LEVEL = 3
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Export the annotated reads of some barcodes.')
+
+    parser.add_argument("--basecalled_path", action="store", type=str, dest="basecalled_path")
+    parser.add_argument("--annotated_path", action="store", type=str, dest="annotated_path")
+    parser.add_argument("--barcodes", nargs="+", default=[], action="store", type=str, dest="barcodes")
+    parser.add_argument("--sample", nargs="+", default=[], action="append", dest="samples", metavar=("SAMPLE", "BARCODE"),
+                        help="bin the reads of these barcodes as a sample, can be given once per sample")
+    parser.add_argument("--min_read_length", default=0, action="store", type=int, dest="min_read_length")
+    parser.add_argument("--max_read_length", default=1000000, action="store", type=int, dest="max_read_length")
+    parser.add_argument("--output_prefix", action="store", type=str, dest="output_prefix",
+                        help="reads of --barcodes are written to {output_prefix}_{barcode}.fastq, their report rows to .csv")
+    parser.add_argument("--output_path", action="store", type=str, dest="output_path",
+                        help="reads of each --sample are written to {output_path}/binned_{sample}.fastq, their report rows to .csv")
+    parser.add_argument("--gzip", action="store_true", dest="gzip",
+                        help="gzip the binned fastq files (.fastq.gz)")
+
+    return parser.parse_args()
+
+def strip_extension(filename, extensions):
+    #the file name without the first matching extension, or None
+    for extension in extensions:
+        if filename.endswith(extension):
+            return filename[:-len(extension)]
+    return None
+
+class BinWriter:
+    #the buffered fastq and csv files of one bin, the csv header is written before the first row
+
+    def __init__(self, fastq_path, csv_path):
+        if fastq_path.endswith(".gz"):
+            self.fastq = io.BufferedWriter(gzip.open(fastq_path, "wb", compresslevel=GZIP_LEVEL), BUFFER_SIZE)
+        else:
+            self.fastq = open(fastq_path, "wb", buffering=BUFFER_SIZE)
+        self.csv = open(csv_path, "w", buffering=BUFFER_SIZE)
+        self.has_header = False
+
+    def write_record(self, record):
+        self.fastq.write(record)
+
+    def write_row(self, header, line):
+        if not self.has_header:
+            self.csv.write(header)
+            self.has_header = True
+        self.csv.write(line if line.endswith("\n") else line + "\n")
+
+    def close(self):
+        self.fastq.close()
+        self.csv.close()
+
+def find_files(path, extensions):
+    #returns {stem: path} of the files under path with one of the extensions, the stem being the path
+    #relative to path without the extension (the reports are in the subdirectories of their FASTQs)
+    files = {}
+    for root, dirs, filenames in os.walk(path):
+        for filename in filenames:
+            stem = strip_extension(filename, extensions)
+            if stem is not None:
+                files[os.path.relpath(os.path.join(root, stem), path)] = os.path.join(root, filename)
+    return files
+
+def report_lines(report):
+    #yields the lines of a csv or columnar report as csv, header first
+    if report.endswith(".rac"):
+        yield from columnar_csv_lines(report)
+    else:
+        with open(report) as fh:
+            yield from fh
+
+def group_reports(reports):
+    #returns {stem: [path, ...]} of the reports ({stem: path} of find_files) of each FASTQ, the
+    #reports of the parts of a FASTQ ({stem}.partNNN) under the stem of the FASTQ
+    groups = {}
+    for stem in sorted(reports):
+        groups.setdefault(PART_REGEX.sub("", stem), []).append(reports[stem])
+    return groups
+
+def index_reports(fastq, reports):
+    #returns the index rows (as read_index.build_read_index) of the reads of the reports of a FASTQ,
+    #in FASTQ order, scanning it once
+    reads = {}
+    for report in reports:
+        reads.update(read_report(report))
+    return [(name,) + reads[name] + (offset, length) for name, offset, length in scan_fastq(fastq) if name in reads]
+
+def export_reads(stem, reports, fastqs, bins, min_read_length, max_read_length):
+    #writes the reads of the reports of one FASTQ (group_reports) to the bins of their barcode
+    #({barcode: [BinWriter, ...]}), returns the number of reads exported
+    index = strip_extension(reports[0], list(REPORT_EXTENSIONS.values())) + READ_INDEX_EXTENSION
+    indexed = load_read_index(index) if len(reports) == 1 and os.path.exists(index) else None
+    if indexed is None:
+        # no usable index, or the reports of the parts of a FASTQ, which aren't indexed
+        if stem not in fastqs:
+            print(f"no FASTQ found for {', '.join(reports)}, skipping it", file=sys.stderr)
+            return 0
+        indexed = fastqs[stem], index_reports(fastqs[stem], reports)
+    fastq, rows = indexed
+
+    wanted = dict((name, (barcode, offset, length)) for name, read_len, barcode, offset, length in rows
+                  if barcode in bins and min_read_length <= read_len <= max_read_length)
+    if not wanted:
+        return 0
+
+    # the records, in the order they are in the FASTQ
+    with open_fastq(fastq) as fh:
+        for barcode, offset, length in sorted(wanted.values(), key=lambda read: read[1]):
+            fh.seek(offset)
+            record = fh.read(length)
+            for writer in bins[barcode]:
+                writer.write_record(record)
+
+    for report in reports:
+        lines = report_lines(report)
+        header = next(lines)
+        for line in lines:
+            read_name = line.split(",", 1)[0]
+            if read_name in wanted:
+                for writer in bins[wanted[read_name][0]]:
+                    writer.write_row(header, line)
+    return len(wanted)
+
+def open_bins(args):
+    #returns {barcode: [BinWriter, ...]} of the bins asked for, a barcode may be in several samples
+    fastq_ext = ".fastq.gz" if args.gzip else ".fastq"
+    bins = {}
+    for barcode in args.barcodes:
+        prefix = f"{args.output_prefix}_{barcode}"
+        bins.setdefault(barcode, []).append(BinWriter(prefix + fastq_ext, prefix + ".csv"))
+    for sample, *barcodes in args.samples:
+        prefix = os.path.join(args.output_path, f"binned_{sample}")
+        writer = BinWriter(prefix + fastq_ext, prefix + ".csv")
+        for barcode in dict.fromkeys(barcodes):
+            bins.setdefault(barcode, []).append(writer)
+    return bins
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    fastqs = find_files(args.basecalled_path, FASTQ_EXTENSIONS)
+    reports = find_files(args.annotated_path, REPORT_EXTENSIONS.values())
+
+    bins = open_bins(args)
+
+    exported = 0
+    for stem, group in group_reports(reports).items():
+        exported += export_reads(stem, group, fastqs, bins, args.min_read_length, args.max_read_length)
+
+    for writer in set(writer for writers in bins.values() for writer in writers):
+        writer.close()
+    print(f"exported {exported} reads from {len(reports)} reports")
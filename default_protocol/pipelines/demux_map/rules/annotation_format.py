@@ -0,0 +1,226 @@
+import argparse
+import array
+import contextlib
+import json
+import os
+import struct
+import sys
+from operator import itemgetter
+from datetime import datetime, timezone
+
+# The report is written as csv (the default) or, with `--output_format columnar`, as a
+# compact typed column-oriented file (.rac) which RAMPART reads without parsing text.
+#
+# Columnar layout (all numbers little-endian):
+#   4 bytes    magic, b"RAC1"
+#   uint32     length of the json header in bytes
+#   json       {"rows": n, "columns": [{"name", "type", "offset", "length"[, "values"]}, ...]}
+#              (other files in this layout, e.g. the read index, may add fields of their own)
+#   data       the column blocks, "offset" is relative to the start of the data section
+#              and every block starts at a multiple of 8 bytes
+#
+# Column types:
+#   int32      signed 32 bit integers
+#   int64      signed 64 bit integers
+#   time       signed 64 bit epoch seconds, -1 where the read header has no start_time
+#   dict       int32 codes indexing the column's "values" list
+#   lines      utf-8 strings joined by "\n"
+
+MAGIC = b"RAC1"
+
+REPORT_HEADER = "read_name,read_len,start_time,barcode,best_reference,ref_len,start_coords,end_coords,num_matches,mapping_len"
+
+REPORT_EXTENSIONS = {
+    "csv": ".csv",
+    "columnar": ".rac"
+}
+
+# the columns of REPORT_HEADER, the reference option columns follow as type "dict"
+SCHEMA = [
+    ("read_name", "lines"),
+    ("read_len", "int32"),
+    ("start_time", "time"),
+    ("barcode", "dict"),
+    ("best_reference", "dict"),
+    ("ref_len", "int32"),
+    ("start_coords", "int32"),
+    ("end_coords", "int32"),
+    ("num_matches", "int32"),
+    ("mapping_len", "int32")
+]
+
+TYPECODES = {
+    "int32": "i",
+    "int64": "q",
+    "time": "q",
+    "dict": "i"
+}
+
+def parse_start_time(start_time):
+    #epoch seconds of an ISO 8601 start_time, -1 if it is missing ('?') or can't be parsed
+    try:
+        return int(datetime.fromisoformat(start_time.replace("Z", "+00:00")).timestamp())
+    except ValueError:
+        return -1
+
+def format_start_time(seconds):
+    if seconds < 0:
+        return "?"
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def to_bytes(values):
+    if sys.byteorder == "big":
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def from_bytes(typecode, data):
+    values = array.array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+def encode_column(kind, values):
+    #returns the data block of a column and the header entries describing it
+    if kind == "lines":
+        return "\n".join(values).encode(), {}
+    if kind == "dict":
+        codes = dict((value, code) for code, value in enumerate(dict.fromkeys(values)))
+        return to_bytes(array.array("i", map(codes.__getitem__, values))), {"values": list(codes)}
+    if kind == "time":
+        # many reads share the same start_time to the second, so parse each one once
+        times = dict((value, parse_start_time(value)) for value in set(values))
+        return to_bytes(array.array("q", map(times.__getitem__, values))), {}
+    return to_bytes(array.array(TYPECODES[kind], map(int, values))), {}
+
+def decode_column(column, data, rows):
+    block = data[column["offset"]:column["offset"] + column["length"]]
+    if column["type"] == "lines":
+        return block.decode().split("\n") if rows else []
+    values = from_bytes(TYPECODES[column["type"]], block)
+    if column["type"] == "dict":
+        return [column["values"][code] for code in values]
+    return values
+
+class CsvReport:
+    #writes report rows as csv lines to an open file (or io.StringIO)
+
+    def __init__(self, handle, ref_option_header):
+        self.handle = handle
+        self.handle.write(f"{REPORT_HEADER}{ref_option_header}\n")
+
+    def write_row(self, row):
+        self.handle.write(",".join(map(str, row)) + "\n")
+
+    def write_rows(self, rows):
+        self.handle.writelines(",".join(map(str, row)) + "\n" for row in rows)
+
+class ColumnarReport:
+    #keeps the report rows and writes them column by column when closed
+
+    def __init__(self, path, ref_option_header):
+        self.path = path
+        self.schema = SCHEMA + [(field, "dict") for field in ref_option_header.split(",")[1:]]
+        self.rows = []
+
+    def write_row(self, row):
+        self.rows.append(row)
+
+    def write_rows(self, rows):
+        self.rows.extend(rows)
+
+    def close(self):
+        write_columnar(self.path, self.schema, self.rows)
+
+class ReportRows(list):
+    #keeps the report rows in memory, e.g. to return them from a worker process
+
+    def write_row(self, row):
+        self.append(row)
+
+    def write_rows(self, rows):
+        self.extend(rows)
+
+def write_columnar(path, schema, rows, **fields):
+    #writes rows (tuples, one value per (name, type) of schema) column by column. Any extra
+    #fields are added to the json header
+    columns = []
+    blocks = []
+    offset = 0
+    for index, (name, kind) in enumerate(schema):
+        block, entries = encode_column(kind, list(map(itemgetter(index), rows)))
+        padding = -len(block) % 8
+        columns.append(dict(name=name, type=kind, offset=offset, length=len(block), **entries))
+        blocks.append(block + b"\0" * padding)
+        offset += len(block) + padding
+
+    header = json.dumps(dict(fields, rows=len(rows), columns=columns)).encode()
+    with open(str(path), "wb") as fh:
+        fh.write(MAGIC)
+        fh.write(struct.pack("<I", len(header)))
+        fh.write(header)
+        fh.writelines(blocks)
+
+@contextlib.contextmanager
+def open_report(path, output_format, ref_option_header):
+    #with open_report(path, output_format, ref_option_header) as report: report.write_row(row)
+    #The report is written to a temporary name and only moved into place once complete, so
+    #a report at `path` is never a partial one (e.g. after a crash)
+    if output_format not in REPORT_EXTENSIONS:
+        raise ValueError(f"unknown output format '{output_format}'")
+    temporary = str(path) + ".tmp"
+    try:
+        if output_format == "columnar":
+            report = ColumnarReport(temporary, ref_option_header)
+            yield report
+            report.close()
+        else:
+            with open(temporary, "w") as handle:
+                yield CsvReport(handle, ref_option_header)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    os.replace(temporary, str(path))
+
+def read_columnar_header(path):
+    #returns the json header of a columnar file (row count and column descriptions)
+    with open(str(path), "rb") as fh:
+        if fh.read(4) != MAGIC:
+            raise ValueError(f"{path} is not a columnar annotation file")
+        header_length, = struct.unpack("<I", fh.read(4))
+        return json.loads(fh.read(header_length))
+
+def read_columnar(path):
+    #returns the column names and a dict of column name -> values. int32, int64 and time
+    #columns are arrays, dict columns are decoded to lists of strings
+    header = read_columnar_header(path)
+    with open(str(path), "rb") as fh:
+        fh.seek(4)
+        header_length, = struct.unpack("<I", fh.read(4))
+        fh.seek(8 + header_length)
+        data = fh.read()
+
+    names = [column["name"] for column in header["columns"]]
+    return names, dict((column["name"], decode_column(column, data, header["rows"])) for column in header["columns"])
+
+def columnar_csv_lines(path):
+    #yields the lines of the equivalent csv report, header first
+    names, columns = read_columnar(path)
+    columns["start_time"] = [format_start_time(seconds) for seconds in columns["start_time"]]
+    yield ",".join(names) + "\n"
+    for row in zip(*(columns[name] for name in names)):
+        yield ",".join(map(str, row)) + "\n"
+
+def columnar_to_csv(path, out):
+    #writes a columnar report as the equivalent csv report
+    out.writelines(columnar_csv_lines(path))
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Convert a columnar annotation file (.rac) to the csv report.')
+    parser.add_argument("columnar_report", action="store", type=str)
+    args = parser.parse_args()
+
+    columnar_to_csv(args.columnar_report, sys.stdout)
@@ -0,0 +1,216 @@
+import argparse
+import contextlib
+import gzip
+import json
+import os
+import resource
+import sys
+import time
+import yaml
+
+import batch_summary
+from annotation_format import REPORT_EXTENSIONS, open_report
+from demultiplex import BarcodeClassifier, BARCODE_FILE, demultiplex, read_barcodes
+from manifest import MANIFEST_FILENAME, record_report
+from mappy_annotate import annotate_reads, load_aligner
+from parse_paf import HeaderStream, get_header_dict, get_reference_table, print_counts
+from read_index import READ_INDEX_EXTENSION, write_read_index
+from stage_metrics import run_stage, summarise, write_summary
+
+# A long-lived alternative to running the demux_map Snakefile once per FASTQ.
+# The mappy index and the reference option table are built once and kept between jobs.
+#
+# Jobs are read from stdin, one JSON object per line:
+#   {"id": 1, "config": {"input_path": ..., "output_path": ..., "filename_stem": ..., "filename_ext": ..., ...}}
+# where "config" holds the same key/values the Snakefile would get via --config.
+# Each job gets one JSON line on stdout in reply:
+#   {"id": 1, "status": "success", "counts": {...}, "seconds": 1.2}
+#   {"id": 1, "status": "error", "message": "..."}
+# Everything else the job prints goes to stderr.
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Persistent annotation worker for the demux_map pipeline.')
+
+    parser.add_argument("--configfile", action="store", type=str, dest="configfile",
+                        help="pipeline config (yaml) with the default options, as given to snakemake")
+
+    return parser.parse_args()
+
+def porechop_arguments(config):
+    #the options rule `demultiplex_porechop` passes to porechop, see the Snakefile
+    barcode_set = str(config["barcode_set"]).lower()
+    arguments = ["--barcode_labels",
+                 "--barcode_threshold", str(config["barcode_threshold"]),
+                 "--barcode_diff", str(config["barcode_diff"])]
+
+    if barcode_set == "none":
+        # limit to an arbitrary barcode (it will be ignored)
+        arguments += ["--limit_barcodes_to", "1"]
+    elif config.get("limit_barcodes_to"):
+        arguments += ["--limit_barcodes_to"]
+        arguments += [i.lstrip("NB").lstrip("BC").lstrip("barcode") for i in str(config["limit_barcodes_to"]).split(',')]
+
+    if str(config["require_two_barcodes"]).lower() != "false":
+        arguments.append("--require_two_barcodes")
+    if str(config["discard_middle"]).lower() == "true":
+        arguments.append("--discard_middle")
+    if str(config["split_reads"]).lower() != "true":
+        arguments.append("--no_split")
+    if str(config["discard_unassigned"]).lower() == "true":
+        arguments.append("--discard_unassigned")
+
+    if barcode_set == "rapid":
+        arguments.append("--rapid_barcodes")
+    elif barcode_set == "pcr":
+        arguments.append("--pcr_barcodes")
+    elif barcode_set != "all":
+        arguments.append("--native_barcodes")
+
+    return arguments
+
+def classifier_options(config):
+    #the barcode set and porechop options for demultiplex.py, as rule `demultiplex_python` passes them
+    barcode_set = str(config["barcode_set"]).lower()
+    if barcode_set == "none":
+        # limit to an arbitrary barcode (it will be ignored)
+        barcode_set, limit_barcodes_to = "native", (1,)
+    elif config.get("limit_barcodes_to"):
+        limit_barcodes_to = tuple(int(i.lstrip("NB").lstrip("BC").lstrip("barcode")) for i in str(config["limit_barcodes_to"]).split(','))
+    else:
+        limit_barcodes_to = ()
+    return (barcode_set if barcode_set in ("native", "rapid", "pcr") else "all", limit_barcodes_to,
+            float(config["barcode_threshold"]), float(config["barcode_diff"]),
+            str(config["require_two_barcodes"]).lower() != "false")
+
+def in_process_stage(stage, started, inputs):
+    #the metrics of a stage run by the worker itself, as stage_metrics.run_stage records them.
+    #The peak RSS is the worker's so far, including the indexes kept between jobs
+    return {"stage": stage, "started": started, "seconds": time.time() - started,
+            "bytes_read": sum(os.path.getsize(i) for i in inputs),
+            "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+
+def is_demultiplexed(fastq):
+    #as get_demuxed_fastq in the Snakefile, the first header tells us if guppy has added barcodes
+    if fastq.endswith(".gz"):
+        with gzip.open(fastq, "rt") as fh:
+            return "barcode" in fh.readline()
+    with open(fastq) as fh:
+        return "barcode" in fh.readline()
+
+class AnnotationWorker:
+
+    def __init__(self, defaults):
+        self._defaults = defaults
+        self._aligners = {}
+        self._reference_tables = {}
+        self._classifiers = {}
+
+    def _get_aligner(self, references, threads):
+        # rebuilt only if the reference file changes
+        key = (references, os.path.getmtime(references))
+        if key not in self._aligners:
+            print(f"Building index for {references}", file=sys.stderr)
+            self._aligners = {key: load_aligner(references, threads)}
+        return self._aligners[key]
+
+    def _get_reference_table(self, reference_options, references):
+        key = (reference_options, references, os.path.getmtime(references))
+        if key not in self._reference_tables:
+            self._reference_tables[key] = get_reference_table(reference_options, references)
+        return self._reference_tables[key]
+
+    def _get_classifier(self, config):
+        # the barcode index is rebuilt only if the barcode options change
+        key = classifier_options(config)
+        if key not in self._classifiers:
+            barcode_set, limit_barcodes_to, threshold, diff, require_two = key
+            self._classifiers = {key: BarcodeClassifier(read_barcodes(BARCODE_FILE, barcode_set, limit_barcodes_to),
+                                                        threshold, diff, require_two)}
+        return self._classifiers[key]
+
+    def run_job(self, job):
+        config = dict(self._defaults)
+        config.update(job)
+
+        output_path = str(config["output_path"]).rstrip("/")
+        stem = config["filename_stem"]
+        fastq = os.path.join(str(config["input_path"]).rstrip("/"), stem + config.get("filename_ext", ".fastq"))
+        threads = int(config.get("threads", 1))
+        os.makedirs(os.path.join(output_path, "temp"), exist_ok=True)
+
+        aligner = self._get_aligner(config["references_file"], threads)
+        reference_table, ref_option_header = self._get_reference_table(config.get("reference_fields") or "", config["references_file"])
+
+        stages = []
+        demuxed = None
+        if not is_demultiplexed(fastq):
+            # porechop and demultiplex.py read gzipped fastq themselves, so there is no unzip step
+            demuxed = os.path.join(output_path, "temp", stem + "_demuxed.fastq")
+            if str(config.get("demultiplexer", "porechop")).lower() == "python":
+                started = time.time()
+                demultiplex(fastq, demuxed, self._get_classifier(config), threads,
+                            str(config["discard_unassigned"]).lower() == "true")
+                stages.append(in_process_stage("demultiplex", started, [fastq]))
+            else:
+                returncode, stage_metrics = run_stage("demultiplex", ["porechop", "--verbosity", "0", "-i", fastq, "-o", demuxed, "--threads", str(threads)] +
+                                                      porechop_arguments(config), [fastq], stdout=sys.stderr)
+                if returncode != 0:
+                    raise Exception(f"porechop failed with exit code {returncode}")
+                stages.append(stage_metrics)
+
+        try:
+            if demuxed is None:
+                header_dict = None
+            elif config.get("header_join") == "stream":
+                header_dict = HeaderStream(demuxed, int(config.get("header_window", 10000)))
+            else:
+                header_dict = get_header_dict(demuxed)
+
+            started = time.time()
+            output_format = config.get("output_format", "csv")
+            report_path = os.path.join(output_path, stem + REPORT_EXTENSIONS[output_format])
+            with open_report(report_path, output_format, ref_option_header) as report:
+                if str(config.get("summary", "false")).lower() == "true":
+                    report = batch_summary.SummarisedReport(report, int(config.get("summary_bin_width", 10)))
+                counts = annotate_reads(aligner, fastq, report, header_dict, reference_table,
+                                        config.get("minimum_identity") or 0.8, threads)
+            if isinstance(report, batch_summary.SummarisedReport):
+                batch_summary.write_summary(os.path.join(output_path, stem + ".summary.json"), report.summary())
+            stages.append(in_process_stage("mappy", started, [i for i in [fastq, demuxed] if i is not None]))
+        finally:
+            if demuxed is not None and os.path.exists(demuxed):
+                os.remove(demuxed)
+
+        if str(config.get("index_reads", "false")).lower() == "true":
+            write_read_index(fastq, report_path, os.path.join(output_path, stem + READ_INDEX_EXTENSION))
+
+        if str(config.get("metrics", "false")).lower() == "true":
+            write_summary(os.path.join(output_path, stem + ".metrics.json"), summarise(stages, stem, fastq, report_path))
+        # as the Snakefile does once the report is complete
+        record_report(fastq, report_path, config.get("manifest") or os.path.join(output_path, MANIFEST_FILENAME))
+        print_counts(counts)
+        return counts
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    defaults = {}
+    if args.configfile:
+        with open(args.configfile) as fh:
+            defaults = yaml.safe_load(fh)
+
+    worker = AnnotationWorker(defaults)
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        job = json.loads(line)
+        start = time.time()
+        try:
+            with contextlib.redirect_stdout(sys.stderr):
+                counts = worker.run_job(job["config"])
+            response = {"id": job.get("id"), "status": "success", "counts": counts, "seconds": time.time() - start}
+        except Exception as err:
+            response = {"id": job.get("id"), "status": "error", "message": str(err)}
+        print(json.dumps(response), flush=True)
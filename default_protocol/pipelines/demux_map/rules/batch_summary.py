@@ -0,0 +1,181 @@
+import argparse
+import json
+import os
+import sys
+from collections import Counter, defaultdict
+from operator import itemgetter
+
+# With --summary the annotation scripts also write a summary of the batch, counted from the
+# report rows as they are written (SummarisedReport), so RAMPART can add a batch to its
+# per-sample statistics without going through every read again:
+#
+#   {"bin_width": 10, "length_bin": 10, "identity_bins": 100,
+#    "reference_lengths": {reference: length},
+#    "counts": {
+#      "reads": n,
+#      "read_lengths": {barcode: [...]},            reads with read_len // length_bin == i
+#      "mapped_read_lengths": {barcode: [...]},     the same for reads with a best_reference
+#      "reference_counts": {barcode: {reference: n}},
+#      "identity": {reference: [...]},              num_matches / mapping_len in identity_bins bins over [0, 1]
+#      "coverage": {barcode: {reference: [...]}}    difference array of reads over bin_width bins
+#    }}
+#
+# A coverage array has one entry per bin_width bases of the reference: the number of reads
+# starting in that bin minus the number which ended in an earlier one, i.e. np.cumsum(array)
+# is the number of reads overlapping each bin. Everything in "counts" is a sum over reads, so
+# the summaries of two batches (with the same bin sizes) are merged by adding them, key by key
+# and element-wise (a shorter read length array is padded with zeros), see merge_summaries.
+#
+# The counts don't use NumPy on purpose. Each row adds 1 to a few bins as it is written, and a
+# Counter increment costs less than indexing a NumPy array for a single element. Counting the
+# rows with NumPy would mean keeping them until the end of the batch (as the summary once
+# did), so memory grew with the batch. The Counters become lists only once, in summary().
+
+# read_len, barcode, best_reference, ref_len, start_coords, end_coords, num_matches, mapping_len
+SUMMARY_COLUMNS = itemgetter(1, 3, 4, 5, 6, 7, 8, 9)
+
+UNMAPPED = ("*", "?")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Merge batch summaries written by parse_paf.py --summary.')
+
+    parser.add_argument("summaries", nargs="+", action="store", type=str)
+    parser.add_argument("--output", action="store", type=str, dest="output",
+                        help="write the merged summary here instead of stdout")
+
+    return parser.parse_args()
+
+class SummarisedReport:
+    #passes report rows on to `report` and adds each row to the counts of the summary as it is
+    #written, so the memory used doesn't grow with the number of reads (only with the number of
+    #barcodes and references). summary() returns the summary of the rows written so far
+
+    def __init__(self, report, bin_width=10, length_bin=10, identity_bins=100):
+        self.report = report
+        self.bin_width = bin_width
+        self.length_bin = length_bin
+        self.identity_bins = identity_bins
+        self.reads = 0
+        # {barcode: Counter of read_len // length_bin}
+        self.read_lengths = defaultdict(Counter)
+        self.mapped_read_lengths = defaultdict(Counter)
+        # {barcode: Counter of best_reference}
+        self.reference_counts = defaultdict(Counter)
+        # {reference: ref_len} and {reference: [identity_bins counts]}, of the references with an alignment
+        self.reference_lengths = {}
+        self.identity = {}
+        # {(barcode, reference): coverage difference array, with an extra last bin for the reads ending at the end}
+        self.coverage = {}
+
+    def write_row(self, row):
+        self.report.write_row(row)
+        self.add_row(row)
+
+    def write_rows(self, rows):
+        self.report.write_rows(rows)
+        for row in rows:
+            self.add_row(row)
+
+    def add_row(self, row):
+        read_len, barcode, reference, ref_len, start, end, matches, mapping_len = SUMMARY_COLUMNS(row)
+        barcode, reference = str(barcode), str(reference)
+        length_bin = int(read_len) // self.length_bin
+        self.reads += 1
+        self.read_lengths[barcode][length_bin] += 1
+        self.reference_counts[barcode][reference] += 1
+        mapped_read_lengths = self.mapped_read_lengths[barcode]
+        if reference in UNMAPPED:
+            return
+        mapped_read_lengths[length_bin] += 1
+
+        # identity and coverage are only kept for reads with a best_reference (and an alignment)
+        start, end, matches, mapping_len = int(start), int(end), int(matches), int(mapping_len)
+        if end <= start or mapping_len <= 0:
+            return
+        if reference not in self.reference_lengths:
+            self.reference_lengths[reference] = int(ref_len)
+            self.identity[reference] = [0] * self.identity_bins
+        self.identity[reference][min((matches * self.identity_bins) // mapping_len, self.identity_bins - 1)] += 1
+
+        coverage = self.coverage.get((barcode, reference))
+        if coverage is None:
+            bin_count = -(-self.reference_lengths[reference] // self.bin_width)
+            coverage = self.coverage[(barcode, reference)] = [0] * (bin_count + 1)
+        last = len(coverage) - 1
+        coverage[min(start // self.bin_width, last)] += 1
+        # the bin after the last base of the alignment (paf end coordinates are exclusive)
+        coverage[min((end - 1) // self.bin_width + 1, last)] -= 1
+
+    def summary(self):
+        #returns the summary of the rows written, the barcodes and references in sorted order
+        barcodes = sorted(self.read_lengths)
+        coverage = {}
+        for (barcode, reference), differences in sorted(self.coverage.items()):
+            coverage.setdefault(barcode, {})[reference] = differences[:-1]
+        return {
+            "bin_width": self.bin_width,
+            "length_bin": self.length_bin,
+            "identity_bins": self.identity_bins,
+            "reference_lengths": dict(sorted(self.reference_lengths.items())),
+            "counts": {
+                "reads": self.reads,
+                "read_lengths": dict((barcode, counter_array(self.read_lengths[barcode])) for barcode in barcodes),
+                "mapped_read_lengths": dict((barcode, counter_array(self.mapped_read_lengths[barcode])) for barcode in barcodes),
+                "reference_counts": dict((barcode, dict(sorted(self.reference_counts[barcode].items()))) for barcode in barcodes),
+                "identity": dict(sorted(self.identity.items())),
+                "coverage": coverage
+            }
+        }
+
+def counter_array(counter):
+    #[counter[0], counter[1], ...] up to the largest key, as np.bincount
+    return [counter[i] for i in range(max(counter) + 1)] if counter else []
+
+def add_counts(a, b):
+    #adds two "counts" values: numbers, arrays (element-wise, zero padded) or dicts of these
+    if isinstance(a, dict):
+        merged = dict(a)
+        for key, value in b.items():
+            merged[key] = add_counts(merged[key], value) if key in merged else value
+        return merged
+    if isinstance(a, list):
+        if len(a) < len(b):
+            a, b = b, a
+        return [x + y for x, y in zip(a, b)] + a[len(b):]
+    return a + b
+
+def merge_summaries(summaries):
+    #returns the summary of all the given batches
+    merged = None
+    for summary in summaries:
+        if merged is None:
+            merged = summary
+            continue
+        for key in ("bin_width", "length_bin", "identity_bins"):
+            if summary[key] != merged[key]:
+                raise ValueError(f"can't merge summaries with a different {key} ({summary[key]} and {merged[key]})")
+        merged = dict(merged,
+                      reference_lengths=dict(merged["reference_lengths"], **summary["reference_lengths"]),
+                      counts=add_counts(merged["counts"], summary["counts"]))
+    return merged
+
+def write_summary(path, summary):
+    #written to a temporary name and moved into place once complete
+    with open(str(path) + ".tmp", "w") as fh:
+        json.dump(summary, fh)
+    os.replace(str(path) + ".tmp", str(path))
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    summaries = []
+    for path in args.summaries:
+        with open(path) as fh:
+            summaries.append(json.load(fh))
+    merged = merge_summaries(summaries)
+
+    if args.output:
+        write_summary(args.output, merged)
+    else:
+        json.dump(merged, sys.stdout)
@@ -0,0 +1,45 @@
+checkpoint split_reads:
+    """
+    With config `chunk_reads`, splits the FASTQ into parts of `chunk_reads` reads
+    ({filename_stem}.partNNN.fastq, see rules/split_reads.py) which are annotated separately.
+    """
+    input:
+        config["input_path"] + "/{filename_stem}" + config["filename_ext"]
+    params:
+        path_to_script = workflow.current_basedir,
+        reads_per_part = chunk_reads
+    output:
+        temp(directory(config["output_path"] + "/temp/{filename_stem}.parts"))
+    shell:
+        """
+        python {params.path_to_script}/split_reads.py \
+        --fastq {input:q} \
+        --reads_per_part {params.reads_per_part} \
+        --output {output:q}
+        """
+
+def get_part_reports(wildcards):
+    """
+        The reports of the parts of the FASTQ, known once `split_reads` has run.
+    """
+    parts = checkpoints.split_reads.get(filename_stem=wildcards.filename_stem).output[0]
+    return expand(config["output_path"] + "/{part}" + report_ext,
+                  part=sorted(glob_wildcards(parts + "/{part}.fastq").part))
+
+rule complete_parts:
+    """
+    Writes the marker {filename_stem}.complete once the report of every part of the FASTQ is done.
+    """
+    input:
+        parts = config["output_path"] + "/temp/{filename_stem}.parts",
+        reports = get_part_reports
+    params:
+        path_to_script = workflow.current_basedir
+    output:
+        config["output_path"] + "/{filename_stem}.complete"
+    shell:
+        """
+        python {params.path_to_script}/split_reads.py \
+        --reports {input.reports:q} \
+        --complete {output:q}
+        """
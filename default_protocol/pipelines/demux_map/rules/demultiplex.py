@@ -0,0 +1,253 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import re
+
+from fastq_files import open_reads
+
+# An in-process alternative to porechop for labelling reads with their barcode (config
+# `demultiplexer: python`). It takes porechop's barcode options and writes the same fastq
+# with " barcode=NB01" (or " barcode=none") added to each header.
+#
+# Only the first and last `end_size` bases of a read are searched. Each barcode (and its
+# reverse complement) is indexed by its k-mers once, so for a read end only the barcodes
+# sharing a k-mer with it are aligned, with a bit-parallel edit distance search (Myers 1999)
+# of the whole barcode against the part of the read around the k-mer hits. The identity of a
+# barcode is 100 * (1 - edit distance / barcode length), a barcode without a k-mer hit at a
+# read end counts as 0 there.
+#
+# Unlike porechop, adapters are not trimmed and reads are not split or discarded for middle
+# adapters, only the header is changed.
+
+BARCODE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "barcodes.fasta")
+
+COMPLEMENT = str.maketrans("ACGT", "TGCA")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Label the reads of a fastq with their barcode.')
+
+    parser.add_argument("-i", "--input", action="store", type=str, dest="reads")
+    parser.add_argument("-o", "--output", action="store", type=str, dest="output",
+                        help="labelled fastq, or only its header lines if the name ends with .headers")
+    parser.add_argument("--threads", default=1, action="store", type=int, dest="threads")
+
+    parser.add_argument("--barcode_file", default=BARCODE_FILE, action="store", type=str, dest="barcode_file",
+                        help="fasta of the barcodes, the `set=` field of each header lists the barcode sets it belongs to")
+    parser.add_argument("--native_barcodes", action="store_const", const="native", dest="barcode_set", default="all")
+    parser.add_argument("--rapid_barcodes", action="store_const", const="rapid", dest="barcode_set")
+    parser.add_argument("--pcr_barcodes", action="store_const", const="pcr", dest="barcode_set")
+    parser.add_argument("--limit_barcodes_to", nargs="+", default=[], action="store", type=int, dest="limit_barcodes_to",
+                        help="numbers of the barcodes to look for, e.g. 1 2 for NB01 and NB02")
+
+    parser.add_argument("--barcode_threshold", default=75.0, action="store", type=float, dest="barcode_threshold")
+    parser.add_argument("--barcode_diff", default=5.0, action="store", type=float, dest="barcode_diff")
+    parser.add_argument("--require_two_barcodes", action="store_true", dest="require_two_barcodes")
+    parser.add_argument("--discard_unassigned", action="store_true", dest="discard_unassigned")
+
+    parser.add_argument("--end_size", default=150, action="store", type=int, dest="end_size",
+                        help="number of bases at each end of a read searched for barcodes")
+    parser.add_argument("--kmer", default=6, action="store", type=int, dest="kmer",
+                        help="k-mer length of the barcode index")
+
+    return parser.parse_args()
+
+def reverse_complement(sequence):
+    return sequence.translate(COMPLEMENT)[::-1]
+
+def read_barcodes(barcode_file, barcode_set="all", limit_barcodes_to=()):
+    #returns {name: sequence} of the barcodes in `barcode_set` ("all" for every set), only
+    #those numbered in `limit_barcodes_to` if it is given (NB01 is number 1)
+    barcodes = {}
+    name = None
+    with open(barcode_file) as fh:
+        for line in fh:
+            line = line.strip()
+            if line.startswith(">"):
+                fields = line[1:].split()
+                sets = dict(field.split("=", 1) for field in fields[1:] if "=" in field).get("set", "").split(",")
+                number = re.search(r"(\d+)$", fields[0])
+                if (barcode_set == "all" or barcode_set in sets) and \
+                        (not limit_barcodes_to or (number and int(number.group(1)) in limit_barcodes_to)):
+                    name = fields[0]
+                    barcodes[name] = ""
+                else:
+                    name = None
+            elif name is not None:
+                barcodes[name] += line.upper()
+    return barcodes
+
+class Pattern:
+    #a barcode sequence prepared for the bit-parallel search, bit i of peq[base] is set
+    #if the barcode has that base at position i
+
+    def __init__(self, sequence):
+        self.length = len(sequence)
+        self.peq = {}
+        for i, base in enumerate(sequence):
+            self.peq[base] = self.peq.get(base, 0) | (1 << i)
+
+def search_distance(pattern, text):
+    #the smallest edit distance between the whole pattern and any part of the text
+    #(Myers' bit-vector algorithm, one column of the alignment matrix per base of text)
+    peq = pattern.peq
+    mask = (1 << pattern.length) - 1
+    high = 1 << (pattern.length - 1)
+    pv, mv = mask, 0
+    score = best = pattern.length
+    for base in text:
+        eq = peq.get(base, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+            if score < best:
+                best = score
+        # no carry into the first row, the alignment may start anywhere in the text
+        ph = (ph << 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+    return best
+
+class BarcodeClassifier:
+    #assigns reads to barcodes following porechop's rules: the best barcode must reach
+    #`threshold` % identity and beat the second best by `diff`, at both read ends if
+    #`require_two` is set (and the same barcode at both), otherwise at either end
+
+    def __init__(self, barcodes, threshold=75.0, diff=5.0, require_two=False, end_size=150, kmer=6):
+        self.names = list(barcodes)
+        self.threshold = threshold
+        self.diff = diff
+        self.require_two = require_two
+        self.end_size = end_size
+        self.kmer = kmer
+
+        # both strands of each barcode, and the patterns each k-mer occurs in
+        self.patterns = []
+        index = {}
+        for number, name in enumerate(self.names):
+            for sequence in (barcodes[name], reverse_complement(barcodes[name])):
+                for i in range(len(sequence) - kmer + 1):
+                    index.setdefault(sequence[i:i + kmer], set()).add(len(self.patterns))
+                self.patterns.append((number, Pattern(sequence)))
+        self.index = dict((seed, tuple(patterns)) for seed, patterns in index.items())
+
+    def end_identities(self, window):
+        #returns the percent identity of each barcode (on either strand) in the window
+        index, kmer = self.index, self.kmer
+        hits = {}
+        for i in range(len(window) - kmer + 1):
+            patterns = index.get(window[i:i + kmer])
+            if patterns:
+                for pattern in patterns:
+                    if pattern in hits:
+                        hits[pattern][1] = i
+                    else:
+                        hits[pattern] = [i, i]
+
+        identities = [0.0] * len(self.names)
+        for pattern, (first, last) in hits.items():
+            number, barcode = self.patterns[pattern]
+            length = barcode.length
+            distance = search_distance(barcode, window[max(0, first - length):last + kmer + length])
+            identity = 100.0 * (length - distance) / length
+            if identity > identities[number]:
+                identities[number] = identity
+        return identities
+
+    def best_barcode(self, identities):
+        #the number of the best barcode, or None if it is below the threshold or too close to the next
+        best = max(range(len(identities)), key=identities.__getitem__)
+        second = max(identities[:best] + identities[best + 1:], default=0.0)
+        if identities[best] >= self.threshold and identities[best] - second >= self.diff:
+            return best
+        return None
+
+    def classify(self, sequence):
+        #returns the barcode name of the read, or "none"
+        if not self.names:
+            return "none"
+        start = self.end_identities(sequence[:self.end_size])
+        if self.require_two:
+            best = self.best_barcode(start)
+            # the end is only searched if the start has a barcode
+            if best is None or best != self.best_barcode(self.end_identities(sequence[-self.end_size:])):
+                return "none"
+        else:
+            end = self.end_identities(sequence[-self.end_size:])
+            best = self.best_barcode([max(identities) for identities in zip(start, end)])
+            if best is None:
+                return "none"
+        return self.names[best]
+
+def read_fastq(reads):
+    #yields the four lines of each fastq record
+    with open_reads(reads) as f:
+        while True:
+            record = list(itertools.islice(f, 4))
+            if not record:
+                return
+            yield record
+
+# set in each worker process by init_worker
+worker_state = {}
+
+def init_worker(classifier, headers_only, discard_unassigned):
+    worker_state["classifier"] = classifier
+    worker_state["headers_only"] = headers_only
+    worker_state["discard_unassigned"] = discard_unassigned
+
+def label_records(records):
+    #returns the labelled records as text and the number of reads per barcode
+    classifier = worker_state["classifier"]
+    lines = []
+    counts = {}
+    for record in records:
+        barcode = classifier.classify(record[1].rstrip())
+        counts[barcode] = counts.get(barcode, 0) + 1
+        if barcode == "none" and worker_state["discard_unassigned"]:
+            continue
+        lines.append(f"{record[0].rstrip()} barcode={barcode}\n")
+        if not worker_state["headers_only"]:
+            lines.extend(record[1:])
+    return "".join(lines), counts
+
+def demultiplex(reads, output, classifier, threads=1, discard_unassigned=False, chunk_size=1000):
+    #labels every read of the fastq, in the original order, and returns the number of reads per barcode
+    initargs = (classifier, str(output).endswith(".headers"), discard_unassigned)
+    records = read_fastq(reads)
+    chunks = iter(lambda: list(itertools.islice(records, chunk_size)), [])
+
+    pool = None
+    if threads > 1:
+        pool = multiprocessing.Pool(threads, initializer=init_worker, initargs=initargs)
+        labelled = pool.imap(label_records, chunks)
+    else:
+        init_worker(*initargs)
+        labelled = map(label_records, chunks)
+
+    counts = {}
+    with open(str(output), "w") as out:
+        for text, chunk_counts in labelled:
+            out.write(text)
+            for barcode, count in chunk_counts.items():
+                counts[barcode] = counts.get(barcode, 0) + count
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return counts
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    barcodes = read_barcodes(args.barcode_file, args.barcode_set, args.limit_barcodes_to)
+    classifier = BarcodeClassifier(barcodes, args.barcode_threshold, args.barcode_diff, args.require_two_barcodes,
+                                   args.end_size, args.kmer)
+    demultiplex(args.reads, args.output, classifier, args.threads, args.discard_unassigned)
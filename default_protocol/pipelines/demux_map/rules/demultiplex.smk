@@ -1,3 +1,14 @@
+porechop_params = dict(
+    require_two_barcodes=require_two_barcodes,
+    discard_middle=discard_middle,
+    split_reads=split_reads,
+    discard_unassigned=discard_unassigned,
+    barcode_option = barcode_set,
+    limit_barcodes_to = limit_barcodes_to,
+    threshold = "--barcode_threshold " + str(config["barcode_threshold"]),
+    diff = "--barcode_diff " + str(config["barcode_diff"])
+)
+
 rule demultiplex_porechop:
     """
         Create a FASTQ with barcode information appended to the header using porechop
@@ -5,20 +16,14 @@ rule demultiplex_porechop:
     input:
         get_unzipped_fastq
     params:
-        require_two_barcodes=require_two_barcodes,
-        discard_middle=discard_middle,
-        split_reads=split_reads,
-        discard_unassigned=discard_unassigned,
-        barcode_option = barcode_set,
-        limit_barcodes_to = limit_barcodes_to,
-        threshold = "--barcode_threshold " + str(config["barcode_threshold"]),
-        diff = "--barcode_diff " + str(config["barcode_diff"])
+        metrics = stage_metrics("demultiplex"),
+        **porechop_params
     threads: config["threads"]
     output:
         temp(config["output_path"] + "/temp/{filename_stem}_demuxed.fastq")
     shell:
         """
-        porechop \
+        {params.metrics} porechop \
         --verbosity 0 \
         -i {input:q} \
         -o {output:q} \
@@ -35,6 +40,106 @@ rule demultiplex_porechop:
         """
 
 
+rule demultiplex_porechop_headers:
+    """
+        Streaming alternative to `demultiplex_porechop` (config `stream_gzip`). Porechop reads the
+        gzipped FASTQ itself and writes the reads to stdout, where only the (barcoded) headers are
+        kept. `parse_mapping` needs nothing else, so no uncompressed reads are written to disk.
+    """
+    input:
+        get_unzipped_fastq
+    params:
+        metrics = stage_metrics("demultiplex"),
+        **porechop_params
+    threads: config["threads"]
+    output:
+        temp(config["output_path"] + "/temp/{filename_stem}_demuxed.headers")
+    shell:
+        """
+        {params.metrics} porechop \
+        --verbosity 0 \
+        -i {input:q} \
+        --threads {threads} \
+        --barcode_labels \
+        {params.threshold} \
+        {params.diff}\
+        {params.limit_barcodes_to}\
+        {params.require_two_barcodes}\
+        {params.discard_middle}\
+        {params.split_reads} \
+        {params.discard_unassigned}\
+        {params.barcode_option} \
+        | awk 'NR % 4 == 1' > {output:q}
+        """
+
+
+rule demultiplex_python:
+    """
+        Alternative to `demultiplex_porechop` (config `demultiplexer: python`). Labels the reads
+        with the same barcode= header annotation using rules/demultiplex.py, which searches only
+        the read ends with a k-mer index of the barcode set. Reads are not trimmed or split.
+    """
+    input:
+        get_unzipped_fastq
+    params:
+        path_to_script = workflow.current_basedir,
+        metrics = stage_metrics("demultiplex"),
+        **porechop_params
+    threads: config["threads"]
+    output:
+        temp(config["output_path"] + "/temp/{filename_stem}_demuxed.fastq")
+    shell:
+        """
+        {params.metrics} python {params.path_to_script}/demultiplex.py \
+        -i {input:q} \
+        -o {output:q} \
+        --threads {threads} \
+        {params.threshold} \
+        {params.diff}\
+        {params.limit_barcodes_to}\
+        {params.require_two_barcodes}\
+        {params.discard_unassigned}\
+        {params.barcode_option}
+        """
+
+
+rule demultiplex_python_headers:
+    """
+        As `demultiplex_python` for config `stream_gzip`: reads the gzipped FASTQ directly and
+        writes only the (barcoded) headers.
+    """
+    input:
+        get_unzipped_fastq
+    params:
+        path_to_script = workflow.current_basedir,
+        metrics = stage_metrics("demultiplex"),
+        **porechop_params
+    threads: config["threads"]
+    output:
+        temp(config["output_path"] + "/temp/{filename_stem}_demuxed.headers")
+    shell:
+        """
+        {params.metrics} python {params.path_to_script}/demultiplex.py \
+        -i {input:q} \
+        -o {output:q} \
+        --threads {threads} \
+        {params.threshold} \
+        {params.diff}\
+        {params.limit_barcodes_to}\
+        {params.require_two_barcodes}\
+        {params.discard_unassigned}\
+        {params.barcode_option}
+        """
+
+# porechop and the python rules make the same files, `demultiplexer` decides which ones run
+if demultiplexer == "python":
+    ruleorder: demultiplex_python > demultiplex_porechop
+    ruleorder: demultiplex_python_headers > demultiplex_porechop_headers
+else:
+    ruleorder: demultiplex_porechop > demultiplex_python
+    ruleorder: demultiplex_porechop_headers > demultiplex_python_headers
+
+
 def get_demuxed_fastq(wildcards):
     """
         For the fastq in question (gotten via wildcards), has it already been
@@ -48,6 +153,14 @@ def get_demuxed_fastq(wildcards):
 
     # There is a better way to do this -- we want to force the `unzip` rule to run if necessary
     # But, alas, snakemake is beyond me somethimes
+    if split_part(wildcards.filename_stem)[1] is not None:
+        # a part (config `chunk_reads`) is always an uncompressed fastq, so is never streamed
+        with open(expand(get_unzipped_fastq(wildcards), filename_stem=wildcards.filename_stem)[0]) as fh:
+            line1 = fh.readline()
+        if "barcode" in line1:
+            return get_unzipped_fastq(wildcards)
+        return config["output_path"] + "/temp/{filename_stem}_demuxed.fastq"
+
     if config["filename_ext"] == ".fastq.gz":
         import gzip
         with gzip.open(expand(config["input_path"] + "/{filename_stem}.fastq.gz", filename_stem=wildcards.filename_stem)[0], 'rb') as fh:
@@ -56,6 +169,13 @@ def get_demuxed_fastq(wildcards):
         with open(expand(config["input_path"] + "/{filename_stem}.fastq", filename_stem=wildcards.filename_stem)[0]) as fh:
             line1 = fh.readline()
 
+    if stream_gzip:
+        if "barcode" in line1 and mapper == "mappy":
+            return get_unzipped_fastq(wildcards)
+        if "barcode" in line1:
+            return config["output_path"] + "/temp/{filename_stem}.headers" # rule `minimap2_stream` keeps these
+        return config["output_path"] + "/temp/{filename_stem}_demuxed.headers" # rule `demultiplex_porechop_headers` will make this
+
     if "barcode" in line1:
         return get_unzipped_fastq(wildcards)
 
@@ -0,0 +1,10 @@
+import gzip
+
+# Opening the FASTQs, shared by the scripts which read them as text (parse_paf.py,
+# demultiplex.py, reference_sketch.py) so the ones that don't need Biopython don't import it.
+
+def open_reads(reads):
+    #opens a (possibly gzipped) fastq for reading as text
+    if str(reads).endswith(".gz"):
+        return gzip.open(str(reads), "rt")
+    return open(str(reads), "r")
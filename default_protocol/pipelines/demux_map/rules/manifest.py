@@ -0,0 +1,56 @@
+import argparse
+import json
+import os
+import time
+
+from reference_headers import checksum, file_stamp
+from stage_metrics import count_reads
+
+# The run manifest (config `manifest`, by default {output_path}/manifest.jsonl) has one json line
+# per annotated FASTQ, appended once its report is complete:
+#   {"fastq": ..., "size": ..., "mtime_ns": ..., "reads": ..., "report": ..., "sha1": ..., "time": ...}
+# "fastq" is the absolute path of the FASTQ, with its size and modification time when it was
+# annotated, "report" the path of the report relative to the manifest with the number of reads in
+# it and its sha1. When RAMPART restarts on an annotated folder (server/startUp.js) only reports
+# with an entry that still matches both the report and the FASTQ are kept, the other FASTQs are
+# annotated again. A later entry for the same report replaces the earlier ones.
+
+MANIFEST_FILENAME = "manifest.jsonl"
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Record an annotated FASTQ in the run manifest.')
+
+    parser.add_argument("--fastq", action="store", type=str, dest="fastq")
+    parser.add_argument("--report", action="store", type=str, dest="report")
+    parser.add_argument("--manifest", action="store", type=str, dest="manifest")
+
+    return parser.parse_args()
+
+def manifest_entry(fastq, report, manifest):
+    entry = {"fastq": os.path.abspath(str(fastq))}
+    entry.update(file_stamp(fastq))
+    entry["reads"] = count_reads(str(report))
+    entry["report"] = os.path.relpath(os.path.abspath(str(report)), os.path.dirname(os.path.abspath(str(manifest))))
+    entry["sha1"] = checksum(report)
+    entry["time"] = time.time()
+    return entry
+
+def append_to_manifest(manifest, entry):
+    # one write of one line to a file opened for appending, so batches finishing at the same
+    # time don't interleave, synced so an entry is never recorded ahead of its report
+    os.makedirs(os.path.dirname(os.path.abspath(str(manifest))), exist_ok=True)
+    fd = os.open(str(manifest), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (json.dumps(entry) + "\n").encode())
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def record_report(fastq, report, manifest):
+    append_to_manifest(manifest, manifest_entry(fastq, report, manifest))
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    record_report(args.fastq, args.report, args.manifest)
@@ -1,3 +1,116 @@
+import json
+import os
+
+checkpoint reference_checksum:
+    """
+    Content hash (sha1) of the reference panel, which its minimap2 index, header fields and
+    sketches are named after (see `get_reference_index`). Run again only when the panel changes.
+    """
+    input:
+        config["references_file"]
+    params:
+        path_to_script = workflow.current_basedir
+    priority: 3
+    output:
+        config.get("index_path", config["output_path"] + "/index").rstrip("/") + "/checksums.json"
+    shell:
+        """
+        python {params.path_to_script}/reference_headers.py \
+        --reference_file {input:q} \
+        --checksum {output:q}
+        """
+
+def get_reference_checksum():
+    """
+        The sha1 of the reference panel written by checkpoint `reference_checksum`, so only
+        input functions (which snakemake calls once the checkpoint has run) can use it.
+    """
+    with open(checkpoints.reference_checksum.get().output[0]) as fh:
+        return json.load(fh)["sha1"]
+
+def get_reference_index(wildcards):
+    """
+        The minimap2 index (.mmi) used by rule `minimap2`. It is named after the content hash
+        of the reference panel and the preset, so it is built once (rule `index_references`)
+        and then reused by every batch and across RAMPART restarts.
+    """
+    if str(config.get("index_references", "true")).lower() != "true":
+        return config["references_file"]
+    index_dir = config.get("index_path", config["output_path"] + "/index").rstrip("/")
+    checksum = get_reference_checksum()
+    name = os.path.splitext(os.path.basename(config["references_file"]))[0]
+    return f"{index_dir}/{name}.{checksum[:16]}.map-ont.mmi"
+
+def get_reference_headers(wildcards):
+    """
+        The saved header fields of the reference panel (rule `index_reference_headers`), named
+        like the minimap2 index. Only needed if `reference_fields` are reported, an empty list
+        (the scripts then read the reference file itself) if not or if `index_references` is off.
+    """
+    if not reference_fields or str(config.get("index_references", "true")).lower() != "true":
+        return []
+    index_dir = config.get("index_path", config["output_path"] + "/index").rstrip("/")
+    checksum = get_reference_checksum()
+    name = os.path.splitext(os.path.basename(config["references_file"]))[0]
+    return f"{index_dir}/{name}.{checksum[:16]}.headers.json"
+
+
+def get_reference_sketch(wildcards):
+    """
+        The sketches of the reference panel (rule `sketch_references`, see rules/reference_sketch.py)
+        used by config `prefilter`. Named like the minimap2 index, and after the k-mer size and
+        scale, so they are made once for the panel and then reused by every batch.
+    """
+    index_dir = config.get("index_path", config["output_path"] + "/index").rstrip("/")
+    checksum = get_reference_checksum()
+    name = os.path.splitext(os.path.basename(config["references_file"]))[0]
+    return f"{index_dir}/{name}.{checksum[:16]}.k{prefilter_kmer_size}.s{prefilter_scaled}.sketch"
+
+def get_mapping_reference(wildcards):
+    """
+        What rules `minimap2` and `map_and_annotate` map against: with config `prefilter` the
+        sub-panel picked for the batch (rule `select_references`), otherwise the whole panel.
+    """
+    if prefilter:
+        return config["output_path"] + "/temp/{filename_stem}.subpanel.fasta"
+    return get_reference_index(wildcards)
+
+
+rule index_references:
+    """
+    Builds the minimap2 index of the reference panel (see `get_reference_index`).
+    The index is written to a temporary name and moved into place once complete.
+    """
+    input:
+        config["references_file"]
+    priority: 3
+    output:
+        config.get("index_path", config["output_path"] + "/index").rstrip("/") + "/{name}.{checksum}.map-ont.mmi"
+    threads: config["threads"]
+    shell:
+        """
+        minimap2 -t {threads} -x map-ont -d {output:q}.tmp {input:q} && mv {output:q}.tmp {output:q}
+        """
+
+rule index_reference_headers:
+    """
+    Saves the header fields and sequence lengths of the reference panel (see `get_reference_headers`)
+    so `parse_mapping` doesn't parse the whole reference file for every batch.
+    """
+    input:
+        config["references_file"]
+    params:
+        path_to_script = workflow.current_basedir
+    priority: 3
+    output:
+        config.get("index_path", config["output_path"] + "/index").rstrip("/") + "/{name}.{checksum}.headers.json"
+    shell:
+        """
+        python {params.path_to_script}/reference_headers.py \
+        --reference_file {input:q} \
+        --output {output:q}
+        """
+
 rule minimap2:
     """
     This rule takes the FASTQ and maps it to the reference panel.
@@ -6,13 +119,16 @@ rule minimap2:
     """
     input:
         fastq=get_unzipped_fastq,
-        ref= config["references_file"]
+        ref=get_mapping_reference
+    params:
+        metrics = stage_metrics("minimap2")
+    priority: 1
     output:
         temp(config["output_path"] + "/temp/{filename_stem}.paf")
     threads: config["threads"]
     shell:
         """
-        minimap2 -t {threads} -x map-ont \
+        {params.metrics} minimap2 -t {threads} -x map-ont \
         --secondary=no \
         --paf-no-hit \
         --cs \
@@ -24,10 +140,56 @@ rule minimap2:
 #read and writes all reads, even if they don't have a hit (no hit written as ``*`` in paf file)
 
 
+rule minimap2_stream:
+    """
+    Streaming alternative to rule `minimap2` for gzipped input (config `stream_gzip`).
+    tee_fastq_headers.py decompresses the FASTQ, pipes the reads to minimap2 and keeps only the
+    read headers, for `parse_mapping` when guppy has added the barcodes (and with `index_reads`
+    the offsets of the reads, for rule `index_reads`). Reads without barcodes are decompressed
+    a second time by `demultiplex_*_headers`, so the FASTQ is only decompressed once when it is
+    already barcoded.
+    """
+    input:
+        fastq=config["input_path"] + "/{filename_stem}.fastq.gz",
+        ref=get_mapping_reference
+    params:
+        path_to_script = workflow.current_basedir,
+        metrics = stage_metrics("minimap2"),
+        offsets = offsets_argument
+    priority: 1
+    output:
+        paf=temp(config["output_path"] + "/temp/{filename_stem}.paf"),
+        headers=temp(config["output_path"] + "/temp/{filename_stem}.headers"),
+        **read_offsets_output()
+    threads: config["threads"]
+    shell:
+        """
+        python {params.path_to_script}/tee_fastq_headers.py \
+        --input {input.fastq:q} \
+        --headers {output.headers:q} \
+        {params.offsets} \
+        | {params.metrics} minimap2 -t {threads} -x map-ont \
+        --secondary=no \
+        --paf-no-hit \
+        --cs \
+        {input.ref:q} \
+        - > {output.paf:q}
+        """
+
+# Both `minimap2` and `minimap2_stream` produce the paf, `stream_gzip` decides which one runs
+# (and whether `minimap2_stream` or `unzip` writes the read offsets for `index_reads`)
+if stream_gzip:
+    ruleorder: minimap2_stream > minimap2
+    ruleorder: minimap2_stream > unzip
+else:
+    ruleorder: minimap2 > minimap2_stream
+    ruleorder: unzip > minimap2_stream
+
+
 rule parse_mapping:
     """
     This rule takes the FASTQ with demuxing done as well as the minimap output (rule: `minimap2`)
-    and returns the desired output for RAMPART to ingest.
+    and returns the desired output for RAMPART to ingest, recording it in the run manifest.
     Since we don't know a priori whether guppy demuxing has been done, we call the function
     `get_demuxed_fastq` to conditionally require porechop demuxing.
     """
@@ -35,20 +197,41 @@ rule parse_mapping:
         fastq=get_demuxed_fastq,
         mapped=config["output_path"] + "/temp/{filename_stem}.paf",
         reference_file = config["references_file"],
+        reference_headers = get_reference_headers,
     params:
         path_to_script = workflow.current_basedir,
         min_identity= minimum_identity, 
-        reference_options = f'--reference_options "{reference_fields}"'
+        header_join = header_join,
+        reference_options = f'--reference_options "{reference_fields}"',
+        reference_headers = lambda wildcards, input: f'--reference_headers "{input.reference_headers}"' if input.reference_headers else "",
+        output_format = output_format,
+        summary = batch_summary,
+        metrics = stage_metrics("parse", summary=True),
+        fastq = source_fastq,
+        manifest = manifest,
+        publish = publish_part
+    priority: 2
     output:
-        report = config["output_path"] + "/{filename_stem}.csv"
+        report = config["output_path"] + "/{filename_stem}" + report_ext
+    threads: config.get("parse_threads", 1)
     shell:
         """
-        python {params.path_to_script}/parse_paf.py \
+        {params.metrics} python {params.path_to_script}/parse_paf.py \
         --paf_file {input.mapped:q} \
         --report {output.report:q} \
         --annotated_reads {input.fastq:q} \
         --reference_file {input.reference_file:q} \
+        --threads {threads} \
         {params.min_identity} \
-        {params.reference_options}
+        {params.header_join} \
+        {params.reference_options} \
+        {params.reference_headers} \
+        {params.summary} \
+        --output_format {params.output_format}
+        python {params.path_to_script}/manifest.py \
+        --fastq "{params.fastq}" \
+        --report {output.report:q} \
+        --manifest "{params.manifest}"
+        {params.publish}
         """
 #produces a csv report
@@ -0,0 +1,55 @@
+rule map_and_annotate:
+    """
+    Alternative to rules `minimap2` and `parse_mapping` (config `mapper: mappy`).
+    This rule maps the FASTQ in-process with mappy and writes the same csv report directly,
+    without writing and re-parsing a temporary paf file, recording it in the run manifest.
+    """
+    input:
+        fastq=get_unzipped_fastq,
+        demuxed=get_demuxed_fastq,
+        reference_file = config["references_file"],
+        reference_headers = get_reference_headers,
+        reference_index = get_mapping_reference
+    params:
+        path_to_script = workflow.current_basedir,
+        min_identity= minimum_identity,
+        header_join = header_join,
+        reference_options = f'--reference_options "{reference_fields}"',
+        reference_headers = lambda wildcards, input: f'--reference_headers "{input.reference_headers}"' if input.reference_headers else "",
+        output_format = output_format,
+        summary = batch_summary,
+        metrics = stage_metrics("mappy", summary=True),
+        fastq = source_fastq,
+        manifest = manifest,
+        publish = publish_part
+    priority: 2
+    output:
+        report = config["output_path"] + "/{filename_stem}" + report_ext
+    threads: config["threads"]
+    shell:
+        """
+        {params.metrics} python {params.path_to_script}/mappy_annotate.py \
+        --reads {input.fastq:q} \
+        --annotated_reads {input.demuxed:q} \
+        --report {output.report:q} \
+        --reference_file {input.reference_file:q} \
+        --reference_index {input.reference_index:q} \
+        --threads {threads} \
+        {params.min_identity} \
+        {params.header_join} \
+        {params.reference_options} \
+        {params.reference_headers} \
+        {params.summary} \
+        --output_format {params.output_format}
+        python {params.path_to_script}/manifest.py \
+        --fastq "{params.fastq}" \
+        --report {output.report:q} \
+        --manifest "{params.manifest}"
+        {params.publish}
+        """
+
+# Both `parse_mapping` and `map_and_annotate` produce the csv report, `mapper` decides which one runs
+if mapper == "mappy":
+    ruleorder: map_and_annotate > parse_mapping
+else:
+    ruleorder: parse_mapping > map_and_annotate
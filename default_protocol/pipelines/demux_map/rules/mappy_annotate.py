@@ -0,0 +1,146 @@
+import argparse
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import mappy as mp
+
+from annotation_format import open_report
+from batch_summary import SummarisedReport, write_summary
+from parse_paf import HeaderStream, get_header_dict, get_reference_table, parse_header_values
+from parse_paf import new_counts, print_counts, write_mapping
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Map reads with mappy and create the same report as minimap2 and parse_paf.py.')
+
+    parser.add_argument("--reads", action="store", type=str, dest="reads")
+    parser.add_argument("--annotated_reads", action="store", type=str, dest="annotated_reads",
+                        help="fastq with barcode annotated headers, defaults to the headers of --reads")
+
+    parser.add_argument("--report", action="store", type=str, dest="report")
+
+    parser.add_argument("--reference_file", action="store", type=str, dest="references")
+    parser.add_argument("--reference_options", action="store", type=str, dest="reference_options")
+    parser.add_argument("--reference_index", action="store", type=str, dest="reference_index",
+                        help="prebuilt minimap2 index (.mmi) of the reference file")
+    parser.add_argument("--reference_headers", action="store", type=str, dest="reference_headers",
+                        help="header fields of the reference file saved by reference_headers.py")
+
+    parser.add_argument("--minimum_identity", default=0.8, action="store", type=float, dest="min_identity")
+
+    parser.add_argument("--threads", default=1, action="store", type=int, dest="threads")
+
+    parser.add_argument("--header_join", default="dict", choices=["dict", "stream"], action="store", type=str, dest="header_join")
+    parser.add_argument("--header_window", default=10000, action="store", type=int, dest="header_window")
+
+    parser.add_argument("--output_format", default="csv", choices=["csv", "columnar"], action="store", type=str, dest="output_format")
+
+    parser.add_argument("--summary", action="store", type=str, dest="summary")
+    parser.add_argument("--summary_bin_width", default=10, action="store", type=int, dest="summary_bin_width")
+
+    return parser.parse_args()
+
+def load_aligner(references, threads=1):
+    #builds the index with the same preset as the minimap2 rule (-x map-ont),
+    #or loads it if `references` is a prebuilt .mmi index
+    aligner = mp.Aligner(str(references), preset="map-ont", n_threads=threads)
+    if not aligner:
+        raise Exception("ERROR: failed to load/build index file '{}'".format(references))
+    return aligner
+
+def map_reads(aligner, reads, threads=1, chunk_size=500):
+    #yields (read_name, read_len, comment, primary_hits) for each read in input order.
+    #mappy releases the GIL while mapping, so chunks of reads are mapped by a pool of
+    #threads, each with its own ThreadBuffer. Only a few chunks are in flight at once.
+    local = threading.local()
+
+    def map_chunk(chunk):
+        if not hasattr(local, "buffer"):
+            local.buffer = mp.ThreadBuffer()
+        mapped = []
+        for name, seq, qual, comment in chunk:
+            # --secondary=no: keep primary (and supplementary) alignments only
+            hits = [h for h in aligner.map(seq, buf=local.buffer) if h.is_primary]
+            mapped.append((name, len(seq), comment, hits))
+        return mapped
+
+    records = mp.fastx_read(str(reads), read_comment=True)
+    chunks = iter(lambda: list(itertools.islice(records, chunk_size)), [])
+
+    with ThreadPoolExecutor(threads) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(map_chunk, chunk))
+            if len(pending) > threads * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def hits_to_mapping(read_name, read_len, hits, barcode, start_time):
+    #returns the same values parse_paf.parse_lines gives for the paf line(s) of a read.
+    #More than one primary hit is an ambiguous mapping ('?') described by the first hit.
+    values = {
+        "read_name": read_name,
+        "read_len": read_len,
+        "barcode": barcode,
+        "start_time": start_time
+    }
+    if not hits:
+        values["query_start"], values["query_end"] = 0, 0
+        values["ref_hit"], values["ref_len"], values["coord_start"], values["coord_end"], values["matches"], values["aln_block_len"] = "*", 0, 0, 0, 0, 0
+        values["mismatches"], values["identity"] = 0, 0
+        values["insertions"], values["inserted_bases"], values["deletions"], values["deleted_bases"] = 0, 0, 0, 0
+        return values
+
+    hit = hits[0]
+    insertions = [length for length, op in hit.cigar if op == 1]
+    deletions = [length for length, op in hit.cigar if op == 2]
+
+    values["query_start"], values["query_end"] = hit.q_st, hit.q_en
+    values["ref_hit"] = hit.ctg if len(hits) == 1 else "?"
+    values["ref_len"], values["coord_start"], values["coord_end"] = hit.ctg_len, hit.r_st, hit.r_en
+    values["matches"], values["aln_block_len"] = hit.mlen, hit.blen
+    # NM is the edit distance, i.e. mismatches plus inserted and deleted bases
+    values["mismatches"] = hit.NM - sum(insertions) - sum(deletions)
+    values["identity"] = hit.mlen / (hit.mlen + values["mismatches"])
+    values["insertions"], values["inserted_bases"] = len(insertions), sum(insertions)
+    values["deletions"], values["deleted_bases"] = len(deletions), sum(deletions)
+    return values
+
+def annotate_reads(aligner, reads, report, header_dict, reference_table, min_identity, threads=1):
+    #maps every read and writes its row to the report, returns the counts.
+    #Barcodes come from header_dict if given, otherwise from the headers of the mapped reads.
+    counts = new_counts()
+    for read_name, read_len, comment, hits in map_reads(aligner, reads, threads):
+        if header_dict is not None:
+            barcode, start_time = header_dict.get(read_name, ("none", "?"))
+        else:
+            barcode, start_time = parse_header_values(f"{read_name} {comment}")
+        mapping = hits_to_mapping(read_name, read_len, hits, barcode, start_time)
+        write_mapping(report, mapping, reference_table, counts, min_identity)
+    return counts
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    aligner = load_aligner(args.reference_index or args.references, args.threads)
+    reference_table, ref_option_header = get_reference_table(args.reference_options, args.references, args.reference_headers)
+
+    if args.annotated_reads and args.annotated_reads != args.reads:
+        if args.header_join == "stream":
+            header_dict = HeaderStream(args.annotated_reads, args.header_window)
+        else:
+            header_dict = get_header_dict(args.annotated_reads)
+    else:
+        header_dict = None
+
+    with open_report(args.report, args.output_format, ref_option_header) as report:
+        if args.summary:
+            report = SummarisedReport(report, args.summary_bin_width)
+        counts = annotate_reads(aligner, args.reads, report, header_dict, reference_table, args.min_identity, args.threads)
+
+    if args.summary:
+        write_summary(args.summary, report.summary())
+
+    print_counts(counts)
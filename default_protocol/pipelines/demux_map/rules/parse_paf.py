@@ -1,7 +1,18 @@
 import argparse
+import itertools
+import multiprocessing
+import os
+import re
+from bisect import bisect_left
 from Bio import SeqIO
 from collections import defaultdict
-from collections import Counter
+from collections import OrderedDict
+from collections import namedtuple
+
+from annotation_format import ReportRows, open_report
+from batch_summary import SummarisedReport, write_summary
+from fastq_files import open_reads
+from reference_headers import load_reference_headers
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Parse barcode info and minimap paf file, create report.')
@@ -13,9 +24,27 @@ def parse_args():
 
     parser.add_argument("--reference_file", action="store", type=str, dest="references")
     parser.add_argument("--reference_options", action="store", type=str, dest="reference_options")
+    parser.add_argument("--reference_headers", action="store", type=str, dest="reference_headers",
+                        help="header fields of the reference file saved by reference_headers.py")
 
     parser.add_argument("--minimum_identity", default=0.8, action="store", type=float, dest="min_identity")
 
+    parser.add_argument("--threads", default=1, action="store", type=int, dest="threads",
+                        help="number of processes used to parse the paf file")
+
+    parser.add_argument("--header_join", default="dict", choices=["dict", "stream"], action="store", type=str, dest="header_join",
+                        help="'dict' loads every read header up front, 'stream' walks the fastq and paf in lockstep")
+    parser.add_argument("--header_window", default=10000, action="store", type=int, dest="header_window",
+                        help="maximum number of read headers buffered ahead of the paf in 'stream' mode")
+
+    parser.add_argument("--output_format", default="csv", choices=["csv", "columnar"], action="store", type=str, dest="output_format",
+                        help="'columnar' writes a typed column-oriented report, see annotation_format.py")
+
+    parser.add_argument("--summary", action="store", type=str, dest="summary",
+                        help="also write a json summary of the batch (coverage, read lengths, identity), see batch_summary.py")
+    parser.add_argument("--summary_bin_width", default=10, action="store", type=int, dest="summary_bin_width",
+                        help="reference bases per coverage bin of the summary")
+
     return parser.parse_args()
 
 def parse_reference_options(reference_options):
@@ -42,20 +71,86 @@ def parse_reference_options(reference_options):
 
 
 
-def parse_reference_file(references):
+def parse_reference_file(references, reference_headers=None):
     #returns a dict of dicts containing reference header information
-    #key is seq id i.e. first field of the header string
-    ref_info = defaultdict(dict)
-    for record in SeqIO.parse(references,"fasta"):
-        tokens = record.description.split(' ')
-        for i in tokens:
-            try:
-                info = i.split('=')
-                ref_info[record.id][info[0]]=info[1]
-                # ref_info['*'][info[0]]='NA'
-            except:
-                pass
-    return ref_info
+    #key is seq id i.e. first field of the header string.
+    #Read from the saved `reference_headers` if given, see reference_headers.py
+    headers = load_reference_headers(references, reference_headers)
+    return dict((seq_id, record["info"]) for seq_id, record in headers.items())
+
+def get_reference_table(reference_options, references, reference_headers=None):
+    #returns the ReferenceOptionTable for the --reference_options string (None if not given)
+    #and the extra csv header columns it adds
+    if not reference_options:
+        return None, ''
+    reference_options, ref_option_header = parse_reference_options(reference_options)
+    return ReferenceOptionTable(reference_options, parse_reference_file(references, reference_headers)), ref_option_header
+
+class RegionIndex:
+    #Sorted interval index over the (start, end) regions of one reference option,
+    #e.g. [["POL_genogroup",0,5000],["VP_genogroup",5000,7000]]. best_overlap returns
+    #the position (in the original option order) of the region sharing the most bases
+    #with an alignment, ties going to the region listed first, or None if none overlap.
+
+    def __init__(self, regions):
+        self._order = sorted(range(len(regions)), key=lambda i: regions[i][0])
+        self._starts = [regions[i][0] for i in self._order]
+        self._ends = [regions[i][1] for i in self._order]
+        self._max_len = max([end - start for start, end in regions] + [0])
+
+    def best_overlap(self, start, end):
+        # only regions starting before `end`, and no more than the longest region
+        # before `start`, can overlap the alignment
+        lo = bisect_left(self._starts, start - self._max_len)
+        hi = bisect_left(self._starts, end)
+
+        best, best_length = None, 0
+        for j in range(lo, hi):
+            length = min(self._ends[j], end) - max(self._starts[j], start)
+            if length > best_length or (length == best_length and length > 0 and self._order[j] < best):
+                best, best_length = self._order[j], length
+        return best
+
+class ReferenceOptionTable:
+    #reference_options resolved against the reference headers once per run.
+    #Each column is either a single header field, looked up per reference here,
+    #or a set of regions, where the header value of the region overlapping the
+    #alignment most is chosen per read using a RegionIndex.
+
+    def __init__(self, reference_options, reference_info):
+        self._columns = []
+        for k in reference_options:
+            if len(reference_options[k]) == 1:
+                self._columns.append(([k], None))
+            else:
+                regions = [i for i in reference_options[k] if len(i) == 3]
+                self._columns.append(([i[0] for i in regions], RegionIndex([(i[1], i[2]) for i in regions])))
+
+        self._reference_info = reference_info
+        self._values = {}
+        for reference in reference_info:
+            self._values[reference] = self._resolve(reference)
+
+    def _resolve(self, reference):
+        # header fields missing from a reference are reported as "NA"
+        info = self._reference_info.get(reference, {})
+        return [[info.get(field, "NA") for field in fields] for fields, index in self._columns]
+
+    def lookup(self, reference, coord_start, coord_end):
+        if reference not in self._values:
+            self._values[reference] = self._resolve(reference)
+
+        ref_opts = []
+        for (fields, index), values in zip(self._columns, self._values[reference]):
+            if index is None:
+                ref_opts.append(values[0])
+            else:
+                best = index.best_overlap(coord_start, coord_end)
+                ref_opts.append(values[best] if best is not None else "NA")
+        return ref_opts
+
+    def unmapped(self, ref_hit):
+        return [ref_hit for i in self._columns]
 
 def parse_read_header(header):
     #returns a dict of {key:value} pairs containing all 
@@ -71,72 +166,123 @@ def parse_read_header(header):
             pass
     return header_info
 
+def parse_header_values(description):
+    #returns the (barcode, start_time) pair stored for each read,
+    #barcode is 'none' if porechop didn't add one to the header
+    header = parse_read_header(description)
+    try:
+        barcode = header["barcode"]
+        start_time = header["start_time"]
+    except:
+        barcode = 'none'
+        start_time = header["start_time"]
+    return barcode, start_time
+
 def get_header_dict(reads):
     #This function parses the fastq file and returns a dictionary
     #with read name as the key and barcode information as the value
     # i.e. barcode_dict[read_name]=barcode
 
-    header_dict = {}
-    for record in SeqIO.parse(str(reads),"fastq"):
-        header = parse_read_header(str(record.description))
-        try:
-            barcode = header["barcode"]
-            start_time = header["start_time"]
-        except:
-            barcode = 'none'
-            start_time = header["start_time"]
+    if str(reads).endswith(".headers"):
+        return dict((name, parse_header_values(description)) for name, description in read_fastq_headers(reads))
 
-        header_dict[record.id]=(barcode, start_time)
+    header_dict = {}
+    with open_reads(reads) as f:
+        for record in SeqIO.parse(f,"fastq"):
+            header_dict[record.id]=parse_header_values(str(record.description))
         
     return header_dict
 
-def check_overlap(coords1,coords2):
-    list1 = list(range(coords1[0],coords1[1]))
-    list2 = list(range(coords2[0],coords2[1]))
-    overlap = set(list1).intersection(list2)
-    if overlap:
-        return True, len(overlap)
-    else:
-        return False, 0 
-
-def take_appropriate_cigar_action(counter, last_symbol, number):
-    if last_symbol == ":":
-        counter[last_symbol]+=int(number)
-    elif last_symbol == "*":
-        counter[last_symbol]+=1
-    else:
-        counter[last_symbol]+=len(number)
-
+def read_fastq_headers(reads):
+    #yields (read_name, description) for every record in the fastq without building
+    #sequence or quality objects. Guppy, porechop and minimap2 all write unwrapped
+    #fastq so each record is exactly four lines. A ".headers" file holds only the
+    #header lines of a fastq (see tee_fastq_headers.py), one per record.
+    step = 1 if str(reads).endswith(".headers") else 4
+    with open_reads(reads) as f:
+        for line in itertools.islice(f, 0, None, step):
+            description = line[1:].rstrip()
+            yield description.split(None, 1)[0], description
+
+class HeaderStream:
+    #Drop-in replacement for the header dict (supports `get`) that walks the fastq
+    #alongside the paf. minimap2 writes paf records in fastq input order, so the
+    #header for the next paf record is almost always the next fastq record.
+    #Reads porechop dropped (no fastq record) or split (fastq records with new names)
+    #break the lockstep, so up to `window` headers are buffered ahead of the paf.
+    #A read that isn't found within the window is treated as missing from the fastq.
+
+    def __init__(self, reads, window=10000):
+        self._headers = read_fastq_headers(reads)
+        self._pending = OrderedDict()
+        self._window = window
+        self._last_name = None
+        self._last_values = None
+
+    def get(self, read_name, default=None):
+        # consecutive paf lines for the same read (ambiguous mappings) share a header
+        if read_name != self._last_name:
+            self._last_name = read_name
+            self._last_values = self._find(read_name)
+        if self._last_values is None:
+            return default
+        return self._last_values
+
+    def _find(self, read_name):
+        if read_name in self._pending:
+            # buffered headers ahead of this one were never in the paf, drop them
+            while True:
+                name, values = self._pending.popitem(last=False)
+                if name == read_name:
+                    return values
+
+        while len(self._pending) < self._window:
+            try:
+                name, description = next(self._headers)
+            except StopIteration:
+                return None
+            values = parse_header_values(description)
+            if name == read_name:
+                self._pending.clear()
+                return values
+            self._pending[name] = values
+
+        return None
+
+# summary of a cs:Z: difference string (minimap2 --cs), see parse_cs_tags
+CsStats = namedtuple("CsStats", ["matches", "mismatches", "insertions", "inserted_bases", "deletions", "deleted_bases"])
+
+CS_MATCHES = re.compile(r':(\d+)')
+CS_INSERTIONS = re.compile(r'\+([A-Za-z]+)')
+CS_DELETIONS = re.compile(r'-([A-Za-z]+)')
+
+def parse_cs_tags(cs_tags):
+    #takes a list of cs:Z: strings (e.g. one per paf line in a chunk) and returns a
+    #list of CsStats. Each operation type is pulled out with a single compiled regex
+    #scan so the work happens in C rather than one python step per character:
+    # ":N" is a run of N matching bases, "*xy" a single mismatch,
+    # "+seq" an insertion and "-seq" a deletion of len(seq) bases
+    matches_pattern = CS_MATCHES.findall
+    insertions_pattern = CS_INSERTIONS.findall
+    deletions_pattern = CS_DELETIONS.findall
+
+    stats = []
+    for cs in cs_tags:
+        insertions = insertions_pattern(cs)
+        deletions = deletions_pattern(cs)
+        stats.append(CsStats(
+            sum(map(int, matches_pattern(cs))),
+            cs.count("*"),
+            len(insertions),
+            sum(map(len, insertions)),
+            len(deletions),
+            sum(map(len, deletions))
+        ))
+    return stats
 
 def parse_cigar_for_matches_and_mismatches(cigar):
-    cigar_counter = Counter()
-
-    cigar = cigar[5:] # removes the cs:Z: from the beginning of the cigar
-    
-    symbol = ''
-    last_symbol = None
-    number = ''
-    
-    for i in cigar:
-        if i in [":","*","+","-"]:
-            symbol = i
-
-            if last_symbol:
-                take_appropriate_cigar_action(cigar_counter, last_symbol, number)
-                last_symbol = symbol
-                number = ''
-            else:
-                last_symbol = symbol
-        else:
-            number += i
-
-
-    take_appropriate_cigar_action(cigar_counter, last_symbol, number)
-
-    matches = cigar_counter[":"]
-    mismatches = cigar_counter["*"]
-    
-    return matches, mismatches
+    stats = parse_cs_tags([cigar])[0]
+    return stats.matches, stats.mismatches
 
 def calculate_genetic_identity(cigar):
     
@@ -155,29 +301,41 @@ def check_identity_threshold(mapping, min_identity):
     else:
         return False
 
-def parse_line(line, header_dict):
-    values = {}
-    tokens = line.rstrip('\n').split('\t')
-    values["read_name"], values["read_len"] = tokens[:2]
-    if values["read_name"] in header_dict:
-        values["barcode"], values["start_time"] = header_dict[values["read_name"]] #if porechop didn't discard the read
-    else:
-        values["barcode"], values["start_time"] = "none", "?" #don't have info on time or barcode
-    values["query_start"] = tokens[2]
-    values["query_end"] = tokens[3]
-    values["ref_hit"], values["ref_len"], values["coord_start"], values["coord_end"], values["matches"], values["aln_block_len"] = tokens[5:11]
-    if values["ref_hit"] != "*":
-        mismatches, identity = calculate_genetic_identity(tokens[-1])
-        values["mismatches"] = mismatches
-        values["identity"] = identity
-    else:
-        values["mismatches"] = 0
-        values["identity"]= 0
+def parse_lines(lines, header_dict):
+    #parses a chunk of paf lines, the cs tags of all mapped lines in the chunk
+    #are handed to parse_cs_tags in one go
+    rows = [line.rstrip('\n').split('\t') for line in lines]
+    cs_stats = iter(parse_cs_tags([tokens[-1] for tokens in rows if tokens[5] != "*"]))
+
+    mappings = []
+    for tokens in rows:
+        values = {}
+        values["read_name"], values["read_len"] = tokens[:2]
+        #"none" and "?" if porechop discarded the read, we don't have info on time or barcode
+        values["barcode"], values["start_time"] = header_dict.get(values["read_name"], ("none", "?"))
+        values["query_start"] = tokens[2]
+        values["query_end"] = tokens[3]
+        values["ref_hit"], values["ref_len"], values["coord_start"], values["coord_end"], values["matches"], values["aln_block_len"] = tokens[5:11]
+        if values["ref_hit"] != "*":
+            stats = next(cs_stats)
+            values["mismatches"] = stats.mismatches
+            values["identity"] = stats.matches / (stats.matches + stats.mismatches)
+            values["insertions"], values["inserted_bases"] = stats.insertions, stats.inserted_bases
+            values["deletions"], values["deleted_bases"] = stats.deletions, stats.deleted_bases
+        else:
+            values["mismatches"] = 0
+            values["identity"]= 0
+            values["insertions"], values["inserted_bases"] = 0, 0
+            values["deletions"], values["deleted_bases"] = 0, 0
+        mappings.append(values)
+
+    return mappings
 
-    return values
+def parse_line(line, header_dict):
+    return parse_lines([line], header_dict)[0]
 
 
-def write_mapping(report, mapping, reference_options, reference_info, counts, min_identity):
+def write_mapping(report, mapping, reference_table, counts, min_identity):
     if mapping["ref_hit"] == '*' or mapping["ref_hit"] == '?':
         # '*' means no mapping, '?' ambiguous mapping (i.e., multiple primary mappings)
         mapping['coord_start'], mapping['coord_end'] = 0, 0
@@ -186,84 +344,61 @@ def write_mapping(report, mapping, reference_options, reference_info, counts, mi
         else:
             counts["ambiguous"] += 1
 
-        if reference_options != None:
-                mapping["ref_opts"] = []
-                for k in reference_options:
-                    mapping["ref_opts"].append(mapping["ref_hit"])
+        if reference_table != None:
+            mapping["ref_opts"] = reference_table.unmapped(mapping["ref_hit"])
     else:
-        if reference_options != None:
-            mapping["ref_opts"] = []
-            for k in reference_options:
-                if len(reference_options[k]) == 1:
-                    mapping["ref_opts"].append(reference_info[mapping["ref_hit"]][k])
-                else:
-                    overlap_list = []
-                    for i in reference_options[k]:
-                        if len(i) == 3:
-                            sub_k, opt_start, opt_end = i
-                            overlap, length = check_overlap((opt_start, opt_end),(int(mapping["coord_start"]), int(mapping["coord_end"])))
-                            if overlap:
-                                overlap_list.append((reference_info[mapping["ref_hit"]][sub_k], length))
-                    if overlap_list:
-                        best = sorted(overlap_list, key = lambda x : x[1], reverse=True)[0]
-                        mapping["ref_opts"].append(best[0])
-                    else:
-                        mapping["ref_opts"].append("NA")
-
-    
+        if reference_table != None:
+            mapping["ref_opts"] = reference_table.lookup(mapping["ref_hit"], int(mapping["coord_start"]), int(mapping["coord_end"]))
 
     if check_identity_threshold(mapping, min_identity):
 
         counts["total"] += 1
 
         mapping_length = int(mapping['matches']) + int(mapping['mismatches'])
-        report.write(f"{mapping['read_name']},{mapping['read_len']},{mapping['start_time']},"
-                    f"{mapping['barcode']},{mapping['ref_hit']},{mapping['ref_len']},"
-                    f"{mapping['coord_start']},{mapping['coord_end']},{mapping['matches']},{mapping_length}")
+        row = (mapping['read_name'], mapping['read_len'], mapping['start_time'],
+               mapping['barcode'], mapping['ref_hit'], mapping['ref_len'],
+               mapping['coord_start'], mapping['coord_end'], mapping['matches'], mapping_length)
         if 'ref_opts' in mapping:
-            report.write(f",{','.join(mapping['ref_opts'])}\n")
-        else:
-            report.write("\n")
+            row += tuple(mapping['ref_opts'])
     else:
         counts["unmapped"] +=1
-        report.write(f"{mapping['read_name']},{mapping['read_len']},{mapping['start_time']},"
-                    f"{mapping['barcode']},*,0,0,0,0,0")
+        row = (mapping['read_name'], mapping['read_len'], mapping['start_time'],
+               mapping['barcode'], '*', 0, 0, 0, 0, 0)
         if 'ref_opts' in mapping:
-            ref_opt_list = ['*' for i in mapping['ref_opts']]
-            report.write(f",{','.join(ref_opt_list)}\n")
-        else:
-            report.write("\n")
+            row += ('*',) * len(mapping['ref_opts'])
 
-def parse_paf(paf, report, header_dict, reference_options, reference_info,min_identity):
-    #This function parses the input paf file 
-    #and outputs a csv report containing information relevant for RAMPART and barcode information
-    # read_name,read_len,start_time,barcode,best_reference,start_coords,end_coords,ref_len,matches,aln_block_len,ref_option1,ref_option2
-    counts = {
+    report.write_row(row)
+
+def new_counts():
+    return {
         "unmapped": 0,
         "ambiguous": 0,
         "total": 0
     }
 
-    with open(str(paf),"r") as f:
-        last_mapping = None
-        for line in f:
-
-            mapping = parse_line(line, header_dict)
-
-            if last_mapping:
-                if mapping["read_name"] == last_mapping["read_name"]:
-                    # this is another mapping for the same read so set the original one to ambiguous. Don't
-                    # set last_mapping in case there is another mapping with the same read name.
-                    last_mapping['ref_hit'] = '?'
-                else:
-                    write_mapping(report, last_mapping, reference_options, reference_info, counts,min_identity)
-                    last_mapping = mapping
+def parse_paf_lines(lines, report, header_dict, reference_table, min_identity, counts, chunk_size=1000):
+    #parses an iterable of paf lines and writes a csv row per read to the report.
+    #Consecutive lines for the same read are collapsed into one ambiguous ('?') row.
+    last_mapping = None
+    chunks = iter(lambda: list(itertools.islice(lines, chunk_size)), [])
+    for mapping in itertools.chain.from_iterable(parse_lines(chunk, header_dict) for chunk in chunks):
+
+        if last_mapping:
+            if mapping["read_name"] == last_mapping["read_name"]:
+                # this is another mapping for the same read so set the original one to ambiguous. Don't
+                # set last_mapping in case there is another mapping with the same read name.
+                last_mapping['ref_hit'] = '?'
             else:
+                write_mapping(report, last_mapping, reference_table, counts, min_identity)
                 last_mapping = mapping
+        else:
+            last_mapping = mapping
 
-        # write the last last_mapping
-        write_mapping(report, last_mapping, reference_options, reference_info, counts,min_identity)
+    # write the last last_mapping
+    if last_mapping:
+        write_mapping(report, last_mapping, reference_table, counts, min_identity)
 
+def print_counts(counts):
     try:
         prop_unmapped = counts["unmapped"] / counts["total"]
         print("Proportion unmapped is {}".format(prop_unmapped))
@@ -272,20 +407,104 @@ def parse_paf(paf, report, header_dict, reference_options, reference_info,min_id
     except:
         print("Probably can't find the records.") #division of zero the error
 
+def parse_paf(paf, report, header_dict, reference_table, min_identity, chunk_size=1000):
+    #This function parses the input paf file 
+    #and outputs a csv report containing information relevant for RAMPART and barcode information
+    # read_name,read_len,start_time,barcode,best_reference,start_coords,end_coords,ref_len,matches,aln_block_len,ref_option1,ref_option2
+    counts = new_counts()
+
+    with open(str(paf),"r") as f:
+        parse_paf_lines(f, report, header_dict, reference_table, min_identity, counts, chunk_size)
+
+    print_counts(counts)
+
+def split_paf(paf, n_chunks):
+    #returns (start, end) byte offsets dividing the paf into roughly equal chunks.
+    #Boundaries are moved forward to the start of a line with a new read name so all
+    #the mappings of one read land in the same chunk and '?' calls are unaffected.
+    size = os.path.getsize(str(paf))
+    boundaries = [0]
+    with open(str(paf), "rb") as f:
+        for i in range(1, n_chunks):
+            target = size * i // n_chunks
+            if target <= boundaries[-1]:
+                continue
+            # move to the start of the next line, then past all the lines for that read
+            f.seek(target - 1)
+            f.readline()
+            read_name = None
+            while True:
+                boundary = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                name = line.split(b'\t', 1)[0]
+                if read_name is None:
+                    read_name = name
+                elif name != read_name:
+                    break
+            if boundaries[-1] < boundary < size:
+                boundaries.append(boundary)
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+# set in each worker process by init_worker
+worker_state = {}
+
+def init_worker(paf, header_dict, reference_table, min_identity):
+    worker_state["paf"] = paf
+    worker_state["header_dict"] = header_dict
+    worker_state["reference_table"] = reference_table
+    worker_state["min_identity"] = min_identity
+
+def parse_paf_chunk(offsets):
+    start, end = offsets
+    with open(str(worker_state["paf"]), "rb") as f:
+        f.seek(start)
+        lines = f.read(end - start).decode().splitlines(True)
+
+    report = ReportRows()
+    counts = new_counts()
+    parse_paf_lines(iter(lines), report, worker_state["header_dict"], worker_state["reference_table"],
+                    worker_state["min_identity"], counts)
+    return report, counts
+
+def parse_paf_parallel(paf, report, header_dict, reference_table, min_identity, threads):
+    #As parse_paf, but the paf is split into chunks at read boundaries which are parsed
+    #by a pool of processes. Rows are written in the original order and counts merged.
+    counts = new_counts()
+    chunks = split_paf(paf, threads * 4)
+
+    with multiprocessing.Pool(threads, initializer=init_worker,
+                              initargs=(paf, header_dict, reference_table, min_identity)) as pool:
+        for rows, chunk_counts in pool.imap(parse_paf_chunk, chunks):
+            report.write_rows(rows)
+            for k in counts:
+                counts[k] += chunk_counts[k]
+
+    print_counts(counts)
+
 if __name__ == '__main__':
 
     args = parse_args()
 
-    with open(str(args.report), "w") as csv_report:
-        
-        if args.reference_options:
-            reference_options,ref_option_header = parse_reference_options(args.reference_options)
-            reference_info = parse_reference_file(args.references)
-        else:
-            reference_options,ref_option_header = None,''
-            reference_info = None
+    reference_table, ref_option_header = get_reference_table(args.reference_options, args.references, args.reference_headers)
 
+    if args.header_join == "stream" and args.threads > 1:
+        # worker processes can't share the fastq position, so read every header once up front
+        header_dict = dict((name, parse_header_values(description)) for name, description in read_fastq_headers(args.reads))
+    elif args.header_join == "stream":
+        header_dict = HeaderStream(args.reads, args.header_window)
+    else:
         header_dict = get_header_dict(args.reads)
 
-        csv_report.write(f"read_name,read_len,start_time,barcode,best_reference,ref_len,start_coords,end_coords,num_matches,mapping_len{ref_option_header}\n")
-        parse_paf(args.paf_file, csv_report, header_dict, reference_options, reference_info,args.min_identity)
+    with open_report(args.report, args.output_format, ref_option_header) as report:
+        if args.summary:
+            report = SummarisedReport(report, args.summary_bin_width)
+        if args.threads > 1:
+            parse_paf_parallel(args.paf_file, report, header_dict, reference_table, args.min_identity, args.threads)
+        else:
+            parse_paf(args.paf_file, report, header_dict, reference_table, args.min_identity)
+
+    if args.summary:
+        write_summary(args.summary, report.summary())
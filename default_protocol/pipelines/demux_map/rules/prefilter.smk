@@ -0,0 +1,62 @@
+rule sketch_references:
+    """
+    Sketches the reference panel (see `get_reference_sketch` and rules/reference_sketch.py), once
+    for the panel. The sketches are written to a temporary name and moved into place once complete.
+    """
+    input:
+        config["references_file"]
+    params:
+        path_to_script = workflow.current_basedir
+    priority: 3
+    output:
+        config.get("index_path", config["output_path"] + "/index").rstrip("/") + "/{name}.{checksum}.k{kmer_size}.s{scaled}.sketch"
+    shell:
+        """
+        python {params.path_to_script}/reference_sketch.py \
+        --reference_file {input:q} \
+        --sketch {output:q} \
+        --kmer_size {wildcards.kmer_size} \
+        --scaled {wildcards.scaled}
+        """
+
+def get_prefilter_barcodes(wildcards):
+    """
+        With `prefilter_by: barcode`, the demultiplexed reads `select_references` takes the barcode
+        of each read from (see `get_demuxed_fastq`). Snakemake also tries `select_references` when
+        looking for the temporary files of other rules (e.g. temp/{filename_stem}_demuxed.headers),
+        so nothing is returned unless the FASTQ is in input_path.
+    """
+    fastq = config["input_path"] + f"/{wildcards.filename_stem}" + config["filename_ext"]
+    if prefilter_by != "barcode" or not os.path.exists(fastq):
+        return []
+    return get_demuxed_fastq(wildcards)
+
+rule select_references:
+    """
+    With config `prefilter`, picks the `prefilter_references` references that share the most
+    k-mers with the reads of the batch (or, with `prefilter_by: barcode`, with the reads of each
+    barcode) and copies them to the sub-panel the batch is mapped against.
+    """
+    input:
+        fastq=get_unzipped_fastq,
+        demuxed=get_prefilter_barcodes,
+        reference_file=config["references_file"],
+        sketch=get_reference_sketch if prefilter else []
+    params:
+        path_to_script = workflow.current_basedir,
+        references_per_group = config.get("prefilter_references", 20),
+        annotated_reads = lambda wildcards, input: f'--annotated_reads "{input.demuxed}"' if input.demuxed else "",
+        metrics = stage_metrics("prefilter")
+    priority: 1
+    output:
+        temp(config["output_path"] + "/temp/{filename_stem}.subpanel.fasta")
+    shell:
+        """
+        {params.metrics} python {params.path_to_script}/reference_sketch.py \
+        --reference_file {input.reference_file:q} \
+        --sketch {input.sketch:q} \
+        --reads {input.fastq:q} \
+        {params.annotated_reads} \
+        --references_per_group {params.references_per_group} \
+        --output {output:q}
+        """
@@ -0,0 +1,138 @@
+import argparse
+import gzip
+import os
+import shutil
+
+from annotation_format import read_columnar, read_columnar_header, write_columnar
+from reference_headers import file_stamp
+
+# With `index_reads` each batch also gets a read index, {filename_stem}.fqi next to its report,
+# so the reads of a barcode can be exported (bin_to_fastq/export_reads.py) by seeking straight
+# to them instead of reading every FASTQ again. It is written in the columnar layout of
+# annotation_format.py, one row per read of the report that is in the FASTQ:
+#
+#   read_name  lines
+#   read_len   int32
+#   barcode    dict
+#   offset     int64    where the read's fastq record starts in the FASTQ
+#   length     int32    bytes of the record (all four lines)
+#
+# Offsets of a .fastq.gz are in the uncompressed stream. The json header also has "fastq", the
+# path of the FASTQ relative to the index, and its "size" and "mtime_ns" when it was indexed, so
+# an index is only used while the FASTQ is unchanged.
+#
+# A gzipped FASTQ isn't decompressed again to index it: the pipeline's pass that decompresses it
+# (rule `unzip`, with --unzip here, or tee_fastq_headers.py for `stream_gzip`) also writes the
+# offset and length of each record, one "read_name<tab>offset<tab>length" line per read, and
+# the index is made from these (--offsets). A plain FASTQ is scanned.
+
+READ_INDEX_EXTENSION = ".fqi"
+
+READ_INDEX_SCHEMA = [
+    ("read_name", "lines"),
+    ("read_len", "int32"),
+    ("barcode", "dict"),
+    ("offset", "int64"),
+    ("length", "int32")
+]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Index the reads of an annotated FASTQ by barcode.')
+
+    parser.add_argument("--fastq", action="store", type=str, dest="fastq")
+    parser.add_argument("--report", action="store", type=str, dest="report",
+                        help="the csv or columnar report of the FASTQ")
+    parser.add_argument("--output", action="store", type=str, dest="output")
+    parser.add_argument("--offsets", action="store", type=str, dest="offsets",
+                        help="the offsets of the FASTQ's records, written as it was decompressed, rather than scanning it")
+
+    parser.add_argument("--unzip", action="store", type=str, dest="unzip",
+                        help="instead decompress this FASTQ to --output, writing the offsets of its records to --offsets if given")
+
+    return parser.parse_args()
+
+def open_fastq(fastq):
+    #binary, so offsets are in bytes
+    if str(fastq).endswith(".gz"):
+        return gzip.open(str(fastq), "rb")
+    return open(str(fastq), "rb")
+
+def scan_fastq(fastq):
+    #yields (read_name, offset, length) of each fastq record
+    offset = 0
+    with open_fastq(fastq) as fh:
+        for header, sequence, plus, quality in zip(fh, fh, fh, fh):
+            length = len(header) + len(sequence) + len(plus) + len(quality)
+            yield header[1:].split(None, 1)[0].decode(), offset, length
+            offset += length
+
+def unzip_fastq(fastq, output, offsets=None):
+    #decompresses a gzipped FASTQ, and writes the offset and length of each record to `offsets`
+    with gzip.open(str(fastq), "rb") as fh, open(str(output), "wb") as out:
+        if offsets is None:
+            shutil.copyfileobj(fh, out)
+            return
+        with open(str(offsets), "w") as offsets_out:
+            offset = 0
+            for record in zip(fh, fh, fh, fh):
+                length = len(record[0]) + len(record[1]) + len(record[2]) + len(record[3])
+                out.writelines(record)
+                offsets_out.write(f"{record[0][1:].split(None, 1)[0].decode()}\t{offset}\t{length}\n")
+                offset += length
+
+def read_offsets(offsets):
+    #yields (read_name, offset, length) of each record from an offsets file
+    with open(str(offsets)) as fh:
+        for line in fh:
+            name, offset, length = line.split("\t")
+            yield name, int(offset), int(length)
+
+def read_report(report):
+    #returns {read_name: (read_len, barcode)} of a csv or columnar report
+    if str(report).endswith(".rac"):
+        names, columns = read_columnar(report)
+        return dict((name, (read_len, barcode)) for name, read_len, barcode in
+                    zip(columns["read_name"], columns["read_len"], columns["barcode"]))
+    reads = {}
+    with open(str(report)) as fh:
+        next(fh, None)
+        for line in fh:
+            fields = line.split(",", 4)
+            reads[fields[0]] = (int(fields[1]), fields[3])
+    return reads
+
+def build_read_index(fastq, report, offsets=None):
+    #returns the index rows of the reads of the report, in FASTQ order
+    reads = read_report(report)
+    rows = []
+    for name, offset, length in (read_offsets(offsets) if offsets else scan_fastq(fastq)):
+        if name in reads:
+            read_len, barcode = reads[name]
+            rows.append((name, read_len, barcode, offset, length))
+    return rows
+
+def write_read_index(fastq, report, output, offsets=None):
+    #written to a temporary name and moved into place once complete
+    rows = build_read_index(fastq, report, offsets)
+    fastq_path = os.path.relpath(os.path.abspath(str(fastq)), os.path.dirname(os.path.abspath(str(output))))
+    write_columnar(str(output) + ".tmp", READ_INDEX_SCHEMA, rows, fastq=fastq_path, **file_stamp(fastq))
+    os.replace(str(output) + ".tmp", str(output))
+
+def load_read_index(path):
+    #returns the path of the indexed FASTQ and the index rows, or None if the FASTQ is
+    #missing or has changed since it was indexed
+    header = read_columnar_header(path)
+    fastq = os.path.normpath(os.path.join(os.path.dirname(str(path)), header["fastq"]))
+    if not os.path.exists(fastq) or file_stamp(fastq) != {"size": header["size"], "mtime_ns": header["mtime_ns"]}:
+        return None
+    names, columns = read_columnar(path)
+    return fastq, list(zip(*(columns[name] for name, kind in READ_INDEX_SCHEMA)))
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    if args.unzip:
+        unzip_fastq(args.unzip, args.output, args.offsets)
+    else:
+        write_read_index(args.fastq, args.report, args.output, args.offsets)
@@ -0,0 +1,33 @@
+def get_read_offsets(wildcards):
+    """
+        The offsets of the reads written by the rule that decompressed the FASTQ (see
+        `read_offsets_output`), or an empty list if the FASTQ isn't gzipped, or (with
+        `stream_gzip` and `mapper: mappy`) nothing decompresses it, and it is scanned instead.
+    """
+    if not read_offsets_output() or (stream_gzip and mapper == "mappy"):
+        return []
+    return config["output_path"] + "/temp/{filename_stem}.offsets"
+
+rule index_reads:
+    """
+    Writes the read index of a batch (config `index_reads`, see rules/read_index.py): where each
+    read of the report is in the original FASTQ, with its barcode and length, so bin_to_fastq
+    can export a barcode's reads without reading every FASTQ.
+    """
+    input:
+        fastq=config["input_path"] + "/{filename_stem}" + config["filename_ext"],
+        report=config["output_path"] + "/{filename_stem}" + report_ext,
+        offsets=get_read_offsets
+    params:
+        path_to_script = workflow.current_basedir,
+        offsets = lambda wildcards, input: f'--offsets "{input.offsets}"' if input.offsets else ""
+    output:
+        config["output_path"] + "/{filename_stem}.fqi"
+    shell:
+        """
+        python {params.path_to_script}/read_index.py \
+        --fastq {input.fastq:q} \
+        --report {input.report:q} \
+        --output {output:q} \
+        {params.offsets}
+        """
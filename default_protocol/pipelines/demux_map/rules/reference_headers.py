@@ -0,0 +1,93 @@
+import argparse
+import hashlib
+import json
+import os
+
+# Of the reference panel, the annotation only needs the `key=value` fields of each fasta
+# header (for --reference_options) and the sequence lengths. Rule `index_reference_headers`
+# scans the panel once and saves them as json next to the minimap2 index, so each batch
+# loads a small file instead of parsing every sequence of the panel again.
+#
+#   {"size": ..., "mtime_ns": ..., "headers": {seq id: {"info": {key: value}, "length": ...}}}
+#
+# With --checksum it also writes the content hash of the panel (checkpoint `reference_checksum`),
+# which the index, header and sketch files of the panel are named after:
+#
+#   {"size": ..., "mtime_ns": ..., "sha1": ...}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Save the header fields and sequence lengths, or the sha1, of a reference panel.')
+
+    parser.add_argument("--reference_file", action="store", type=str, dest="references")
+    parser.add_argument("--output", action="store", type=str, dest="output")
+    parser.add_argument("--checksum", action="store", type=str, dest="checksum",
+                        help="json file to write the sha1 of the reference file to")
+
+    return parser.parse_args()
+
+def scan_reference_file(references):
+    #returns {seq id: {"info": {key: value}, "length": int}}. The id and fields are taken
+    #from the header as SeqIO does (id is the first word, each `key=value` word is a field)
+    headers = {}
+    record = {"length": 0}
+    length = 0
+    with open(str(references), "rb") as fh:
+        for line in fh:
+            if line.startswith(b">"):
+                record["length"] = length
+                length = 0
+                title = line[1:].decode().rstrip()
+                seq_id = title.split(None, 1)[0] if title else ""
+                record = headers.setdefault(seq_id, {"info": {}, "length": 0})
+                for token in title.split(' '):
+                    info = token.split('=')
+                    if len(info) > 1:
+                        record["info"][info[0]] = info[1]
+            else:
+                length += len(line.rstrip())
+    record["length"] = length
+    return headers
+
+def file_stamp(references):
+    stat = os.stat(str(references))
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def checksum(path):
+    sha1 = hashlib.sha1()
+    with open(str(path), "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def write_reference_checksum(references, output):
+    #written to a temporary name and moved into place once complete
+    with open(output + ".tmp", "w") as fh:
+        json.dump(dict(file_stamp(references), sha1=checksum(references)), fh)
+    os.replace(output + ".tmp", output)
+
+def write_reference_headers(references, output):
+    #written to a temporary name and moved into place once complete
+    index = dict(file_stamp(references), headers=scan_reference_file(references))
+    with open(output + ".tmp", "w") as fh:
+        json.dump(index, fh)
+    os.replace(output + ".tmp", output)
+
+def load_reference_headers(references, reference_headers=None):
+    #the saved headers if `reference_headers` exists and was made from the current
+    #reference file (same size and modification time), otherwise the panel is scanned
+    if reference_headers and os.path.exists(reference_headers):
+        with open(reference_headers) as fh:
+            index = json.load(fh)
+        stamp = file_stamp(references)
+        if index.get("size") == stamp["size"] and index.get("mtime_ns") == stamp["mtime_ns"]:
+            return index["headers"]
+    return scan_reference_file(references)
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    if args.checksum:
+        write_reference_checksum(args.references, args.checksum)
+    if args.output:
+        write_reference_headers(args.references, args.output)
@@ -0,0 +1,201 @@
+import argparse
+import itertools
+import os
+from collections import defaultdict
+
+import numpy as np
+
+from annotation_format import read_columnar, read_columnar_header, write_columnar
+from fastq_files import open_reads
+from parse_paf import parse_read_header, read_fastq_headers
+
+# With `prefilter` each batch is mapped against a sub-panel of the references most like its
+# reads, rather than the whole reference panel, so the mapping time and memory of a batch don't
+# grow with the size of the panel.
+#
+# The panel is sketched once (rule `sketch_references`, named like the minimap2 index): the
+# FracMinHash sketch of a reference is the set of the hashes (crc32) of its k-mers, on both
+# strands, that are below 2^32 / scaled. The sketches are written in the columnar layout of
+# annotation_format.py, one row per hash of each reference, sorted by hash:
+#
+#   hash       int64
+#   reference  int32    index into the "references" of the json header
+#
+# The json header also has "k", "scaled" and "references", the [name, offset, length] of each
+# record in the reference file, so the sub-panel is copied from it without parsing the panel again.
+#
+# For a batch (rule `select_references`) the k-mers of the reads are hashed the same way, and
+# each reference scores the number of hashes it shares with them. The `prefilter_references`
+# best scoring references are taken for the whole batch or, with `prefilter_by: barcode`, for
+# the reads of each barcode, and written in panel order (so minimap2 breaks ties between equally
+# good references as it would with the whole panel) to the sub-panel fasta.
+#
+# The k-mers are hashed with numpy, all the k-mers of many sequences at once: the crc32 (as
+# zlib.crc32) of every k-mer is computed a byte at a time with the crc table, k steps over the
+# array of k-mer start positions, rather than a python call per k-mer.
+
+SKETCH_SCHEMA = [
+    ("hash", "int64"),
+    ("reference", "int32")
+]
+
+COMPLEMENT = bytes.maketrans(b"ACGTacgt", b"TGCAtgca")
+
+# reads are hashed this many at a time
+READS_PER_CHUNK = 1000
+
+def crc_table():
+    #the table of the reflected crc32 polynomial of zlib.crc32
+    table = np.arange(256, dtype=np.uint32)
+    for bit in range(8):
+        table = np.where(table & 1, (table >> 1) ^ np.uint32(0xEDB88320), table >> 1)
+    return table
+
+CRC_TABLE = crc_table()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Sketch a reference panel, or pick the sub-panel of references to map a batch against.')
+
+    parser.add_argument("--reference_file", action="store", type=str, dest="references")
+    parser.add_argument("--sketch", action="store", type=str, dest="sketch",
+                        help="the sketches of the reference file, written if there are no --reads")
+    parser.add_argument("--kmer_size", default=15, action="store", type=int, dest="kmer_size")
+    parser.add_argument("--scaled", default=50, action="store", type=int, dest="scaled",
+                        help="keep 1 in `scaled` k-mer hashes")
+
+    parser.add_argument("--reads", action="store", type=str, dest="reads",
+                        help="fastq of the batch, the sub-panel is written to --output")
+    parser.add_argument("--annotated_reads", action="store", type=str, dest="annotated_reads",
+                        help="fastq (or .headers) with the barcodes of the reads, to pick references for each barcode")
+    parser.add_argument("--references_per_group", default=20, action="store", type=int, dest="references_per_group",
+                        help="number of references picked for the batch, or for each barcode")
+    parser.add_argument("--output", action="store", type=str, dest="output")
+
+    return parser.parse_args()
+
+def sketch_sequences(sequences, k, max_hash):
+    #returns the sorted unique hashes below max_hash of the k-mers of the sequences (bytes)
+    data = np.frombuffer(b"".join(sequences), dtype=np.uint8)
+    n = len(data) - k + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.int64)
+    crc = np.full(n, 0xFFFFFFFF, dtype=np.uint32)
+    for i in range(k):
+        index = crc.astype(np.uint8) ^ data[i:i + n]
+        crc >>= 8
+        crc ^= CRC_TABLE[index]
+    crc ^= np.uint32(0xFFFFFFFF)
+
+    # only the k-mers that start and end in the same sequence
+    lengths = np.array([len(sequence) for sequence in sequences], dtype=np.int64)
+    starts = np.cumsum(lengths) - lengths
+    whole = lengths >= k
+    edges = np.zeros(n + 1, dtype=np.int64)
+    np.add.at(edges, starts[whole], 1)
+    np.add.at(edges, starts[whole] + lengths[whole] - k + 1, -1)
+    crc = crc[np.cumsum(edges[:n]) > 0]
+    return np.unique(crc[crc < max_hash]).astype(np.int64)
+
+def read_fasta_records(references):
+    #yields (name, offset, length, sequence) of each record of the fasta, offset and length
+    #in bytes of the whole record (header and sequence lines)
+    name, start, lines = None, 0, []
+    offset = 0
+    with open(str(references), "rb") as fh:
+        for line in fh:
+            if line.startswith(b">"):
+                if name is not None:
+                    yield name, start, offset - start, b"".join(lines)
+                name, start, lines = line[1:].split(None, 1)[0].decode(), offset, []
+            else:
+                lines.append(line.strip().upper())
+            offset += len(line)
+    if name is not None:
+        yield name, start, offset - start, b"".join(lines)
+
+def sketch_references(references, k, scaled):
+    #returns the [name, offset, length] of each reference and the sketch rows, sorted by hash
+    max_hash = (1 << 32) // scaled
+    records = []
+    hashes = []
+    for name, offset, length, sequence in read_fasta_records(references):
+        records.append([name, offset, length])
+        hashes.append(sketch_sequences([sequence, sequence.translate(COMPLEMENT)[::-1]], k, max_hash))
+    indices = np.repeat(np.arange(len(records)), [len(reference_hashes) for reference_hashes in hashes])
+    hashes = np.concatenate(hashes) if hashes else np.zeros(0, dtype=np.int64)
+    order = np.lexsort((indices, hashes))
+    return records, list(zip(hashes[order].tolist(), indices[order].tolist()))
+
+def write_sketch(references, output, k, scaled):
+    #written to a temporary name and moved into place once complete
+    records, rows = sketch_references(references, k, scaled)
+    write_columnar(str(output) + ".tmp", SKETCH_SCHEMA, rows, k=k, scaled=scaled, references=records)
+    os.replace(str(output) + ".tmp", str(output))
+
+def load_sketch(sketch):
+    #returns the json header and the hash and reference columns of the sketches
+    header = read_columnar_header(sketch)
+    names, columns = read_columnar(sketch)
+    return header, np.asarray(columns["hash"], dtype=np.int64), np.asarray(columns["reference"], dtype=np.int64)
+
+def read_barcodes(annotated_reads):
+    #{read_name: barcode} of the reads with a barcode in their header
+    barcodes = {}
+    for name, description in read_fastq_headers(annotated_reads):
+        barcode = parse_read_header(description).get("barcode")
+        if barcode is not None:
+            barcodes[name] = barcode
+    return barcodes
+
+def sketch_reads(reads, k, max_hash, barcodes=None):
+    #returns {group: sorted unique hashes} of the k-mers of the reads, one group ("") for the
+    #batch or, given the {read_name: barcode} of the reads, one group per barcode
+    groups = defaultdict(list)
+    with open_reads(reads) as fh:
+        records = zip(fh, fh, fh, fh)
+        for chunk in iter(lambda: list(itertools.islice(records, READS_PER_CHUNK)), []):
+            sequences = defaultdict(list)
+            for header, sequence, plus, quality in chunk:
+                group = barcodes.get(header[1:].split(None, 1)[0], "none") if barcodes is not None else ""
+                sequences[group].append(sequence.rstrip().upper().encode())
+            for group, group_sequences in sequences.items():
+                groups[group].append(sketch_sequences(group_sequences, k, max_hash))
+    return dict((group, np.unique(np.concatenate(hashes))) for group, hashes in groups.items())
+
+def score_references(hashes, references, group_hashes, n_references):
+    #the number of hashes each reference shares with the reads
+    return np.bincount(references[np.isin(hashes, group_hashes)], minlength=n_references)
+
+def select_references(sketch, reads, references_per_group, annotated_reads=None):
+    #returns the indices (in panel order) of the references picked for the batch, and the sketch header
+    header, hashes, references = load_sketch(sketch)
+    barcodes = read_barcodes(annotated_reads) if annotated_reads else None
+    groups = sketch_reads(reads, header["k"], (1 << 32) // header["scaled"], barcodes)
+    n_references = len(header["references"])
+    selected = set()
+    for group_hashes in groups.values():
+        scores = score_references(hashes, references, group_hashes, n_references)
+        # highest score first, ties in panel order
+        selected.update(np.argsort(-scores, kind="stable")[:references_per_group].tolist())
+    return sorted(selected), header
+
+def write_sub_panel(references, header, selected, output):
+    #copies the selected records of the reference file. The sketch is named after the content
+    #hash of the reference file (see get_reference_sketch in the Snakefile) so its offsets are of this file
+    with open(str(references), "rb") as fh, open(str(output) + ".tmp", "wb") as out:
+        for index in selected:
+            name, offset, length = header["references"][index]
+            fh.seek(offset)
+            out.write(fh.read(length))
+    os.replace(str(output) + ".tmp", str(output))
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    if args.reads:
+        selected, header = select_references(args.sketch, args.reads, args.references_per_group, args.annotated_reads)
+        write_sub_panel(args.references, header, selected, args.output)
+        print(f"Mapping against {len(selected)} of {len(header['references'])} references")
+    else:
+        write_sketch(args.references, args.sketch, args.kmer_size, args.scaled)
@@ -0,0 +1,75 @@
+import argparse
+import gzip
+import json
+import os
+
+from stage_metrics import count_reads
+
+# With `chunk_reads` a FASTQ is annotated in parts of that many reads (rules/chunks.smk), so the
+# first reads reach RAMPART long before the whole FASTQ is annotated. This splits the FASTQ into
+# {output}/{filename_stem}.partNNN.fastq (uncompressed) and, once every part has been annotated,
+# writes the marker {filename_stem}.complete:
+#   {"parts": ["reads.part000.csv", ...], "reads": n}
+# the names of the part reports (relative to the marker) and the total number of reads in them.
+# Part reports without a marker are from a FASTQ that hasn't been annotated completely.
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Split a FASTQ into parts, or mark the parts of a FASTQ as complete.')
+
+    parser.add_argument("--fastq", action="store", type=str, dest="fastq")
+    parser.add_argument("--reads_per_part", default=1000, action="store", type=int, dest="reads_per_part")
+    parser.add_argument("--output", action="store", type=str, dest="output",
+                        help="directory the parts are written to")
+
+    parser.add_argument("--reports", nargs="*", default=[], action="store", type=str, dest="reports",
+                        help="the reports of all the parts")
+    parser.add_argument("--complete", action="store", type=str, dest="complete",
+                        help="marker written once the parts are all annotated")
+
+    return parser.parse_args()
+
+def part_name(filename_stem, part):
+    return f"{filename_stem}.part{part:03d}"
+
+def split_reads(fastq, reads_per_part, output):
+    #returns the number of parts written
+    filename_stem = os.path.basename(str(fastq))
+    for extension in (".gz", ".fastq"):
+        if filename_stem.endswith(extension):
+            filename_stem = filename_stem[:-len(extension)]
+    os.makedirs(output, exist_ok=True)
+
+    opener = gzip.open if str(fastq).endswith(".gz") else open
+    part, reads, out = 0, 0, None
+    with opener(str(fastq), "rb") as fh:
+        for record in zip(fh, fh, fh, fh):
+            if out is None:
+                out = open(os.path.join(output, part_name(filename_stem, part) + ".fastq"), "wb")
+            out.writelines(record)
+            reads += 1
+            if reads == reads_per_part:
+                out.close()
+                part, reads, out = part + 1, 0, None
+    if out is not None:
+        out.close()
+        part += 1
+    return part
+
+def write_complete(reports, complete):
+    #written to a temporary name and moved into place once complete
+    marker = {
+        "parts": [os.path.relpath(os.path.abspath(report), os.path.dirname(os.path.abspath(complete))) for report in reports],
+        "reads": sum(count_reads(report) for report in reports)
+    }
+    with open(complete + ".tmp", "w") as fh:
+        json.dump(marker, fh)
+    os.replace(complete + ".tmp", complete)
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    if args.complete:
+        write_complete(args.reports, args.complete)
+    else:
+        print(f"Split {args.fastq} into {split_reads(args.fastq, args.reads_per_part, args.output)} parts")
@@ -0,0 +1,131 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from annotation_format import read_columnar_header
+
+# Per-stage metrics of a batch (config `metrics`). Each rule's command is run through this script:
+#   python stage_metrics.py --stage minimap2 --log temp/{stem}.stages.jsonl --inputs reads.fastq -- minimap2 ...
+# which runs the command unchanged and appends its wall time, the bytes of its input files and
+# its peak RSS to the batch's log. The last stage also gets --summary (plus --fastq and --report):
+# once its command is done the log is combined into the batch metrics json, with reads/sec per
+# stage and the queue lag from the FASTQ being written to the report being complete, and one
+# "####" line per stage is printed for RAMPART to show.
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run a pipeline stage and record its metrics.')
+
+    parser.add_argument("--stage", action="store", type=str, dest="stage")
+    parser.add_argument("--log", action="store", type=str, dest="log",
+                        help="per batch log the stage metrics are appended to")
+    parser.add_argument("--inputs", nargs="*", default=[], action="store", type=str, dest="inputs")
+
+    parser.add_argument("--summary", action="store", type=str, dest="summary",
+                        help="write the batch metrics json here once the command is done")
+    parser.add_argument("--fastq", action="store", type=str, dest="fastq")
+    parser.add_argument("--report", action="store", type=str, dest="report")
+
+    parser.add_argument("command", nargs=argparse.REMAINDER)
+
+    return parser.parse_args()
+
+def run_stage(stage, command, inputs, stdout=None):
+    #runs the command, returns its exit code and metrics
+    bytes_read = sum(os.path.getsize(i) for i in inputs if os.path.exists(i))
+    started = time.time()
+    process = subprocess.Popen(command, stdout=stdout)
+    pid, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    stage_metrics = {
+        "stage": stage,
+        "started": started,
+        "seconds": time.time() - started,
+        "bytes_read": bytes_read,
+        # ru_maxrss is in kilobytes on linux
+        "peak_rss": usage.ru_maxrss * 1024
+    }
+    return process.returncode, stage_metrics
+
+def append_to_log(log, stage_metrics):
+    # one short line per write, so stages running at the same time don't interleave
+    with open(log, "a") as fh:
+        fh.write(json.dumps(stage_metrics) + "\n")
+
+def read_log(log):
+    #the latest metrics of each stage in the log (a rerun replaces earlier attempts), in run order
+    stages = {}
+    if os.path.exists(log):
+        with open(log) as fh:
+            for line in fh:
+                if line.strip():
+                    stage_metrics = json.loads(line)
+                    stages[stage_metrics["stage"]] = stage_metrics
+    return sorted(stages.values(), key=lambda stage_metrics: stage_metrics["started"])
+
+def count_reads(report):
+    #number of reads in the csv or columnar report
+    if report.endswith(".rac"):
+        return read_columnar_header(report)["rows"]
+    with open(report, "rb") as fh:
+        return sum(block.count(b"\n") for block in iter(lambda: fh.read(1 << 20), b"")) - 1
+
+def summarise(stages, stem, fastq, report):
+    reads = count_reads(report)
+    metrics = {
+        "filename_stem": stem,
+        "reads": reads,
+        "fastq_bytes": os.path.getsize(fastq),
+        "seconds": sum(stage_metrics["seconds"] for stage_metrics in stages),
+        # from the FASTQ being written (by MinKNOW) to its report being complete
+        "queue_lag": os.path.getmtime(report) - os.path.getmtime(fastq),
+        "stages": {}
+    }
+    for stage_metrics in stages:
+        metrics["stages"][stage_metrics["stage"]] = {
+            "seconds": stage_metrics["seconds"],
+            "reads_per_second": reads / stage_metrics["seconds"] if stage_metrics["seconds"] else None,
+            "bytes_read": stage_metrics["bytes_read"],
+            "peak_rss": stage_metrics["peak_rss"]
+        }
+    return metrics
+
+def format_metrics(metrics):
+    #the "####" lines RAMPART passes on to the front end
+    lines = []
+    for stage, stage_metrics in metrics["stages"].items():
+        line = f"#### {metrics['filename_stem']} {stage}: {stage_metrics['seconds']:.1f}s"
+        if stage_metrics["reads_per_second"] is not None:
+            line += f", {stage_metrics['reads_per_second']:.0f} reads/s"
+        line += f", {stage_metrics['bytes_read'] / 1e6:.1f} MB read"
+        if stage_metrics["peak_rss"] is not None:
+            line += f", peak RSS {stage_metrics['peak_rss'] / 1e6:.0f} MB"
+        lines.append(line)
+    lines.append(f"#### {metrics['filename_stem']}: {metrics['reads']} reads in {metrics['seconds']:.1f}s, "
+                 f"annotated {metrics['queue_lag']:.1f}s after the FASTQ was written")
+    return lines
+
+def write_summary(summary, metrics):
+    with open(summary + ".tmp", "w") as fh:
+        json.dump(metrics, fh, indent=2)
+    os.replace(summary + ".tmp", summary)
+    for line in format_metrics(metrics):
+        print(line, flush=True)
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    returncode, stage_metrics = run_stage(args.stage, command, args.inputs)
+    if returncode != 0:
+        sys.exit(returncode)
+
+    append_to_log(args.log, stage_metrics)
+
+    if args.summary:
+        stem = os.path.splitext(os.path.basename(args.report))[0]
+        write_summary(args.summary, summarise(read_log(args.log), stem, args.fastq, args.report))
+        os.remove(args.log)
@@ -0,0 +1,41 @@
+import argparse
+import contextlib
+import gzip
+import sys
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Decompress a fastq to stdout, keeping a copy of the read headers.')
+
+    parser.add_argument("--input", action="store", type=str, dest="input")
+    parser.add_argument("--headers", action="store", type=str, dest="headers",
+                        help="file to write the header line of each record to")
+    parser.add_argument("--offsets", action="store", type=str, dest="offsets",
+                        help="file to write the name, offset and length of each record to, for read_index.py")
+
+    return parser.parse_args()
+
+def tee_fastq_headers(fastq, output, headers, offsets=None):
+    #copies the (unwrapped, four line) fastq records to output and every header line to headers,
+    #and the offset and length of every record in the uncompressed stream to offsets
+    if offsets is None:
+        for i, line in enumerate(fastq):
+            output.write(line)
+            if i % 4 == 0:
+                headers.write(line)
+        return
+    offset = 0
+    for record in zip(fastq, fastq, fastq, fastq):
+        length = len(record[0]) + len(record[1]) + len(record[2]) + len(record[3])
+        output.writelines(record)
+        headers.write(record[0])
+        offsets.write(f"{record[0][1:].split(None, 1)[0].decode()}\t{offset}\t{length}\n")
+        offset += length
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    opener = gzip.open if args.input.endswith(".gz") else open
+    with opener(args.input, "rb") as fastq, open(args.headers, "wb") as headers, \
+            (open(args.offsets, "w") if args.offsets else contextlib.nullcontext()) as offsets:
+        tee_fastq_headers(fastq, sys.stdout.buffer, headers, offsets)
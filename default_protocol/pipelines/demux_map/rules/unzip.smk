@@ -1,21 +1,33 @@
 rule unzip:
     """
     Uses the python standard library to copy a gzipped file to an unzipped file.
-    Would be faster to use shell commands, but this reduces dependencies
+    Would be faster to use shell commands, but this reduces dependencies.
+    With `index_reads` it also writes the offsets of the reads for rule `index_reads`.
     """
     input:
         config["input_path"] + "/{filename_stem}.fastq.gz"
+    params:
+        path_to_script = workflow.current_basedir,
+        metrics = stage_metrics("unzip"),
+        offsets = offsets_argument
     output:
-        temp(config["output_path"] + "/temp/{filename_stem}.fastq")
-    run:
-        import gzip
-        import shutil
-        with gzip.open(input[0], 'rb') as f_in:
-            with open(output[0], 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
+        fastq = temp(config["output_path"] + "/temp/{filename_stem}.fastq"),
+        **read_offsets_output()
+    shell:
+        """
+        {params.metrics} python {params.path_to_script}/read_index.py \
+        --unzip {input:q} \
+        --output {output.fastq:q} \
+        {params.offsets}
+        """
 
 
 def get_unzipped_fastq(wildcards):
+    stem, part = split_part(wildcards.filename_stem)
+    if part is not None:
+        return config["output_path"] + f"/temp/{stem}.parts/" + "{filename_stem}.fastq" # rule `split_reads` wrote this (uncompressed)
+    if stream_gzip:
+        return config["input_path"] + "/{filename_stem}.fastq.gz" # minimap2, mappy and porechop all read gzip
     if config["filename_ext"] == ".fastq.gz":
         return config["output_path"] + "/temp/{filename_stem}.fastq" # will call rule `unzip` to make this file
     return config["input_path"] + "/{filename_stem}.fastq"
\ No newline at end of file
@@ -0,0 +1,63 @@
+import argparse
+import sys
+
+from annotation_format import read_columnar
+
+# Checks that mapping against the sub-panels picked by the prefilter (config `prefilter`, see
+# reference_sketch.py) gives the same best reference for every read as mapping against the whole
+# panel. Annotate the same FASTQs twice, with `prefilter` off and on, into two output paths and
+# compare the reports:
+#   python validate_prefilter.py --full full/reads.csv --prefiltered prefiltered/reads.csv
+# The exit code is 1 if any read has a different best reference.
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare the best reference of each read with and without the reference prefilter.')
+
+    parser.add_argument("--full", nargs="+", action="store", type=str, dest="full",
+                        help="reports of mapping against the whole panel")
+    parser.add_argument("--prefiltered", nargs="+", action="store", type=str, dest="prefiltered",
+                        help="reports of the same FASTQs mapped with the prefilter, in the same order")
+    parser.add_argument("--show", default=10, action="store", type=int, dest="show",
+                        help="number of differing reads to print")
+
+    return parser.parse_args()
+
+def best_references(report):
+    #{read_name: best_reference} of a csv or columnar report
+    if str(report).endswith(".rac"):
+        names, columns = read_columnar(report)
+        return dict(zip(columns["read_name"], columns["best_reference"]))
+    best = {}
+    with open(str(report)) as fh:
+        next(fh, None)
+        for line in fh:
+            fields = line.split(",", 5)
+            best[fields[0]] = fields[4]
+    return best
+
+def compare_reports(full, prefiltered):
+    #returns the number of reads compared and the (read_name, full, prefiltered) best references that differ
+    full_best = best_references(full)
+    prefiltered_best = best_references(prefiltered)
+    differences = [(name, reference, prefiltered_best.get(name, "missing")) for name, reference in full_best.items()
+                   if prefiltered_best.get(name) != reference]
+    return len(full_best), differences
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    if len(args.full) != len(args.prefiltered):
+        sys.exit("give as many --prefiltered reports as --full reports")
+
+    reads = 0
+    differences = []
+    for full, prefiltered in zip(args.full, args.prefiltered):
+        compared, differing = compare_reports(full, prefiltered)
+        reads += compared
+        differences.extend(differing)
+
+    for name, reference, prefiltered_reference in differences[:args.show]:
+        print(f"{name}: {reference} (whole panel), {prefiltered_reference} (prefiltered)")
+    print(f"{reads - len(differences)} of {reads} reads have the same best reference with the prefilter")
+    sys.exit(1 if differences else 0)
@@ -14,6 +14,7 @@
 
 
 const { spawn } = require('child_process');
+const os = require('os');
 const Deque = require("collections/deque");
 var kill = require('tree-kill');
 const { verbose, warn } = require("./utils");
@@ -33,9 +34,11 @@ class PipelineRunner {
      * @property {Object}         opts
      * @property {object}         opts.config         The pipeline config definition.
      * @property {false|Function} opts.onSuccess      callback when snakemake is successful. Callback arguments: `job`. Only used if `queue` is true.
+     * @property {false|Function} opts.onResult       callback when the pipeline announces a result file while it is still running,
+     *                                                by printing a line "@@@@ <path>". Callback arguments: `path`.
      * @property {Boolean}        opts.queue
      */
-    constructor({config, onSuccess=false, queue=false}) {
+    constructor({config, onSuccess=false, onResult=false, queue=false}) {
         this._name = config.name;
         this._snakefile = config.path + "Snakefile";
         this._configfile = config.config_file ?
@@ -44,10 +47,28 @@ class PipelineRunner {
 
         this._configOptions = config.configOptions;
 
+        /* an optional long-lived process which runs jobs sent to it on stdin (see `_runWorkerJob`) */
+        this._worker = config.worker ?
+            config.path + config.worker :
+            false;
+        this._workerProcess = undefined;
+        this._workerFailed = false;
+        this._workerJobs = {}; // promise callbacks of jobs sent to the worker, by job ID
+        this._workerJobCount = 0;
+
         this._processedCount = 0;
+        this._onResult = onResult;
 
         this._threadsRequested = config.threads_requested || 1;
 
+        /* queued jobs which differ only in `filename_stem` can be run by one snakemake invocation
+        (up to `batch_size` of them, waiting up to `batch_wait` seconds for a batch to fill) */
+        this._batchSize = config.batch_size || 1;
+        this._batchWait = config.batch_wait || 0;
+        this._batchCores = config.batch_cores || Math.max(this._threadsRequested, os.cpus().length);
+        this._batchTimer = undefined;
+        this._queuedAt = new WeakMap(); // when each queued job was added
+
         this._isRunning = false;
         if (queue) {
             this._onSuccess = onSuccess; // callback
@@ -90,6 +111,7 @@ class PipelineRunner {
         if (!this._jobQueue) {
             throw new Error(`Pipeline, ${this._name}, is not set up with a queue`)
         }
+        this._queuedAt.set(job, Date.now());
         this._jobQueue.push(job);
     }
 
@@ -137,22 +159,206 @@ class PipelineRunner {
             .filter((d) => d!=="")
     }
 
+    _getPipelineConfig(job) {
+        let pipelineConfig = {}; // what snakemake's going to receive via `--config`
+        // add in any (optional) configuration options defined for the entire pipeline
+        if (this._configOptions) {
+            pipelineConfig = {...pipelineConfig, ...this._configOptions}
+        }
+        // add in job-specific config options
+        return {...pipelineConfig, ...job};
+    }
+
     /**
-     * private method to actually spawn a Snakemake pipeline and capture output.
+     * private method to run a job. This uses the pipeline's worker process if one is defined
+     * and falls back to running Snakemake if the worker can't run the job.
      * @param {Object} job snakemake config key-value pairs
      * @returns {Promise<*>}
      * @private
      */
     async _runPipeline(job) {
-        return new Promise((resolve, reject) => {
+        if (this._worker && !this._workerFailed) {
+            try {
+                await this._runWorkerJob(job);
+                return;
+            } catch (err) {
+                warn(`pipeline (${this._name}) worker failed to run job (${err}) - running snakemake instead`);
+            }
+        }
+        await this._runSnakemake(job);
+    }
 
-            let pipelineConfig = {}; // what snakemake's going to receive via `--config`
-            // add in any (optional) configuration options defined for the entire pipeline
-            if (this._configOptions) {
-                pipelineConfig = {...pipelineConfig, ...this._configOptions}
+    /**
+     * private method to start the worker process. The worker reads one JSON job per line on stdin
+     * and replies with one JSON line on stdout. Any other output (on stderr) is treated as
+     * snakemake's stdout is, i.e. lines starting with "####" are passed to the front end.
+     * @private
+     */
+    _startWorker() {
+        const spawnArgs = [this._worker];
+        if (this._configfile) {
+            spawnArgs.push(...['--configfile', this._configfile]);
+        }
+        verbose(`pipeline (${this._name})`, `python ` + spawnArgs.join(" "));
+        this._workerProcess = spawn('python', spawnArgs);
+
+        let partialLine = "";
+        this._workerProcess.stdout.on(
+            'data',
+            (data) => {
+                const lines = (partialLine + data.toString()).split("\n");
+                partialLine = lines.pop();
+                lines.filter((line) => line.trim()).forEach((line) => {
+                    let response;
+                    try {
+                        response = JSON.parse(line);
+                    } catch (err) {
+                        verbose(`pipeline (${this._name})`, line);
+                        return;
+                    }
+                    const callbacks = this._workerJobs[response.id];
+                    if (!callbacks) return;
+                    delete this._workerJobs[response.id];
+                    if (response.status === "success") {
+                        callbacks.resolve(response);
+                    } else {
+                        callbacks.reject(response.message);
+                    }
+                });
+            }
+        );
+
+        this._workerProcess.stderr.on(
+            'data',
+            (data) => {
+                data.toString().split("\n").filter((line) => line.trim()).forEach((line) => {
+                    if (line.startsWith("####")) {
+                        this._sendMessage("info", line.substring(4).trim());
+                    }
+                    verbose(`pipeline (${this._name})`, line);
+                });
+            }
+        );
+
+        const workerStopped = (reason) => {
+            if (!this._workerProcess) return;
+            warn(`pipeline (${this._name}) worker stopped (${reason}). Jobs will be run using snakemake.`);
+            this._workerProcess = undefined;
+            this._workerFailed = true;
+            Object.values(this._workerJobs).forEach((callbacks) => callbacks.reject(reason));
+            this._workerJobs = {};
+        };
+        this._workerProcess.on('error', (err) => workerStopped(err.message));
+        this._workerProcess.on('exit', (code) => workerStopped(`exit code ${code}`));
+    }
+
+    /**
+     * private method to send a job to the worker process (starting it if needed).
+     * @param {Object} job snakemake config key-value pairs
+     * @returns {Promise<*>} resolves with the worker's response
+     * @private
+     */
+    async _runWorkerJob(job) {
+        if (!this._workerProcess) {
+            this._startWorker();
+        }
+        const id = ++this._workerJobCount;
+        this._sendMessage("start", job.name || "");
+        const response = await new Promise((resolve, reject) => {
+            this._workerJobs[id] = {resolve, reject};
+            this._workerProcess.stdin.write(JSON.stringify({id, config: this._getPipelineConfig(job)}) + "\n");
+        });
+        this._sendMessage("success", job.name || "");
+        return response;
+    }
+
+    /**
+     * private method to run a batch of queued jobs (see `_takeBatch`) as a single snakemake job with
+     * a list of `filename_stem`s. If it fails, the jobs are run one by one (snakemake skips the files
+     * the batch did annotate) so that a single bad file doesn't fail the others.
+     * @param {Array} jobs
+     * @returns {Promise<Array>} the jobs which were successfully run
+     * @private
+     */
+    async _runBatch(jobs) {
+        if (jobs.length === 1) {
+            await this._runPipeline(jobs[0]); // will throw if job fails
+            return jobs;
+        }
+        const batchJob = {...jobs[0], filename_stem: jobs.map((job) => job.filename_stem)};
+        try {
+            await this._runSnakemake(batchJob, this._batchCores);
+            return jobs;
+        } catch (err) {
+            warn(`${err} - running the ${jobs.length} files of the batch separately`);
+        }
+        const succeeded = [];
+        for (const job of jobs) {
+            try {
+                await this._runPipeline(job);
+                succeeded.push(job);
+            } catch (err) {
+                warn(err);
             }
-            // add in job-specific config options
-            pipelineConfig = {...pipelineConfig, ...job};
+        }
+        return succeeded;
+    }
+
+    /**
+     * private method to take the next job off the queue, along with the queued jobs after it which
+     * can run in the same snakemake invocation (all their config but `filename_stem` is the same).
+     * Jobs for the worker are not batched.
+     * @returns {Array} the jobs
+     * @private
+     */
+    _takeBatch() {
+        const batch = [this._jobQueue.shift()];
+        if (this._batchSize <= 1 || (this._worker && !this._workerFailed) || batch[0].filename_stem === undefined) {
+            return batch;
+        }
+        const batchKey = (job) => JSON.stringify({...job, filename_stem: undefined});
+        const key = batchKey(batch[0]);
+        while (this._jobQueue.length && batch.length < this._batchSize && batchKey(this._jobQueue.peek()) === key) {
+            batch.push(this._jobQueue.shift());
+        }
+        return batch;
+    }
+
+    /**
+     * private method to decide if the queue should wait (up to `batch_wait` seconds after the oldest
+     * job was added) for more jobs to fill a batch. If so a timer to run the queue is set.
+     * @returns {Boolean}
+     * @private
+     */
+    _waitForBatch() {
+        if (this._batchSize <= 1 || !this._batchWait || this._jobQueue.length >= this._batchSize ||
+            (this._worker && !this._workerFailed)) {
+            return false;
+        }
+        const remaining = this._queuedAt.get(this._jobQueue.peek()) + this._batchWait * 1000 - Date.now();
+        if (remaining <= 0) {
+            return false;
+        }
+        if (!this._batchTimer) {
+            this._batchTimer = setTimeout(() => {
+                this._batchTimer = undefined;
+                this._runJobsInQueue();
+            }, remaining);
+        }
+        return true;
+    }
+
+    /**
+     * private method to actually spawn a Snakemake pipeline and capture output.
+     * @param {Object} job snakemake config key-value pairs
+     * @param {Number} cores value of snakemake's --cores (default: `threads_requested`)
+     * @returns {Promise<*>}
+     * @private
+     */
+    async _runSnakemake(job, cores=this._threadsRequested) {
+        return new Promise((resolve, reject) => {
+
+            const pipelineConfig = this._getPipelineConfig(job);
             let spawnArgs = ['--snakefile', this._snakefile];
             if (this._configfile) {
                 spawnArgs.push(...['--configfile', this._configfile])
@@ -164,7 +370,11 @@ class PipelineRunner {
             spawnArgs.push('--rerun-incomplete');
 
             /* Snakemake accepts a --cores arg, and 5.11 made this compulsory */
-            spawnArgs.push(...['--cores', this._threadsRequested]);
+            spawnArgs.push(...['--cores', cores]);
+            /* a batch of files carries on with the others if one fails */
+            if (Array.isArray(job.filename_stem)) {
+                spawnArgs.push('--keep-going');
+            }
 
             verbose(`pipeline (${this._name})`, `snakemake ` + spawnArgs.join(" "));
 
@@ -173,14 +383,22 @@ class PipelineRunner {
             this._process = spawn('snakemake', spawnArgs);
 
             const out = [];
+            let partialLine = "";
             this._process.stdout.on(
                 'data',
                 (data) => {
                     const message = data.toString();
-                    if (message.startsWith("####")) {
-                        // pass message to front end
-                        this._sendMessage("info", message.substring(4).trim());
-                    }
+                    // pass "####" lines to front end and "@@@@" lines (results ready before the job is done)
+                    // to `onResult`. A chunk of stdout may hold several lines, or end part way through one
+                    const lines = (partialLine + message).split("\n");
+                    partialLine = lines.pop();
+                    lines.forEach((line) => {
+                        if (line.startsWith("####")) {
+                            this._sendMessage("info", line.substring(4).trim());
+                        } else if (line.startsWith("@@@@") && this._onResult) {
+                            this._onResult(line.substring(4).trim());
+                        }
+                    });
                     out.push(message);
                     verbose(`pipeline (${this._name})`, message);
                 }
@@ -226,15 +444,19 @@ class PipelineRunner {
     async _runJobsInQueue() {
         if (this._jobQueue.length > 0) {
             if (!this._isRunning) {
+                if (this._waitForBatch()) return;
                 this._isRunning = true;
 
-                verbose(`pipeline (${this._name})`, `queue length: ${this._jobQueue.length + 1}, processed ${this._processedCount} files`);
+                verbose(`pipeline (${this._name})`, `queue length: ${this._jobQueue.length}, processed ${this._processedCount} files`);
 
-                const job = this._jobQueue.shift();
+                const jobs = this._takeBatch();
+                if (jobs.length > 1) {
+                    verbose(`pipeline (${this._name})`, `running a batch of ${jobs.length} files`);
+                }
                 try {
-                    await this._runPipeline(job);
-                    this._processedCount += 1;
-                    if (this._onSuccess) this._onSuccess(job);
+                    const succeeded = await this._runBatch(jobs);
+                    this._processedCount += succeeded.length;
+                    if (this._onSuccess) succeeded.forEach((job) => this._onSuccess(job));
                 } catch (err) {
                     // trace(err);
                     warn(err)
@@ -252,6 +474,9 @@ class PipelineRunner {
      * Partial implementation. TODO.
      */
     close() {
+        if (this._workerProcess) {
+            this._workerProcess.stdin.end();
+        }
         delete global.pipelineRunners[this.key];
         this._sendMessage("closed", "Pipeline now closed.");
     }
@@ -13,35 +13,87 @@
  */
 
 /**
- * Code related to parsing an annotated CSV file & adding it to `global.datastore`
+ * Code related to parsing an annotated CSV (or columnar) file & adding it to `global.datastore`
  */
 const fs = require('fs');
 const path = require('path');
 const dsv = require('d3-dsv');
 const Deque = require("collections/deque");
 const { warn, verbose, sleep } = require('./utils');
-const { UNASSIGNED_LABEL, UNMAPPED_LABEL } = require('./magics');
+const { UNASSIGNED_LABEL, UNMAPPED_LABEL, ANNOTATION_EXTENSIONS } = require('./magics');
 
 const parsingQueue = new Deque();
 let isRunning = false; // prevent this being called by parsingQueue.observeRangeChange() when parsingQueue.shift is called
 
 parsingQueue.observeRangeChange( () => { annotationParser(); } );
 
+/**
+ * The file extension of the annotation report, which depends on the pipeline's `output_format`
+ * @param {object} configOptions annotation pipeline config options
+ * @returns {string}
+ */
+const getAnnotationExtension = (configOptions) => ANNOTATION_EXTENSIONS[configOptions.output_format] || ".csv";
+
+const isAnnotationFile = (filepath) => Object.values(ANNOTATION_EXTENSIONS).includes(path.extname(filepath));
+
 /**
  * An annotated CSV to add to the parsing queue
  * @param {string} filepath
  */
 const addToParsingQueue = (filepath) => parsingQueue.push(filepath);
 
+/**
+ * Read a columnar annotation file (`output_format: columnar`, see the demux_map pipeline's
+ * rules/annotation_format.py for the layout). Returns the same row objects as `csvParse` except
+ * that numbers are already numbers and `start_time` is in ms since the epoch (NaN if unknown).
+ * @param {Buffer} buffer file contents
+ * @returns {Array} one object per read
+ */
+const parseColumnarAnnotations = (buffer) => {
+    if (buffer.toString("latin1", 0, 4) !== "RAC1") {
+        throw new Error("not a columnar annotation file");
+    }
+    const headerLength = buffer.readUInt32LE(4);
+    const header = JSON.parse(buffer.toString("utf8", 8, 8 + headerLength));
+    const dataStart = 8 + headerLength;
+
+    const columns = header.columns.map((column) => {
+        const start = dataStart + column.offset;
+        const block = buffer.buffer.slice(buffer.byteOffset + start, buffer.byteOffset + start + column.length);
+        switch (column.type) {
+            case "lines":
+                return header.rows ? buffer.toString("utf8", start, start + column.length).split("\n") : [];
+            case "int32":
+                return new Int32Array(block);
+            case "dict":
+                return Array.from(new Int32Array(block), (code) => column.values[code]);
+            case "time":
+                return Array.from(new BigInt64Array(block), (seconds) => seconds < 0 ? NaN : Number(seconds) * 1000);
+            default:
+                throw new Error(`unknown column type ${column.type}`);
+        }
+    });
+
+    const annotations = new Array(header.rows);
+    for (let i = 0; i < header.rows; i++) {
+        const d = {};
+        header.columns.forEach((column, j) => {d[column.name] = columns[j][i];});
+        annotations[i] = d;
+    }
+    return annotations;
+};
+
 async function parseAnnotations(fileToParse) {
     if (!fs.existsSync(fileToParse)) {
         warn(`Annotation file, ${fileToParse}, doesn't exist - skipping.`);
         return undefined;
     }
-    const annotations = await dsv.csvParse(fs.readFileSync(fileToParse).toString());
+    const annotations = path.extname(fileToParse) === ANNOTATION_EXTENSIONS.columnar ?
+        parseColumnarAnnotations(fs.readFileSync(fileToParse)) :
+        await dsv.csvParse(fs.readFileSync(fileToParse).toString());
     verbose(
         "annotation parser",
-        `parsed annotation file, ${path.basename(fileToParse, '.csv')} (${annotations.length} lines)`
+        `parsed annotation file, ${path.basename(fileToParse, path.extname(fileToParse))} (${annotations.length} lines)`
     );
     return annotations;
 }
@@ -57,7 +109,7 @@ const annotationParser = async () => {
         isRunning = true;
 
         const fileToParse = parsingQueue.shift();
-        const filenameStem = path.basename(fileToParse, '.csv');
+        const filenameStem = path.basename(fileToParse, path.extname(fileToParse));
         let annotations;
 
         verbose("annotation parser", `Parsing annotation for ${filenameStem}`);
@@ -141,7 +193,7 @@ const createReadsFromAnnotation = (fastqStem, annotations) => {
             dataPoint.topRefHitSimilarity = parseInt(d.num_matches, 10) / parseInt(d.mapping_len, 10);
         }
         dataPoint.readLength = readLength;
-        dataPoint.time = (new Date(d.start_time)).getTime();
+        dataPoint.time = typeof d.start_time === "number" ? d.start_time : (new Date(d.start_time)).getTime();
 
         reads.push(dataPoint);
     });
@@ -150,5 +202,7 @@ const createReadsFromAnnotation = (fastqStem, annotations) => {
 
 module.exports = {
     addToParsingQueue,
+    getAnnotationExtension,
+    isAnnotationFile,
     createReadsFromAnnotation
 };
@@ -17,7 +17,7 @@ const yaml = require('js-yaml');
 const path = require('path');
 const { getAbsolutePath, warn, fatal, ensurePathExists, verbose } = require("../utils");
 const { assert, findConfigFile, getBarcodesInConfig } = require("./helpers");
-const { addToParsingQueue } = require("../annotationParser");
+const { addToParsingQueue, getAnnotationExtension } = require("../annotationParser");
 const { PipelineRunner } = require('../PipelineRunner');
 
 /**
@@ -69,7 +69,12 @@ function setUpPipelines(config, args, pathCascade) {
                 pipelineRunners[key] = new PipelineRunner({
                     config: pipeline,
                     onSuccess: (job) => {
-                        addToParsingQueue(path.join(job.output_path, job.filename_stem + '.csv'));
+                        /* a FASTQ annotated in parts (`chunk_reads`) has a `.complete` marker, its parts were queued by `onResult` */
+                        if (fs.existsSync(path.join(job.output_path, job.filename_stem + ".complete"))) return;
+                        addToParsingQueue(path.join(job.output_path, job.filename_stem + getAnnotationExtension(pipeline.configOptions)));
+                    },
+                    onResult: (filepath) => {
+                        addToParsingQueue(filepath);
                     },
                     queue: true
                 });
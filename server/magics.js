@@ -1,5 +1,7 @@
 
 module.exports = {
   UNMAPPED_LABEL: "unmapped",
-  UNASSIGNED_LABEL: "unassigned"
+  UNASSIGNED_LABEL: "unassigned",
+  /* file extension of the annotation report for each `output_format` of the annotation pipeline */
+  ANNOTATION_EXTENSIONS: {csv: ".csv", columnar: ".rac"}
 };
\ No newline at end of file
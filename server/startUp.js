@@ -14,11 +14,18 @@
 
 const fs = require('fs');
 const path = require('path');
+const crypto = require('crypto');
 const { promisify } = require('util');
-const { addToParsingQueue } = require("./annotationParser");
+const { addToParsingQueue, isAnnotationFile } = require("./annotationParser");
 const readdir = promisify(fs.readdir);
 const { prettyPath, log } = require('./utils');
 
+/* the run manifest the annotation pipeline appends each annotated FASTQ to (see demux_map/rules/manifest.py) */
+const MANIFEST_FILENAME = "manifest.jsonl";
+
+/* the annotated files of a FASTQ annotated in parts (annotation option `chunk_reads`) are named `{stem}.partNNN` */
+const PART_REGEX = /\.part\d+$/;
+
 async function getCSVs(dir) {
   const dirents = await readdir(dir, { withFileTypes: true });
   const files = await Promise.all(dirents.map((dirent) => {
@@ -26,7 +33,7 @@ async function getCSVs(dir) {
     return dirent.isDirectory() ? getCSVs(res) : res;
   }));
   return Array.prototype.concat(...files)
-    .filter((f) => f.endsWith('.csv'));
+    .filter(isAnnotationFile);
 }
 
 
@@ -67,28 +74,91 @@ const removeExistingAnnotatedCSVs = async () => {
   await deleteCSVsRecursive(global.config.run.annotatedPath);
 }
 
+/**
+ * Read the run manifest in the annotated folder
+ * Returns a Map of (absolute) report path -> the latest entry for it, or `undefined` if there is no manifest
+ */
+const readManifest = (annotatedPath) => {
+    const manifestPath = path.join(annotatedPath, MANIFEST_FILENAME);
+    if (!fs.existsSync(manifestPath)) return undefined;
+    const entries = new Map();
+    fs.readFileSync(manifestPath, 'utf8').split("\n").forEach((line) => {
+        if (!line.trim()) return;
+        try {
+            const entry = JSON.parse(line);
+            entries.set(path.resolve(annotatedPath, entry.report), entry);
+        } catch (err) {
+            /* a line cut short by a crash, its report will be annotated again */
+        }
+    });
+    return entries;
+}
+
+/**
+ * Is the annotated file the one recorded in the manifest `entry`, and is its FASTQ unchanged since?
+ * If the FASTQ isn't there any more the report is kept, so a run can be started from annotated files
+ */
+const matchesManifest = (report, entry) => {
+    if (!entry) return false;
+    const sha1 = crypto.createHash('sha1').update(fs.readFileSync(report)).digest('hex');
+    if (sha1 !== entry.sha1) return false;
+    if (!fs.existsSync(entry.fastq)) return true;
+    const stat = fs.statSync(entry.fastq, { bigint: true });
+    return Number(stat.size) === entry.size && Number(stat.mtimeNs) === entry.mtime_ns;
+}
+
 /**
  * Process existing annotated CSVs
  * Adds these (as appropriate, no duplicates) to parsing queues and filesSeen (so no dups)
+ * The annotation of a FASTQ is removed, so that the FASTQ is annotated again, if
+ *   - the annotated folder has a run manifest and the annotated file isn't recorded in it (e.g. RAMPART stopped
+ *     before the manifest was written) or its FASTQ has changed since
+ *   - it was annotated in parts (`{stem}.partNNN`, annotation option `chunk_reads`) and has no `{stem}.complete`
+ *     marker, i.e. not all of the parts were done
  */
 const processExistingAnnotatedCSVs = async () => {
-    const csvs = await getCSVs(global.config.run.annotatedPath)
-    const csvTransformFn = (f) => path.relative(global.config.run.annotatedPath, f).replace(/\.csv$/, '');
+    const annotatedPath = global.config.run.annotatedPath;
+    let csvs = await getCSVs(annotatedPath)
+    const csvTransformFn = (f) => path.relative(annotatedPath, f).replace(/\.(csv|rac)$/, '');
+    /* the name of the FASTQ an annotated file is from (as in `filesSeen`), the same for all of the parts of a FASTQ */
+    const fastqName = (f) => csvTransformFn(f).replace(PART_REGEX, '');
+
+    const manifest = readManifest(annotatedPath);
+    const fastqsToRedo = new Set();
+    csvs.forEach((f) => {
+        if (manifest && !matchesManifest(f, manifest.get(f))) {
+            fastqsToRedo.add(fastqName(f));
+        } else if (PART_REGEX.test(csvTransformFn(f)) && !fs.existsSync(path.join(annotatedPath, fastqName(f) + ".complete"))) {
+            fastqsToRedo.add(fastqName(f));
+        }
+    });
+    if (fastqsToRedo.size) {
+        csvs.filter((f) => fastqsToRedo.has(fastqName(f))).forEach((f) => fs.unlinkSync(f));
+        fastqsToRedo.forEach((name) => {
+            const marker = path.join(annotatedPath, name + ".complete");
+            if (fs.existsSync(marker)) fs.unlinkSync(marker);
+        });
+        log(`Removed the incomplete or out of date annotation of ${fastqsToRedo.size} FASTQs. These FASTQs will be annotated again.`);
+        csvs = csvs.filter((f) => !fastqsToRedo.has(fastqName(f)));
+    }
 
-    const pathsOfAnnotatedCSVs = csvs.sort(makeFileSortFunction(csvTransformFn));
-    log(`Found ${pathsOfAnnotatedCSVs.length} annotated CSV files in ${prettyPath(global.config.run.annotatedPath)}. FASTQs with the same filename as these will be ignored.`);
+    const byFastq = makeFileSortFunction(fastqName);
+    const byPart = makeFileSortFunction(csvTransformFn);
+    const pathsOfAnnotatedCSVs = csvs.sort((a, b) => byFastq(a, b) || byPart(a, b));
+    log(`Found ${pathsOfAnnotatedCSVs.length} annotated CSV files in ${prettyPath(annotatedPath)}. FASTQs with the same filename as these will be ignored.`);
     /* TODO - we could sort these based on time stamps if we wished */
     /* TODO - we could filter these to remove ones without a corresponding FASTQ, but that wouldn't let
     us start from annotated files which may be useful */
 
     pathsOfAnnotatedCSVs.forEach((f) => {
         addToParsingQueue(f);
-        global.filesSeen.add(csvTransformFn(f));
+        global.filesSeen.add(fastqName(f));
     });
     // console.log("After initial scan, filesSeen:", global.filesSeen)
 }
 
 module.exports = {
+    MANIFEST_FILENAME,
     removeExistingAnnotatedCSVs,
     processExistingAnnotatedCSVs,
     makeFileSortFunction
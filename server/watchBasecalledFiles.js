@@ -16,7 +16,7 @@ const chokidar = require('chokidar');
 const fs = require('fs');
 const path = require('path');
 const { sleep, verbose, log, warn } = require('./utils');
-const { makeFileSortFunction } = require("./startUp");
+const { makeFileSortFunction, MANIFEST_FILENAME } = require("./startUp");
 
 
 const newFastqFileHandler = (fileInfo) => {
@@ -35,7 +35,9 @@ const newFastqFileHandler = (fileInfo) => {
       input_path: fileInfo.dir,
       output_path: path.join(global.config.run.annotatedPath, fileInfo.subdir),
       filename_stem: fileInfo.name,
-      filename_ext: fileInfo.ext
+      filename_ext: fileInfo.ext,
+      /* one manifest for the run, whatever subdirectory the FASTQ is in */
+      manifest: path.join(global.config.run.annotatedPath, MANIFEST_FILENAME)
     });
     global.filesSeen.add(fileInfo.filesSeenName);
   } catch (err) {
@@ -0,0 +1,18 @@
+import os
+import sys
+
+# The pipeline scripts are run from their own directories and import their neighbours by name,
+# so their directories are put on the path for the tests.
+
+REPO_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+SCRIPT_DIRS = [
+    os.path.join(REPO_DIR, "default_protocol", "pipelines", "demux_map", "rules"),
+    os.path.join(REPO_DIR, "default_protocol", "pipelines", "bin_to_fastq"),
+    os.path.join(REPO_DIR, "unused_scripts"),
+    os.path.join(REPO_DIR, "tests", "parse_paf_benchmarks")
+]
+
+for script_dir in SCRIPT_DIRS:
+    if script_dir not in sys.path:
+        sys.path.insert(0, script_dir)
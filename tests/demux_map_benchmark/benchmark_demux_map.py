@@ -0,0 +1,198 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+# Runs the demux_map pipeline end-to-end on a data set from make_dataset.py and compares the
+# per-rule benchmarks across configurations and commits.
+#
+# Each --config (a name and key=value options passed to snakemake with --config) is run
+# --repeat times on every --pipeline (a demux_map directory, e.g. git worktrees of two commits),
+# annotating all of the data set's FASTQs in one snakemake run into a fresh output path. The
+# pipeline's `benchmark_path` option makes snakemake record the wall time, CPU time, peak RSS and
+# I/O of each job of the main rules (unzip, demultiplex, minimap2 and parse_mapping, or mappy) in
+# {benchmark_path}/{rule}/{filename_stem}.tsv; these are summed over the FASTQs of a run. The wall
+# and CPU time of the whole snakemake run (including building the reference index) are recorded too.
+#
+# The snakemake log of the last run is left in {work_dir}/snakemake.log. The results can be saved
+# as json (--save) and the results of several runs, e.g. on different machines or commits,
+# compared (--results a.json b.json) without running anything.
+
+PIPELINE_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "default_protocol", "pipelines", "demux_map"))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the rules of the demux_map pipeline across configurations and commits.')
+
+    parser.add_argument("--data_dir", action="store", type=str, dest="data_dir",
+                        help="data set written by make_dataset.py")
+    parser.add_argument("--pipeline", nargs="+", default=[PIPELINE_DIR], action="store", type=str, dest="pipelines",
+                        help="demux_map directories to benchmark, e.g. git worktrees of other commits")
+    parser.add_argument("--config", nargs="+", default=[], action="append", type=str, dest="configs",
+                        metavar="NAME [KEY=VALUE ...]",
+                        help="a configuration to benchmark, can be given more than once (default: the pipeline's config.yaml)")
+    parser.add_argument("--repeat", default=3, action="store", type=int, dest="repeat")
+    parser.add_argument("--cores", default=os.cpu_count(), action="store", type=int, dest="cores",
+                        help="cores given to snakemake")
+    parser.add_argument("--work_dir", default="/tmp/demux_map_benchmark", action="store", type=str, dest="work_dir",
+                        help="where the pipeline output and benchmark files are written (cleared before each run)")
+    parser.add_argument("--save", action="store", type=str, dest="save",
+                        help="write the results to this json file")
+    parser.add_argument("--results", nargs="+", default=[], action="store", type=str, dest="results",
+                        help="compare saved results instead of running the pipeline")
+
+    return parser.parse_args()
+
+def pipeline_commit(pipeline):
+    #the short commit hash of the pipeline directory, with "+" if it has uncommitted changes
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=pipeline, capture_output=True, text=True, check=True).stdout.strip()
+        changes = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no", "--", "."], cwd=pipeline, capture_output=True, text=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("+" if changes.strip() else "")
+
+def host_info():
+    return {"machine": platform.machine(), "processor": platform.processor(), "cpus": os.cpu_count(),
+            "system": platform.platform(), "python": platform.python_version()}
+
+def find_dataset(data_dir):
+    #the FASTQ stems and extension and the references of a make_dataset.py data set
+    fastq_dir = os.path.join(data_dir, "fastq")
+    stems, extensions = [], set()
+    for filename in sorted(os.listdir(fastq_dir)):
+        for extension in (".fastq.gz", ".fastq"):
+            if filename.endswith(extension):
+                stems.append(filename[:-len(extension)])
+                extensions.add(extension)
+                break
+    if len(extensions) != 1:
+        raise Exception(f"{fastq_dir} should have either .fastq or .fastq.gz files")
+    return fastq_dir, stems, extensions.pop(), os.path.join(data_dir, "references.fasta")
+
+def read_benchmarks(benchmark_path):
+    #{rule: {"jobs": n, "seconds": s, "cpu_time": s, "max_rss": MB, "io_in": MB, "io_out": MB}} summed over the
+    #snakemake benchmark files of the run, the peak RSS is the largest of any job
+    rules = {}
+    if not os.path.isdir(benchmark_path):
+        return rules
+    for rule in sorted(os.listdir(benchmark_path)):
+        totals = {"jobs": 0, "seconds": 0.0, "cpu_time": 0.0, "max_rss": 0.0, "io_in": 0.0, "io_out": 0.0}
+        for filename in os.listdir(os.path.join(benchmark_path, rule)):
+            with open(os.path.join(benchmark_path, rule, filename)) as fh:
+                for row in csv.DictReader(fh, delimiter="\t"):
+                    totals["jobs"] += 1
+                    totals["seconds"] += float(row["s"])
+                    # snakemake writes "-" for what psutil couldn't measure
+                    for key in ("cpu_time", "io_in", "io_out"):
+                        totals[key] += float(row[key]) if row.get(key, "-") != "-" else 0.0
+                    totals["max_rss"] = max(totals["max_rss"], float(row["max_rss"]) if row.get("max_rss", "-") != "-" else 0.0)
+        rules[rule] = totals
+    return rules
+
+def run_pipeline(pipeline, options, dataset, cores, work_dir):
+    #runs snakemake once on all of the data set's FASTQs, returns the wall and CPU time of the
+    #whole run and the per-rule benchmarks
+    fastq_dir, stems, extension, references = dataset
+    if os.path.exists(work_dir):
+        shutil.rmtree(work_dir)
+    output_path = os.path.join(work_dir, "annotations")
+    benchmark_path = os.path.join(work_dir, "benchmarks")
+    config = {"input_path": fastq_dir, "output_path": output_path, "filename_stem": ",".join(stems),
+              "filename_ext": extension, "references_file": references, "benchmark_path": benchmark_path}
+    config.update(options)
+    command = ["snakemake", "--snakefile", os.path.join(pipeline, "Snakefile"),
+               "--configfile", os.path.join(pipeline, "config.yaml"),
+               "--cores", str(cores), "--nolock",
+               "--config"] + [f"{key}={value}" for key, value in config.items()]
+
+    # run from work_dir, so every run starts without the .snakemake metadata of the last one
+    os.makedirs(work_dir)
+    log = os.path.join(work_dir, "snakemake.log")
+    start = time.perf_counter()
+    with open(log, "w") as fh:
+        process = subprocess.Popen(command, cwd=work_dir, stdout=fh, stderr=subprocess.STDOUT)
+        pid, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    if not os.WIFEXITED(status) or os.WEXITSTATUS(status) != 0:
+        raise Exception(f"snakemake failed, see {log}")
+    # the CPU time of snakemake and every job it ran, and the peak RSS (kilobytes on linux) of the largest of them
+    return {"seconds": elapsed, "cpu_time": usage.ru_utime + usage.ru_stime, "max_rss": usage.ru_maxrss / 1024,
+            "rules": read_benchmarks(benchmark_path)}
+
+def run_benchmarks(args):
+    dataset = find_dataset(os.path.abspath(args.data_dir))
+    configs = [(config[0], dict(option.split("=", 1) for option in config[1:])) for config in args.configs] or [("default", {})]
+    print(f"Benchmarking {len(dataset[1])} FASTQs of {args.data_dir}, {args.repeat} repeats, {args.cores} cores", file=sys.stderr)
+
+    runs = []
+    for pipeline in args.pipelines:
+        commit = pipeline_commit(pipeline)
+        for name, options in configs:
+            for repeat in range(args.repeat):
+                print(f"  {commit} {name} ({repeat + 1}/{args.repeat})", file=sys.stderr)
+                result = run_pipeline(os.path.abspath(pipeline), options, dataset, args.cores, os.path.abspath(args.work_dir))
+                result.update({"pipeline": os.path.abspath(pipeline), "commit": commit, "config": name,
+                               "options": options, "repeat": repeat, "fastqs": len(dataset[1])})
+                runs.append(result)
+    return {"host": host_info(), "cores": args.cores, "data_dir": os.path.abspath(args.data_dir), "runs": runs}
+
+def summarise(runs):
+    #{(commit, config): {rule: {measure: median over the repeats}}}, with the whole run as rule "(total)"
+    groups = {}
+    for run in runs:
+        rules = dict(run["rules"])
+        rules["(total)"] = {"jobs": 1, "seconds": run["seconds"], "cpu_time": run["cpu_time"], "max_rss": run["max_rss"]}
+        groups.setdefault((run["commit"], run["config"]), []).append(rules)
+    summary = {}
+    for key, repeats in groups.items():
+        names = sorted({rule for rules in repeats for rule in rules})
+        summary[key] = {rule: {measure: statistics.median(rules[rule].get(measure, 0.0) for rules in repeats if rule in rules)
+                               for measure in ("jobs", "seconds", "cpu_time", "max_rss", "io_in", "io_out")}
+                        for rule in names}
+    return summary
+
+def print_comparison(summary):
+    #one table per rule, one row per commit and configuration, wall time relative to the first row
+    rules = sorted({rule for rules in summary.values() for rule in rules}, key=lambda rule: (rule == "(total)", rule))
+    width = max(len(f"{commit} {config}") for commit, config in summary)
+    for rule in rules:
+        print(f"\n{rule}")
+        print(f"  {'commit config':<{width}} {'jobs':>5} {'wall s':>9} {'cpu s':>9} {'max rss MB':>11} {'in MB':>9} {'out MB':>9} {'vs first':>9}")
+        baseline = None
+        for (commit, config), rules_summary in summary.items():
+            if rule not in rules_summary:
+                continue
+            measures = rules_summary[rule]
+            if baseline is None:
+                baseline = measures["seconds"]
+            relative = f"{measures['seconds'] / baseline:.2f}x" if baseline else "-"
+            print(f"  {commit + ' ' + config:<{width}} {measures['jobs']:>5.0f} {measures['seconds']:>9.2f} {measures['cpu_time']:>9.2f} "
+                  f"{measures['max_rss']:>11.1f} {measures['io_in']:>9.1f} {measures['io_out']:>9.1f} {relative:>9}")
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    if args.results:
+        runs = []
+        for path in args.results:
+            with open(path) as fh:
+                results = json.load(fh)
+            print(f"{path}: {results['host']['system']}, {results['host']['cpus']} cpus, {results['cores']} cores")
+            runs.extend(results["runs"])
+    else:
+        if not args.data_dir:
+            sys.exit("give --data_dir (see make_dataset.py), or --results to compare")
+        results = run_benchmarks(args)
+        runs = results["runs"]
+        if args.save:
+            with open(args.save, "w") as fh:
+                json.dump(results, fh, indent=1)
+
+    print_comparison(summarise(runs))
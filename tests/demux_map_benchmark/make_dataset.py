@@ -0,0 +1,143 @@
+import argparse
+import gzip
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+REPO_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+sys.path.insert(0, os.path.join(REPO_DIR, "default_protocol", "pipelines", "demux_map", "rules"))
+sys.path.insert(0, os.path.join(REPO_DIR, "tests", "parse_paf_benchmarks"))
+
+from demultiplex import BARCODE_FILE, read_barcodes
+from generate_data import COMPLEMENT, random_sequence, simulate_alignment
+
+# Writes a data set for benchmark_demux_map.py:
+#   fastq/{name}.fastq (or .fastq.gz)   basecalled FASTQs, one pipeline batch each
+#   references.fasta                   the reference panel to map them against
+#
+# The FASTQs are those of the example run (example_data/20181008_1405_EBOV/fastq/pass) if it has
+# any, otherwise reads simulated from the EBOV references, with a native barcode at both ends, in
+# batches of --batch_reads like MinKNOW writes them. With --scale n each FASTQ is written n times
+# ({name}_x0, {name}_x1, ...) with the read names made unique, so the same run can be benchmarked
+# at n times its size.
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Write scaled-up copies of the example run (or simulated reads) for benchmark_demux_map.py.')
+
+    parser.add_argument("--output_dir", action="store", type=str, dest="output_dir", required=True)
+    parser.add_argument("--fastq_dir", default=os.path.join(REPO_DIR, "example_data", "20181008_1405_EBOV", "fastq", "pass"),
+                        action="store", type=str, dest="fastq_dir",
+                        help="FASTQs (.fastq or .fastq.gz, searched recursively) to copy, reads are simulated if there are none")
+    parser.add_argument("--references", default=os.path.join(REPO_DIR, "example_protocols", "EBOV", "references.fasta"),
+                        action="store", type=str, dest="references")
+    parser.add_argument("--scale", default=1, action="store", type=int, dest="scale",
+                        help="number of copies of each FASTQ")
+    parser.add_argument("--gzip", action="store_true", dest="gzip",
+                        help="write .fastq.gz rather than .fastq")
+
+    parser.add_argument("--reads", default=20000, action="store", type=int, dest="reads",
+                        help="number of reads simulated if there are no FASTQs")
+    parser.add_argument("--batch_reads", default=4000, action="store", type=int, dest="batch_reads",
+                        help="reads per simulated FASTQ")
+    parser.add_argument("--read_length", default=1000, action="store", type=int, dest="read_length",
+                        help="median simulated read length, lengths are log-normally distributed")
+    parser.add_argument("--error_rate", default=0.08, action="store", type=float, dest="error_rate")
+    parser.add_argument("--barcodes", default=4, action="store", type=int, dest="barcodes",
+                        help="number of native barcodes the simulated reads are spread over")
+    parser.add_argument("--seed", default=1, action="store", type=int, dest="seed")
+
+    return parser.parse_args()
+
+def find_fastqs(fastq_dir):
+    #{name: path} of the FASTQs under fastq_dir, named after their path relative to it
+    fastqs = {}
+    for root, dirs, files in os.walk(fastq_dir):
+        for filename in files:
+            for extension in (".fastq", ".fastq.gz"):
+                if filename.endswith(extension):
+                    relative = os.path.relpath(os.path.join(root, filename[:-len(extension)]), fastq_dir)
+                    fastqs[relative.replace(os.sep, "_")] = os.path.join(root, filename)
+    return dict(sorted(fastqs.items()))
+
+def read_fasta(path):
+    #{name: sequence} of a fasta, as DNA (the EBOV panel is written with U)
+    sequences = {}
+    name = None
+    with open(path) as fh:
+        for line in fh:
+            if line.startswith(">"):
+                name = line[1:].split()[0]
+                sequences[name] = []
+            elif name is not None:
+                sequences[name].append(line.strip().upper().replace("U", "T"))
+    return {name: "".join(lines) for name, lines in sequences.items()}
+
+def simulate_reads(references, args):
+    #yields (header, sequence, quality) of reads from the references with a native barcode at both ends
+    rng = random.Random(args.seed)
+    names = sorted(references)
+    barcodes = list(read_barcodes(BARCODE_FILE, "native").items())[:args.barcodes]
+    run_start = datetime(2018, 10, 8, 14, 5, 0)
+    for i in range(args.reads):
+        reference = references[rng.choice(names)]
+        length = min(max(200, int(rng.lognormvariate(0, 0.5) * args.read_length)), len(reference))
+        start = rng.randrange(len(reference) - length + 1)
+        sequence = simulate_alignment(rng, reference, start, length, args.error_rate)[0]
+        barcode = rng.choice(barcodes)[1]
+        sequence = random_sequence(rng, rng.randint(5, 30)) + barcode + sequence + \
+            barcode.translate(COMPLEMENT)[::-1] + random_sequence(rng, rng.randint(5, 30))
+        if rng.random() < 0.5:
+            sequence = sequence.translate(COMPLEMENT)[::-1]
+        quality = "".join(chr(33 + rng.randint(5, 30)) for _ in range(8)) * (len(sequence) // 8 + 1)
+        start_time = (run_start + timedelta(seconds=i // 4)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        header = f"{rng.getrandbits(128):032x} runid=0a1b2c3d read={i} ch={rng.randint(1, 512)} start_time={start_time}"
+        yield header, sequence, quality[:len(sequence)]
+
+def write_simulated(references, fastq_dir, args):
+    #returns {name: path} of the batches written to fastq_dir
+    fastqs = {}
+    for i, read in enumerate(simulate_reads(references, args)):
+        if i % args.batch_reads == 0:
+            name = f"simulated_{i // args.batch_reads}"
+            fastqs[name] = os.path.join(fastq_dir, name + ".fastq")
+            out = open(fastqs[name], "w")
+        out.write("@{}\n{}\n+\n{}\n".format(*read))
+        if (i + 1) % args.batch_reads == 0 or i + 1 == args.reads:
+            out.close()
+    return fastqs
+
+def write_copy(fastq, output, copy):
+    #copies a FASTQ, adding _{copy} to its read names
+    opener = gzip.open if fastq.endswith(".gz") else open
+    out_opener = gzip.open if output.endswith(".gz") else open
+    with opener(fastq, "rt") as fh, out_opener(output, "wt") as out:
+        for header, sequence, plus, quality in zip(fh, fh, fh, fh):
+            name, space, description = header.rstrip("\n").partition(" ")
+            out.write(f"{name}_{copy}{space}{description}\n{sequence}{plus}{quality}")
+
+def main(args):
+    fastq_dir = os.path.join(args.output_dir, "fastq")
+    os.makedirs(fastq_dir, exist_ok=True)
+    references = os.path.join(args.output_dir, "references.fasta")
+    with open(args.references) as fh, open(references, "w") as out:
+        out.write(fh.read())
+
+    sources = find_fastqs(args.fastq_dir) if os.path.isdir(args.fastq_dir) else {}
+    if sources:
+        print(f"Copying {len(sources)} FASTQs from {args.fastq_dir}")
+    else:
+        print(f"No FASTQs in {args.fastq_dir}, simulating {args.reads} reads from {args.references}")
+        simulated_dir = os.path.join(args.output_dir, "simulated")
+        os.makedirs(simulated_dir, exist_ok=True)
+        sources = write_simulated(read_fasta(args.references), simulated_dir, args)
+
+    extension = ".fastq.gz" if args.gzip else ".fastq"
+    for copy in range(args.scale):
+        for name, fastq in sources.items():
+            write_copy(fastq, os.path.join(fastq_dir, f"{name}_x{copy}{extension}"), copy)
+    print(f"Wrote {len(sources) * args.scale} FASTQs to {fastq_dir}")
+
+if __name__ == '__main__':
+
+    main(parse_args())
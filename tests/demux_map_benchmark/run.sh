@@ -0,0 +1,16 @@
+#!/usr/bin/env bash
+# usage: ./run.sh [scale] [extra benchmark_demux_map.py arguments, e.g. --config t4 threads=4 --save results.json]
+
+set -e
+
+SCALE=${1:-1}
+shift || true
+DATA_DIR=${DATA_DIR:-/tmp/demux_map_benchmark_data_${SCALE}}
+
+echo "Benchmarking the demux_map pipeline on ${SCALE} copies of the example run (data in ${DATA_DIR})."
+
+if [ ! -d "${DATA_DIR}/fastq" ]; then
+    python make_dataset.py --output_dir "${DATA_DIR}" --scale "${SCALE}"
+fi
+
+python benchmark_demux_map.py --data_dir "${DATA_DIR}" "$@"
@@ -0,0 +1,186 @@
+import argparse
+import contextlib
+import filecmp
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Times and memory-profiles the stages of parse_paf.py on a data set from generate_data.py.
+#
+# Each benchmark is run --repeat times (min and median wall time are reported) and once more
+# under tracemalloc for the peak python allocation. Results can be saved as json and compared
+# against an earlier run (--baseline) to catch regressions. Other versions of parse_paf.py
+# can be timed end-to-end on the same data (--compare) and their reports are checked against
+# the current one.
+
+RULES_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "default_protocol", "pipelines", "demux_map", "rules"))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark parse_paf.py on data made by generate_data.py.')
+
+    parser.add_argument("--data_dir", action="store", type=str, dest="data_dir", required=True)
+    parser.add_argument("--rules_dir", default=RULES_DIR, action="store", type=str, dest="rules_dir",
+                        help="directory of the parse_paf.py to benchmark in-process")
+    parser.add_argument("--repeat", default=5, action="store", type=int, dest="repeat")
+    parser.add_argument("--save", action="store", type=str, dest="save",
+                        help="write the results to this json file")
+    parser.add_argument("--baseline", action="store", type=str, dest="baseline",
+                        help="results json of an earlier run, exit with status 1 if any benchmark got slower")
+    parser.add_argument("--tolerance", default=0.2, action="store", type=float, dest="tolerance",
+                        help="allowed slowdown against --baseline (0.2 = 20%%)")
+    parser.add_argument("--compare", nargs="*", default=[], action="store", type=str, dest="compare",
+                        help="other parse_paf.py scripts to run end-to-end on the same data")
+
+    return parser.parse_args()
+
+def measure(function, setup, repeat):
+    #returns the wall times of `repeat` calls of function(setup()) and the peak traced
+    #allocation of one more call. setup() is not timed.
+    times = []
+    for i in range(repeat):
+        argument = setup()
+        start = time.perf_counter()
+        function(argument)
+        times.append(time.perf_counter() - start)
+
+    argument = setup()
+    tracemalloc.start()
+    function(argument)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return times, peak
+
+def run_script(script, data, report):
+    #runs a parse_paf.py end-to-end, returns the wall time and peak RSS (bytes)
+    command = [sys.executable, script,
+               "--paf_file", data["paf"],
+               "--annotated_reads", data["demuxed"],
+               "--report", report,
+               "--reference_file", data["references"],
+               "--reference_options", data["reference_options"]]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, cwd=os.path.dirname(os.path.abspath(script)))
+    pid, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    if process.returncode != 0:
+        raise Exception(f"{script} failed with exit code {process.returncode}")
+    # ru_maxrss is in kilobytes on linux
+    return elapsed, usage.ru_maxrss * 1024
+
+def run_benchmarks(parse_paf, CsvReport, data, repeat):
+    #returns {name: {"times": [...], "peak": bytes, "items": n}}
+    results = {}
+
+    with open(data["paf"]) as fh:
+        paf_lines = fh.readlines()
+    cs_tags = [line.rstrip("\n").split("\t")[-1] for line in paf_lines if line.split("\t")[5] != "*"]
+    header_dict = parse_paf.get_header_dict(data["demuxed"])
+    reference_table, ref_option_header = parse_paf.get_reference_table(data["reference_options"], data["references"])
+    mappings = parse_paf.parse_lines(paf_lines, header_dict)
+
+    def bench(name, function, setup, items):
+        # parse_paf prints the proportion unmapped
+        with contextlib.redirect_stdout(io.StringIO()):
+            times, peak = measure(function, setup, repeat)
+        results[name] = {"times": times, "peak": peak, "items": items}
+        print(f"{name:<40}{min(times):>10.3f}{statistics.median(times):>10.3f}"
+              f"{min(times) / items * 1e6:>12.2f}{peak / 1e6:>12.1f}", flush=True)
+
+    print(f"{'benchmark':<40}{'min s':>10}{'median s':>10}{'us/item':>12}{'peak MB':>12}")
+
+    bench("get_header_dict", lambda reads: parse_paf.get_header_dict(reads),
+          lambda: data["demuxed"], len(header_dict))
+
+    def per_tag(tags):
+        for cs in tags:
+            parse_paf.parse_cigar_for_matches_and_mismatches(cs)
+    bench("parse_cigar_for_matches_and_mismatches", per_tag, lambda: cs_tags, len(cs_tags))
+
+    if hasattr(parse_paf, "parse_cs_tags"):
+        bench("parse_cs_tags (batched)", parse_paf.parse_cs_tags, lambda: cs_tags, len(cs_tags))
+
+    bench("parse_lines", lambda lines: parse_paf.parse_lines(lines, header_dict), lambda: paf_lines, len(paf_lines))
+
+    def write_all(copies):
+        report = CsvReport(io.StringIO(), ref_option_header)
+        counts = parse_paf.new_counts()
+        for mapping in copies:
+            parse_paf.write_mapping(report, mapping, reference_table, counts, 0.8)
+    # write_mapping updates the mapping it is given, so each run gets fresh copies
+    bench("write_mapping", write_all, lambda: [dict(mapping) for mapping in mappings], len(mappings))
+
+    bench("parse_paf", lambda report: parse_paf.parse_paf(data["paf"], report, header_dict, reference_table, 0.8),
+          lambda: CsvReport(io.StringIO(), ref_option_header), len(paf_lines))
+
+    return results
+
+def compare_scripts(scripts, data, repeat):
+    #times each script end-to-end, the first is the reference for the output check
+    results = {}
+    print(f"\n{'script (end-to-end)':<40}{'min s':>10}{'median s':>10}{'peak RSS MB':>12}{'output':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        reference_report = None
+        for i, script in enumerate(scripts):
+            report = os.path.join(tmp, f"report{i}.csv")
+            runs = [run_script(script, data, report) for r in range(repeat)]
+            times = [elapsed for elapsed, rss in runs]
+            if reference_report is None:
+                reference_report, output = report, "reference"
+            else:
+                output = "same" if filecmp.cmp(reference_report, report, shallow=False) else "DIFFERENT"
+            results[f"script:{script}"] = {"times": times, "peak_rss": max(rss for elapsed, rss in runs)}
+            label = os.path.join(os.path.basename(os.path.dirname(os.path.abspath(script))), os.path.basename(script))
+            print(f"{label[-40:]:<40}{min(times):>10.3f}{statistics.median(times):>10.3f}"
+                  f"{max(rss for elapsed, rss in runs) / 1e6:>12.1f}{output:>12}", flush=True)
+    return results
+
+def check_baseline(results, baseline, tolerance):
+    #returns the names of the benchmarks that are slower than in the baseline
+    regressions = []
+    print(f"\n{'against baseline':<40}{'ratio':>10}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = min(result["times"]) / min(baseline[name]["times"])
+        flag = "  REGRESSION" if ratio > 1 + tolerance else ""
+        print(f"{name[-40:]:<40}{ratio:>10.2f}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    sys.path.insert(0, os.path.abspath(args.rules_dir))
+    import parse_paf
+    from annotation_format import CsvReport
+
+    with open(os.path.join(args.data_dir, "reference_options.txt")) as fh:
+        reference_options = fh.read().strip()
+    data = {
+        "paf": os.path.join(args.data_dir, "reads.paf"),
+        "demuxed": os.path.join(args.data_dir, "demuxed.fastq"),
+        "references": os.path.join(args.data_dir, "references.fasta"),
+        "reference_options": reference_options
+    }
+
+    results = run_benchmarks(parse_paf, CsvReport, data, args.repeat)
+    results.update(compare_scripts([os.path.join(args.rules_dir, "parse_paf.py")] + args.compare, data, args.repeat))
+
+    if args.save:
+        with open(args.save, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            regressions = check_baseline(results, json.load(fh), args.tolerance)
+        if regressions:
+            sys.exit(1)
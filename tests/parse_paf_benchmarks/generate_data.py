@@ -0,0 +1,169 @@
+import argparse
+import os
+import random
+from datetime import datetime, timedelta
+
+# Writes a synthetic, internally consistent set of inputs for parse_paf.py:
+#   references.fasta        reference panel with `key=value` header fields
+#   reads.fastq             basecalled reads with MinKNOW style headers
+#   demuxed.fastq           the same reads as porechop leaves them (barcode= added, some discarded)
+#   reads.paf               minimap2 style paf (--secondary=no --paf-no-hit --cs) of reads.fastq
+#   reference_options.txt   a --reference_options string using the header fields
+#
+# Reads are simulated from the references with substitutions, insertions and deletions, and
+# the cs tags, coordinates and match counts in the paf describe exactly those errors.
+
+BASES = "ACGT"
+COMPLEMENT = str.maketrans("ACGT", "TGCA")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Generate ONT-like fastq/paf/reference inputs for benchmarking parse_paf.py.')
+
+    parser.add_argument("--output_dir", action="store", type=str, dest="output_dir", required=True)
+    parser.add_argument("--reads", default=10000, action="store", type=int, dest="reads")
+    parser.add_argument("--read_length", default=1500, action="store", type=int, dest="read_length",
+                        help="median read length, lengths are log-normally distributed")
+    parser.add_argument("--references", default=20, action="store", type=int, dest="references")
+    parser.add_argument("--reference_length", default=10000, action="store", type=int, dest="reference_length")
+    parser.add_argument("--error_rate", default=0.08, action="store", type=float, dest="error_rate",
+                        help="fraction of aligned bases that are substitutions, insertions or deletions, sets the cs tag length")
+    parser.add_argument("--unmapped", default=0.1, action="store", type=float, dest="unmapped",
+                        help="fraction of reads that don't map")
+    parser.add_argument("--ambiguous", default=0.05, action="store", type=float, dest="ambiguous",
+                        help="fraction of reads with two primary mappings")
+    parser.add_argument("--discarded", default=0.01, action="store", type=float, dest="discarded",
+                        help="fraction of reads porechop leaves out of demuxed.fastq")
+    parser.add_argument("--barcodes", default=12, action="store", type=int, dest="barcodes")
+    parser.add_argument("--fields", default=1, action="store", type=int, dest="fields",
+                        help="number of plain header field columns in the reference options")
+    parser.add_argument("--regions", default=2, action="store", type=int, dest="regions",
+                        help="number of regions in the region based reference option column, 0 for none")
+    parser.add_argument("--seed", default=1, action="store", type=int, dest="seed")
+
+    return parser.parse_args()
+
+def random_sequence(rng, length):
+    return "".join(rng.choices(BASES, k=length))
+
+def region_bounds(reference_length, regions):
+    #evenly spaced regions overlapping their neighbours by 10%
+    step = reference_length // regions
+    overlap = step // 10
+    return [(max(0, i * step - overlap), min(reference_length, (i + 1) * step + overlap)) for i in range(regions)]
+
+def write_references(path, rng, args):
+    references = {}
+    with open(path, "w") as fh:
+        for i in range(args.references):
+            name = f"ref{i:05d}"
+            fields = [f"field{j}=F{j}_{i % (j + 3)}" for j in range(args.fields)]
+            fields += [f"R{k}_type=R{k}_{rng.randrange(5)}" for k in range(args.regions)]
+            sequence = random_sequence(rng, args.reference_length)
+            references[name] = sequence
+            fh.write(f">{name} {' '.join(fields)}\n")
+            for j in range(0, len(sequence), 60):
+                fh.write(sequence[j:j + 60] + "\n")
+    return references
+
+def reference_options(args):
+    columns = [f"field{j}[field{j}]" for j in range(args.fields)]
+    if args.regions:
+        regions = region_bounds(args.reference_length, args.regions)
+        columns.append("region[" + ",".join(f"R{k}_type:{start}:{end}" for k, (start, end) in enumerate(regions)) + "]")
+    return ";".join(columns)
+
+def simulate_alignment(rng, reference, start, length, error_rate):
+    #returns the aligned query sequence, cs tag and counts for reference[start:start + length].
+    #Errors are placed by drawing the length of the matching run before each one.
+    query, cs = [], []
+    matches = mismatches = inserted = deleted = 0
+    position, end = start, start + length
+    while position < end:
+        run = min(int(rng.expovariate(error_rate)) if error_rate > 0 else end - position, end - position)
+        if run:
+            query.append(reference[position:position + run])
+            cs.append(f":{run}")
+            matches += run
+            position += run
+        if position >= end:
+            break
+        kind = rng.random()
+        if kind < 0.5:
+            base = reference[position]
+            alt = rng.choice(BASES.replace(base, ""))
+            query.append(alt)
+            cs.append(f"*{base.lower()}{alt.lower()}")
+            mismatches += 1
+            position += 1
+        elif kind < 0.75:
+            bases = random_sequence(rng, rng.randint(1, 3))
+            query.append(bases)
+            cs.append(f"+{bases.lower()}")
+            inserted += len(bases)
+        else:
+            bases = reference[position:min(position + rng.randint(1, 3), end)]
+            cs.append(f"-{bases.lower()}")
+            deleted += len(bases)
+            position += len(bases)
+    return "".join(query), "".join(cs), matches, matches + mismatches + inserted + deleted
+
+def simulate_read(rng, references, names, read_length, args):
+    #returns the read sequence and its paf columns after the read name (one list per paf line)
+    if rng.random() < args.unmapped:
+        sequence = random_sequence(rng, read_length)
+        return sequence, [[str(len(sequence)), "0", "0", "*", "*", "0", "0", "0", "0", "0", "0"]]
+
+    hits = 2 if rng.random() < args.ambiguous else 1
+    ref_names = rng.sample(names, hits)
+    aligned_length = min(read_length, args.reference_length)
+    ref_start = rng.randrange(args.reference_length - aligned_length + 1)
+    left, right = random_sequence(rng, rng.randint(0, 50)), random_sequence(rng, rng.randint(0, 50))
+    strand = rng.choice("+-")
+
+    alignments = [simulate_alignment(rng, references[name], ref_start, aligned_length, args.error_rate) for name in ref_names]
+    aligned_query = alignments[0][0]
+    sequence = left + aligned_query + right
+    if strand == "-":
+        sequence = sequence.translate(COMPLEMENT)[::-1]
+        query_start, query_end = len(right), len(right) + len(aligned_query)
+    else:
+        query_start, query_end = len(left), len(left) + len(aligned_query)
+
+    lines = []
+    for name, (query, cs, matches, block_length) in zip(ref_names, alignments):
+        lines.append([str(len(sequence)), str(query_start), str(query_end), strand, name, str(args.reference_length),
+                      str(ref_start), str(ref_start + aligned_length), str(matches), str(block_length), "60",
+                      "tp:A:P", f"cs:Z:{cs}"])
+    return sequence, lines
+
+def main(args):
+    rng = random.Random(args.seed)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    references = write_references(os.path.join(args.output_dir, "references.fasta"), rng, args)
+    names = sorted(references)
+    with open(os.path.join(args.output_dir, "reference_options.txt"), "w") as fh:
+        fh.write(reference_options(args) + "\n")
+
+    run_start = datetime(2019, 5, 29, 20, 0, 0)
+    with open(os.path.join(args.output_dir, "reads.fastq"), "w") as reads, \
+            open(os.path.join(args.output_dir, "demuxed.fastq"), "w") as demuxed, \
+            open(os.path.join(args.output_dir, "reads.paf"), "w") as paf:
+        for i in range(args.reads):
+            read_name = f"{rng.getrandbits(128):032x}"
+            read_length = max(100, int(rng.lognormvariate(0, 0.5) * args.read_length))
+            sequence, lines = simulate_read(rng, references, names, read_length, args)
+            quality = "".join(chr(33 + rng.randint(5, 30)) for _ in range(8)) * (len(sequence) // 8 + 1)
+
+            start_time = (run_start + timedelta(seconds=i // 4)).strftime("%Y-%m-%dT%H:%M:%SZ")
+            header = f"{read_name} runid=0a1b2c3d read={i} ch={rng.randint(1, 512)} start_time={start_time}"
+            reads.write(f"@{header}\n{sequence}\n+\n{quality[:len(sequence)]}\n")
+            if rng.random() >= args.discarded:
+                barcode = f"NB{rng.randint(1, args.barcodes):02d}" if rng.random() < 0.9 else "none"
+                demuxed.write(f"@{header} barcode={barcode}\n{sequence}\n+\n{quality[:len(sequence)]}\n")
+            for line in lines:
+                paf.write(read_name + "\t" + "\t".join(line) + "\n")
+
+if __name__ == '__main__':
+
+    main(parse_args())
@@ -0,0 +1,16 @@
+#!/usr/bin/env bash
+# usage: ./run.sh [reads] [extra benchmark_parse_paf.py arguments, e.g. --baseline results.json]
+
+set -e
+
+READS=${1:-20000}
+shift || true
+DATA_DIR=${DATA_DIR:-/tmp/parse_paf_benchmark_${READS}}
+
+echo "Benchmarking parse_paf.py with ${READS} synthetic reads (data in ${DATA_DIR})."
+
+if [ ! -f "${DATA_DIR}/reads.paf" ]; then
+    python generate_data.py --output_dir "${DATA_DIR}" --reads "${READS}"
+fi
+
+python benchmark_parse_paf.py --data_dir "${DATA_DIR}" "$@"
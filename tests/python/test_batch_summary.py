@@ -0,0 +1,37 @@
+from annotation_format import ReportRows
+from batch_summary import SummarisedReport, merge_summaries
+
+ROWS = [
+    ("read_1", 125, "2019-05-29T20:00:01Z", "BC01", "ref_a", 100, 0, 25, 24, 25),
+    ("read_2", 30, "2019-05-29T20:00:02Z", "BC01", "*", 0, 0, 0, 0, 0),
+    # ends in the last bin of the reference
+    ("read_3", 7, "?", "BC02", "ref_a", 100, 95, 100, 5, 5),
+]
+
+def summarise(rows, bin_width=10):
+    report = SummarisedReport(ReportRows(), bin_width)
+    report.write_rows(rows[:1])
+    for row in rows[1:]:
+        report.write_row(row)
+    assert report.report == rows
+    return report.summary()
+
+def test_summary_counts():
+    summary = summarise(ROWS)
+    assert summary["reference_lengths"] == {"ref_a": 100}
+    assert summary["counts"] == {
+        "reads": 3,
+        "read_lengths": {"BC01": [0, 0, 0, 1] + [0] * 8 + [1], "BC02": [1]},
+        "mapped_read_lengths": {"BC01": [0] * 12 + [1], "BC02": [1]},
+        "reference_counts": {"BC01": {"*": 1, "ref_a": 1}, "BC02": {"ref_a": 1}},
+        "identity": {"ref_a": [0] * 96 + [1, 0, 0, 1]},
+        "coverage": {"BC01": {"ref_a": [1, 0, 0, -1, 0, 0, 0, 0, 0, 0]}, "BC02": {"ref_a": [0] * 9 + [1]}}
+    }
+
+def test_no_rows():
+    assert summarise([])["counts"] == {"reads": 0, "read_lengths": {}, "mapped_read_lengths": {},
+                                       "reference_counts": {}, "identity": {}, "coverage": {}}
+
+def test_merged_batches_as_one():
+    merged = merge_summaries([summarise(ROWS[:2]), summarise(ROWS[2:])])
+    assert merged == summarise(ROWS)
@@ -0,0 +1,130 @@
+import random
+
+import pytest
+
+import demultiplex
+from demultiplex import BarcodeClassifier, Pattern, read_barcodes, reverse_complement, search_distance
+
+BARCODES = read_barcodes(demultiplex.BARCODE_FILE, "native")
+
+def edit_distance(pattern, text):
+    #the smallest edit distance between the whole pattern and any part of the text, by the
+    #full dynamic programming matrix (the first row is 0, an alignment may start anywhere)
+    row = [0] * (len(text) + 1)
+    for i, base in enumerate(pattern, 1):
+        new_row = [i]
+        for j, text_base in enumerate(text, 1):
+            new_row.append(min(row[j - 1] + (base != text_base), row[j] + 1, new_row[j - 1] + 1))
+        row = new_row
+    return min(row)
+
+def random_sequence(rng, length):
+    return "".join(rng.choice("ACGT") for _ in range(length))
+
+def mutate(rng, sequence, edits):
+    #`edits` random substitutions, insertions and deletions
+    sequence = list(sequence)
+    for _ in range(edits):
+        i = rng.randrange(len(sequence))
+        edit = rng.choice("sid")
+        if edit == "s":
+            sequence[i] = rng.choice("ACGT".replace(sequence[i], ""))
+        elif edit == "i":
+            sequence.insert(i, rng.choice("ACGT"))
+        else:
+            del sequence[i]
+    return "".join(sequence)
+
+def read_with(rng, start=None, end=None, length=600):
+    #a random read with the barcode sequence `start` near its start and the reverse complement of `end` near its end
+    read = random_sequence(rng, length)
+    if start:
+        read = read[:20] + start + read[20 + len(start):]
+    if end:
+        end = reverse_complement(end)
+        read = read[:-20 - len(end)] + end + read[-20:]
+    return read
+
+def test_search_distance_as_dynamic_programming():
+    rng = random.Random(1)
+    for _ in range(500):
+        pattern = random_sequence(rng, rng.randint(1, 30))
+        if rng.random() < 0.5:
+            # the pattern (with a few edits) in the text
+            text = random_sequence(rng, rng.randint(0, 20)) + mutate(rng, pattern, rng.randint(0, min(4, len(pattern) - 1))) + \
+                random_sequence(rng, rng.randint(0, 20))
+        else:
+            text = random_sequence(rng, rng.randint(0, 60))
+        assert search_distance(Pattern(pattern), text) == edit_distance(pattern, text), (pattern, text)
+
+def test_search_distance_of_long_patterns():
+    # patterns longer than a machine word
+    rng = random.Random(2)
+    for length in (63, 64, 65, 100):
+        pattern = random_sequence(rng, length)
+        text = random_sequence(rng, 30) + mutate(rng, pattern, 10) + random_sequence(rng, 30)
+        assert search_distance(Pattern(pattern), text) == edit_distance(pattern, text)
+
+def test_threshold_boundary():
+    rng = random.Random(3)
+    read = read_with(rng, start=mutate(rng, BARCODES["NB01"], 3))
+    identity = max(BarcodeClassifier(BARCODES).end_identities(read[:150]))
+    assert 75 < identity < 100
+
+    # the best barcode must reach the threshold, not exceed it
+    assert BarcodeClassifier(BARCODES, threshold=identity, diff=0).classify(read) == "NB01"
+    assert BarcodeClassifier(BARCODES, threshold=identity + 0.01, diff=0).classify(read) == "none"
+
+def test_diff_boundary():
+    rng = random.Random(4)
+    read = read_with(rng, start=BARCODES["NB01"], end=mutate(rng, BARCODES["NB02"], 2))
+    classifier = BarcodeClassifier(BARCODES)
+    second = max(classifier.end_identities(read[-150:]))
+    assert classifier.end_identities(read[-150:]).index(second) == classifier.names.index("NB02")
+    assert 75 < second < 100
+
+    # the best barcode must beat the second by at least `diff`
+    assert BarcodeClassifier(BARCODES, threshold=0, diff=100 - second).classify(read) == "NB01"
+    assert BarcodeClassifier(BARCODES, threshold=0, diff=100 - second + 0.01).classify(read) == "none"
+
+@pytest.mark.parametrize("start, end, either, both", [
+    ("NB01", "NB01", "NB01", "NB01"),
+    ("NB01", None, "NB01", "none"),
+    (None, "NB03", "NB03", "none"),
+    # a different barcode at each end
+    ("NB01", "NB03", "none", "none"),
+])
+def test_require_two_barcodes(start, end, either, both):
+    read = read_with(random.Random(5), start=start and BARCODES[start], end=end and BARCODES[end])
+    assert BarcodeClassifier(BARCODES, require_two=False).classify(read) == either
+    assert BarcodeClassifier(BARCODES, require_two=True).classify(read) == both
+
+def test_random_reads_have_no_barcode():
+    rng = random.Random(6)
+    classifier = BarcodeClassifier(BARCODES)
+    for _ in range(50):
+        assert classifier.classify(random_sequence(rng, rng.randint(50, 2000))) == "none"
+    assert classifier.classify("") == "none"
+    assert BarcodeClassifier({}).classify(read_with(rng, start=BARCODES["NB01"])) == "none"
+
+def write_reads(path, reads):
+    with open(path, "w") as fh:
+        for i, read in enumerate(reads):
+            fh.write(f"@read_{i} start_time=2019-05-29T20:00:00Z\n{read}\n+\n{'I' * len(read)}\n")
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_output_in_read_order(tmp_path, threads):
+    rng = random.Random(7)
+    names = [rng.choice(["NB01", "NB02", "NB03", None]) for _ in range(200)]
+    reads = [read_with(rng, start=name and BARCODES[name], end=name and BARCODES[name], length=rng.randint(300, 800))
+             for name in names]
+    write_reads(str(tmp_path / "reads.fastq"), reads)
+
+    counts = demultiplex.demultiplex(str(tmp_path / "reads.fastq"), str(tmp_path / "labelled.fastq"),
+                                     BarcodeClassifier(BARCODES, require_two=True), threads, chunk_size=7)
+    with open(str(tmp_path / "labelled.fastq")) as fh:
+        lines = fh.readlines()
+
+    assert lines[0::4] == [f"@read_{i} start_time=2019-05-29T20:00:00Z barcode={name or 'none'}\n" for i, name in enumerate(names)]
+    assert lines[1::4] == [read + "\n" for read in reads]
+    assert counts == dict((name or "none", names.count(name)) for name in set(names))
@@ -0,0 +1,66 @@
+import gzip
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import REPO_DIR
+
+SCRIPT = os.path.join(REPO_DIR, "default_protocol", "pipelines", "bin_to_fastq", "export_reads.py")
+
+REPORT_HEADER = "read_name,read_len,start_time,barcode,best_reference,ref_len,start_coords,end_coords,num_matches,mapping_len\n"
+
+def write_fastq(path, names):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with (gzip.open(path, "wt") if path.endswith(".gz") else open(path, "w")) as fh:
+        for name in names:
+            fh.write(f"@{name}\nACGT\n+\nIIII\n")
+
+def write_report(path, reads):
+    #a report of reads [(read_name, barcode)]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fh:
+        fh.write(REPORT_HEADER)
+        for name, barcode in reads:
+            fh.write(f"{name},4,2019-05-29T20:00:00Z,{barcode},ref,100,0,4,4,4\n")
+
+def write_annotated(basecalled_path, annotated_path, stem, reads):
+    #writes {stem}.fastq and its report {stem}.csv of reads [(read_name, barcode)]
+    write_fastq(os.path.join(basecalled_path, stem + ".fastq"), [name for name, barcode in reads])
+    write_report(os.path.join(annotated_path, stem + ".csv"), reads)
+
+def export(tmp_path, *samples):
+    output_path = str(tmp_path / "binned")
+    os.makedirs(output_path)
+    command = [sys.executable, SCRIPT, "--basecalled_path", str(tmp_path / "basecalled"),
+               "--annotated_path", str(tmp_path / "annotations"), "--output_path", output_path]
+    for sample in samples:
+        command += ["--sample"] + list(sample)
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+    exported = {}
+    for sample in samples:
+        with open(os.path.join(output_path, f"binned_{sample[0]}.fastq")) as fh:
+            exported[sample[0]] = sorted(line[1:].strip() for line in fh if line.startswith("@"))
+    return exported
+
+def test_same_stem_in_subdirectories(tmp_path):
+    # the FASTQs (and their reports) of two subdirectories have the same name
+    write_annotated(str(tmp_path / "basecalled"), str(tmp_path / "annotations"), os.path.join("a", "batch_0"),
+                    [("a1", "BC01"), ("a2", "BC02")])
+    write_annotated(str(tmp_path / "basecalled"), str(tmp_path / "annotations"), os.path.join("b", "batch_0"),
+                    [("b1", "BC01"), ("b2", "BC02")])
+
+    assert export(tmp_path, ("one", "BC01"), ("two", "BC02")) == {"one": ["a1", "b1"], "two": ["a2", "b2"]}
+
+@pytest.mark.parametrize("extension", [".fastq", ".fastq.gz"])
+def test_parts_of_a_fastq(tmp_path, extension):
+    # a FASTQ annotated in parts (config `chunk_reads`) has a report per part and no read index
+    reads = [(f"r{i}", "BC01" if i % 2 else "BC02") for i in range(5)]
+    write_fastq(str(tmp_path / "basecalled" / ("batch_0" + extension)), [name for name, barcode in reads])
+    for part, start in enumerate(range(0, len(reads), 2)):
+        write_report(str(tmp_path / "annotations" / f"batch_0.part{part:03d}.csv"), reads[start:start + 2])
+
+    assert export(tmp_path, ("one", "BC01"), ("two", "BC02")) == {"one": ["r1", "r3"], "two": ["r0", "r2", "r4"]}
+    with open(str(tmp_path / "binned" / "binned_two.csv")) as fh:
+        assert fh.read() == REPORT_HEADER + "".join(f"r{i},4,2019-05-29T20:00:00Z,BC02,ref,100,0,4,4,4\n" for i in (0, 2, 4))
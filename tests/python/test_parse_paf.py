@@ -0,0 +1,204 @@
+import io
+import random
+from collections import Counter
+
+import pytest
+
+import parse_paf
+from annotation_format import CsvReport
+
+# The cs tags (minimap2 --cs) used to be walked one character at a time, by the functions below as
+# they were before parse_cs_tags. The reports of both code paths must be the same.
+
+def take_appropriate_cigar_action(counter, last_symbol, number):
+    if last_symbol == ":":
+        counter[last_symbol]+=int(number)
+    elif last_symbol == "*":
+        counter[last_symbol]+=1
+    else:
+        counter[last_symbol]+=len(number)
+
+def parse_cigar_for_matches_and_mismatches(cigar):
+    cigar_counter = Counter()
+
+    cigar = cigar[5:] # removes the cs:Z: from the beginning of the cigar
+
+    symbol = ''
+    last_symbol = None
+    number = ''
+
+    for i in cigar:
+        if i in [":","*","+","-"]:
+            symbol = i
+
+            if last_symbol:
+                take_appropriate_cigar_action(cigar_counter, last_symbol, number)
+                last_symbol = symbol
+                number = ''
+            else:
+                last_symbol = symbol
+        else:
+            number += i
+
+    take_appropriate_cigar_action(cigar_counter, last_symbol, number)
+
+    return cigar_counter[":"], cigar_counter["*"]
+
+def old_parse_line(line, header_dict):
+    values = {}
+    tokens = line.rstrip('\n').split('\t')
+    values["read_name"], values["read_len"] = tokens[:2]
+    values["barcode"], values["start_time"] = header_dict.get(values["read_name"], ("none", "?"))
+    values["query_start"] = tokens[2]
+    values["query_end"] = tokens[3]
+    values["ref_hit"], values["ref_len"], values["coord_start"], values["coord_end"], values["matches"], values["aln_block_len"] = tokens[5:11]
+    if values["ref_hit"] != "*":
+        matches, mismatches = parse_cigar_for_matches_and_mismatches(tokens[-1])
+        values["mismatches"] = mismatches
+        values["identity"] = matches / (matches + mismatches)
+    else:
+        values["mismatches"] = 0
+        values["identity"]= 0
+    return values
+
+def paf_line(read_name, read_len, reference, start, cs):
+    #a paf line of minimap2 -c --cs, the number of matches and the alignment block length from the cs tag
+    matches, mismatches = parse_cigar_for_matches_and_mismatches("cs:Z:" + cs)
+    return "\t".join(map(str, [read_name, read_len, 0, read_len, "+", reference, 18959, start, start + matches + mismatches,
+                               matches, matches + mismatches, 60, "tp:A:P", "cs:Z:" + cs])) + "\n"
+
+PAF_LINES = [
+    paf_line("read_1", 1002, "ref_a", 100, ":120*ag:30+acgt:400-tt:12*ct*ga:300"),
+    paf_line("read_2", 450, "ref_b", 5000, ":87+a:3-gattaca*tc:200+ccc:150"),
+    # no mapping
+    "read_3\t700\t0\t0\t*\t*\t0\t0\t0\t0\t0\t0\n",
+    # two primary mappings, reported as ambiguous
+    paf_line("read_4", 900, "ref_a", 10, ":400*ag:480"),
+    paf_line("read_4", 900, "ref_b", 20, ":300-aaaa:560"),
+    # below a minimum identity of 0.9
+    paf_line("read_5", 300, "ref_a", 1000, ":10*ag*ct*ga:5*tc*ac:5+gg:20*at"),
+    paf_line("read_6", 1500, "ref_c", 0, ":1500"),
+    paf_line("read_7", 250, "ref_b", 77, "*ga:248-c*tg"),
+]
+
+HEADER_DICT = {"read_1": ("BC01", "2019-05-29T20:00:01Z"), "read_2": ("BC02", "2019-05-29T20:00:02Z"),
+               "read_4": ("BC01", "2019-05-29T20:00:04Z"), "read_6": ("none", "2019-05-29T20:00:06Z")}
+
+def write_report(tmp_path, min_identity, chunk_size):
+    paf = tmp_path / "reads.paf"
+    paf.write_text("".join(PAF_LINES))
+    handle = io.StringIO()
+    parse_paf.parse_paf(paf, CsvReport(handle, ""), HEADER_DICT, None, min_identity, chunk_size)
+    return handle.getvalue()
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1000])
+@pytest.mark.parametrize("min_identity", [0, 0.9])
+def test_cs_tags_report_as_before(tmp_path, monkeypatch, min_identity, chunk_size):
+    report = write_report(tmp_path, min_identity, chunk_size)
+
+    monkeypatch.setattr(parse_paf, "parse_lines", lambda lines, header_dict: [old_parse_line(line, header_dict) for line in lines])
+    old_report = write_report(tmp_path, min_identity, chunk_size)
+
+    rows = [line.split(",") for line in report.splitlines()]
+    assert len(rows) == 1 + 7
+    assert rows == [line.split(",") for line in old_report.splitlines()]
+
+def test_cs_tags_parse_as_before():
+    for line in PAF_LINES:
+        mapping = parse_paf.parse_line(line, HEADER_DICT)
+        old_mapping = old_parse_line(line, HEADER_DICT)
+        assert (mapping["mismatches"], mapping["identity"]) == (old_mapping["mismatches"], old_mapping["identity"])
+
+# The reference option of a region column used to be found by checking every region of the
+# option against the alignment, by check_overlap as it was before RegionIndex, and taking the
+# value of the region listed first among those with the longest overlap.
+
+def check_overlap(coords1,coords2):
+    list1 = list(range(coords1[0],coords1[1]))
+    list2 = list(range(coords2[0],coords2[1]))
+    overlap = set(list1).intersection(list2)
+    if overlap:
+        return True, len(overlap)
+    else:
+        return False, 0
+
+def old_reference_options(reference_options, reference_info, ref_hit, coord_start, coord_end):
+    ref_opts = []
+    for k in reference_options:
+        if len(reference_options[k]) == 1:
+            ref_opts.append(reference_info[ref_hit][k])
+        else:
+            overlap_list = []
+            for i in reference_options[k]:
+                if len(i) == 3:
+                    sub_k, opt_start, opt_end = i
+                    overlap, length = check_overlap((opt_start, opt_end),(coord_start, coord_end))
+                    if overlap:
+                        overlap_list.append((reference_info[ref_hit][sub_k], length))
+            if overlap_list:
+                best = sorted(overlap_list, key = lambda x : x[1], reverse=True)[0]
+                ref_opts.append(best[0])
+            else:
+                ref_opts.append("NA")
+    return ref_opts
+
+def old_best_overlap(regions, start, end):
+    #the position of the region check_overlap picked, or None
+    overlaps = [(i, check_overlap(region, (start, end))[1]) for i, region in enumerate(regions)]
+    overlaps = [overlap for overlap in overlaps if overlap[1]]
+    return sorted(overlaps, key=lambda x: x[1], reverse=True)[0][0] if overlaps else None
+
+@pytest.mark.parametrize("regions, start, end, best", [
+    # touching regions share no base
+    ([(0, 10), (10, 20)], 5, 10, 0),
+    ([(0, 10), (10, 20)], 10, 15, 1),
+    ([(0, 10), (10, 20)], 9, 11, 0),
+    ([(10, 20), (0, 10)], 9, 11, 0),
+    # ties go to the region listed first, whatever its start
+    ([(5, 15), (0, 10)], 5, 10, 0),
+    ([(0, 10), (5, 15)], 5, 10, 0),
+    # zero-length regions and alignments overlap nothing
+    ([(5, 5), (0, 10)], 0, 10, 1),
+    ([(0, 10), (5, 15)], 7, 7, None),
+    ([(3, 3)], 3, 3, None),
+    ([(0, 10)], 10, 20, None),
+])
+def test_region_index_edges(regions, start, end, best):
+    assert old_best_overlap(regions, start, end) == best
+    assert parse_paf.RegionIndex(regions).best_overlap(start, end) == best
+
+def test_region_index_as_linear_scan():
+    rng = random.Random(1)
+    for _ in range(2000):
+        regions = []
+        for _ in range(rng.randint(1, 8)):
+            start = rng.randint(0, 60)
+            regions.append((start, start + rng.choice([0, 0, 1, 5, 10, 10, 20, 40])))
+        index = parse_paf.RegionIndex(regions)
+        for _ in range(10):
+            start = rng.randint(0, 80)
+            end = start + rng.choice([0, 1, 5, 10, 20, 50])
+            assert index.best_overlap(start, end) == old_best_overlap(regions, start, end), (regions, start, end)
+
+def test_reference_options_as_before():
+    rng = random.Random(2)
+    for _ in range(200):
+        reference_options = {"genogroup": ["genogroup"]}
+        for column in range(rng.randint(1, 3)):
+            regions = []
+            # a column of one item is a header field, not a region
+            for i in range(rng.randint(2, 6)):
+                start = rng.randint(0, 60)
+                regions.append([f"region_{column}_{i}", start, start + rng.choice([0, 1, 10, 10, 30])])
+            reference_options[f"loc_{column}"] = regions
+        reference_info = dict((reference, dict([("genogroup", reference + "_group")] +
+                                               [(region[0], f"{reference}_{region[0]}") for k in reference_options
+                                                for region in reference_options[k] if len(region) == 3]))
+                              for reference in ("ref_a", "ref_b"))
+        table = parse_paf.ReferenceOptionTable(reference_options, reference_info)
+        for _ in range(10):
+            reference = rng.choice(["ref_a", "ref_b"])
+            start = rng.randint(0, 80)
+            end = start + rng.choice([0, 1, 5, 20, 50])
+            assert table.lookup(reference, start, end) == \
+                old_reference_options(reference_options, reference_info, reference, start, end)
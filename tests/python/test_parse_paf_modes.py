@@ -0,0 +1,70 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from annotation_format import columnar_csv_lines
+from conftest import REPO_DIR
+
+# parse_paf.py on a data set of tests/parse_paf_benchmarks/generate_data.py: every way of joining
+# the read headers, number of threads and output format must give the same report and summary.
+
+SCRIPT = os.path.join(REPO_DIR, "default_protocol", "pipelines", "demux_map", "rules", "parse_paf.py")
+GENERATE_DATA = os.path.join(REPO_DIR, "tests", "parse_paf_benchmarks", "generate_data.py")
+
+MODES = {
+    "dict": [],
+    "stream": ["--header_join", "stream"],
+    "stream, small window": ["--header_join", "stream", "--header_window", "5"],
+    "threads": ["--threads", "3"],
+    "stream, threads": ["--header_join", "stream", "--threads", "3"],
+    "columnar": ["--output_format", "columnar"],
+    "columnar, stream, threads": ["--output_format", "columnar", "--header_join", "stream", "--threads", "3"]
+}
+
+@pytest.fixture(scope="module")
+def data_dir(tmp_path_factory):
+    data_dir = str(tmp_path_factory.mktemp("parse_paf_benchmark"))
+    subprocess.run([sys.executable, GENERATE_DATA, "--output_dir", data_dir, "--reads", "400", "--read_length", "300",
+                    "--references", "5", "--reference_length", "2000"], check=True)
+    return data_dir
+
+def run_parse_paf(data_dir, output_dir, mode, reference_options):
+    #returns the report (as csv) and the summary of a mode
+    report = os.path.join(output_dir, "report.rac" if "--output_format" in MODES[mode] else "report.csv")
+    summary = os.path.join(output_dir, "summary.json")
+    command = [sys.executable, SCRIPT,
+               "--paf_file", os.path.join(data_dir, "reads.paf"),
+               "--annotated_reads", os.path.join(data_dir, "demuxed.fastq"),
+               "--reference_file", os.path.join(data_dir, "references.fasta"),
+               "--report", report,
+               "--summary", summary] + MODES[mode]
+    if reference_options:
+        with open(os.path.join(data_dir, "reference_options.txt")) as fh:
+            command += ["--reference_options", fh.read().strip()]
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, cwd=os.path.dirname(SCRIPT))
+    if report.endswith(".rac"):
+        lines = list(columnar_csv_lines(report))
+    else:
+        with open(report) as fh:
+            lines = fh.readlines()
+    with open(summary) as fh:
+        return lines, json.load(fh)
+
+@pytest.mark.parametrize("reference_options", [False, True])
+def test_modes_give_the_same_report(data_dir, tmp_path, reference_options):
+    outputs = {}
+    for mode in MODES:
+        os.makedirs(str(tmp_path / str(len(outputs))))
+        outputs[mode] = run_parse_paf(data_dir, str(tmp_path / str(len(outputs))), mode, reference_options)
+
+    lines, summary = outputs["dict"]
+    assert len(lines) > 300
+    # the data set has reads without a barcode, unmapped reads and ambiguous ones
+    rows = [line.split(",") for line in lines[1:]]
+    assert {"none", "NB01"} <= set(row[3] for row in rows)
+    assert {"*", "?"} <= set(row[4] for row in rows)
+    for mode, output in outputs.items():
+        assert output == (lines, summary), mode
@@ -0,0 +1,27 @@
+import random
+import zlib
+
+import numpy as np
+
+import reference_sketch
+
+def python_sketch(sequences, k, max_hash):
+    #the hashes as they were computed before numpy, a zlib.crc32 call per k-mer
+    hashes = set()
+    for sequence in sequences:
+        hashes.update(h for h in map(zlib.crc32, [sequence[i:i + k] for i in range(len(sequence) - k + 1)]) if h < max_hash)
+    return sorted(hashes)
+
+def test_hashes_as_zlib_crc32():
+    rng = random.Random(1)
+    # reads shorter than k (and empty ones) have no k-mers, none span two reads
+    sequences = [bytes(rng.choice(b"ACGTN") for _ in range(length)) for length in [0, 3, 14, 15, 16, 200, 1000, 7, 5000]]
+    for k in (1, 5, 15):
+        for max_hash in (1 << 32, (1 << 32) // 50):
+            hashes = reference_sketch.sketch_sequences(sequences, k, max_hash)
+            assert hashes.dtype == np.int64
+            assert hashes.tolist() == python_sketch(sequences, k, max_hash)
+
+def test_no_kmers():
+    assert reference_sketch.sketch_sequences([], 15, 1 << 32).tolist() == []
+    assert reference_sketch.sketch_sequences([b"ACGT", b"AC"], 15, 1 << 32).tolist() == []
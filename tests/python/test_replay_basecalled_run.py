@@ -0,0 +1,79 @@
+import gzip
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+from conftest import REPO_DIR
+from replay_basecalled_run import RateSchedule, parse_profile
+
+SCRIPT = os.path.join(REPO_DIR, "unused_scripts", "replay_basecalled_run.py")
+
+def write_run(indir, reads):
+    os.makedirs(indir)
+    with open(os.path.join(indir, "run_0.fastq"), "w") as fh:
+        for i in range(reads):
+            fh.write(f"@r{i} start_time=2019-05-29T20:00:{i:02d}Z\nACGT\n+\nIIII\n")
+
+def test_gzip_replay_reads_back(tmp_path):
+    indir, outdir = str(tmp_path / "in"), str(tmp_path / "out")
+    write_run(indir, 5)
+    subprocess.run([sys.executable, SCRIPT, indir, outdir, "--rate", "100000", "--reads_per_file", "2", "--gzip"],
+                   check=True, stdout=subprocess.DEVNULL)
+
+    names = sorted(f for f in os.listdir(outdir))
+    assert names and all(name.endswith(".fastq.gz") for name in names)
+    headers = []
+    for name in names:
+        with gzip.open(os.path.join(outdir, name), "rt") as fh:
+            headers += [line.split()[0] for line in fh if line.startswith("@r")]
+    assert headers == [f"@r{i}" for i in range(5)]
+
+def stepped_due(points, ramp, total_reads, step=0.002):
+    #the time the reads are due by adding up the rate in small steps, as the schedule once did
+    seconds = reads = 0.0
+    while reads < total_reads:
+        rate = points[-1][1]
+        for (t0, r0), (t1, r1) in zip(points, points[1:]):
+            if seconds + step / 2 < t1:
+                rate = r0 + (r1 - r0) * (seconds + step / 2 - t0) / (t1 - t0) if ramp else r0
+                break
+        reads += rate * step
+        seconds += step
+    return seconds
+
+@pytest.mark.parametrize("profile, ramp, due", [
+    ("0:100", False, [(0, 0), (50, 0.5), (1000, 10)]),
+    # 100 reads/s for 10s, then 300
+    ("0:100,10:300", False, [(1000, 10), (1300, 11), (1600, 12)]),
+    # 100 + 20 * t reads/s, 2000 reads by 10s
+    ("0:100,10:300", True, [(500, 75 ** 0.5 - 5), (2000, 10), (2300, 11)]),
+    # a profile starts at its first rate, no reads are due while the rate is 0
+    ("5:100,10:0,20:50", False, [(500, 5), (1000, 10), (1100, 22)]),
+])
+def test_rate_schedule(profile, ramp, due):
+    schedule = RateSchedule(parse_profile(profile), ramp)
+    for total_reads, seconds in due:
+        assert schedule.due(total_reads, None) == pytest.approx(seconds)
+
+def test_rate_schedule_as_steps():
+    rng = random.Random(1)
+    for _ in range(10):
+        times = sorted(rng.sample(range(1, 60), rng.randint(1, 4)))
+        # rates of 0 between the points, but not at the end (the reads would never be due)
+        points = [(0.0, float(rng.randint(1, 200)))] + [(float(t), float(rng.randint(0, 200))) for t in times]
+        points[-1] = (points[-1][0], float(rng.randint(1, 200)))
+        for ramp in (False, True):
+            schedule = RateSchedule(points, ramp)
+            total_reads = 0
+            for _ in range(5):
+                total_reads += rng.randint(0, 1000)
+                assert schedule.due(total_reads, None) == pytest.approx(stepped_due(points, ramp, total_reads), abs=0.01)
+
+def test_rate_drops_to_zero():
+    schedule = RateSchedule(parse_profile("0:100,10:0"), False)
+    assert schedule.due(1000, None) == pytest.approx(10)
+    with pytest.raises(ValueError):
+        schedule.due(1001, None)
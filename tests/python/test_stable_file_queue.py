@@ -0,0 +1,80 @@
+import time
+
+from stable_file_queue import StableFileQueue
+
+THRESHOLD = 0.3
+POLL_INTERVAL = 0.02
+
+def write_file(path, text="@read\nACGT\n+\nIIII\n"):
+    with open(str(path), "w") as fh:
+        fh.write(text)
+    return str(path)
+
+def test_handed_out_once_stable(tmp_path):
+    queue = StableFileQueue(THRESHOLD, POLL_INTERVAL)
+    path = write_file(tmp_path / "batch_0.fastq", "")
+    queue.add(path)
+
+    # the file keeps changing for longer than the threshold
+    for _ in range(8):
+        time.sleep(THRESHOLD / 3)
+        with open(path, "a") as fh:
+            fh.write("@read\nACGT\n+\nIIII\n")
+        assert queue.stats()["ready"] == 0
+    last_write = time.time()
+
+    assert queue.get() == path
+    assert time.time() - last_write >= THRESHOLD
+    stats = queue.stats()
+    assert (stats["ready"], stats["pending"], stats["taken"]) == (0, 0, 1)
+
+def test_added_once_until_handed_out(tmp_path):
+    queue = StableFileQueue(THRESHOLD, POLL_INTERVAL)
+    path = write_file(tmp_path / "batch_0.fastq")
+    queue.add(path)
+    queue.add(path)
+    assert queue.get() == path
+    assert queue.get(THRESHOLD * 2) is None
+
+    # a file written again with the same name is handed out again
+    queue.add(write_file(path))
+    assert queue.get(THRESHOLD * 2) == path
+
+def test_max_depth_keeps_order(tmp_path):
+    queue = StableFileQueue(THRESHOLD, POLL_INTERVAL, max_depth=2)
+    paths = [write_file(tmp_path / f"batch_{i}.fastq") for i in range(5)]
+    for path in paths:
+        queue.add(path)
+
+    time.sleep(THRESHOLD * 3)
+    stats = queue.stats()
+    assert (stats["ready"], stats["pending"], stats["max_ready"]) == (2, 3, 2)
+    assert stats["full_seconds"] >= THRESHOLD
+
+    # taking a file makes room for the next pending one
+    assert [queue.get() for _ in paths] == paths
+    time.sleep(POLL_INTERVAL * 5)
+    full_seconds = queue.stats()["full_seconds"]
+    time.sleep(POLL_INTERVAL * 5)
+    stats = queue.stats()
+    assert (stats["ready"], stats["pending"], stats["max_ready"], stats["taken"]) == (0, 0, 2, 5)
+    assert stats["full_seconds"] == full_seconds
+
+def test_idle_timeout(tmp_path):
+    queue = StableFileQueue(THRESHOLD, POLL_INTERVAL)
+    start = time.time()
+    assert queue.get(0.2) is None
+    assert 0.2 <= time.time() - start < 1
+
+    # pending files aren't idle: the timeout starts once the last one is handed out
+    queue.add(write_file(tmp_path / "batch_0.fastq"))
+    assert queue.get(0.1) == str(tmp_path / "batch_0.fastq")
+    assert queue.get(0.1) is None
+
+def test_removed_files_are_dropped(tmp_path):
+    queue = StableFileQueue(THRESHOLD, POLL_INTERVAL)
+    path = write_file(tmp_path / "batch_0.fastq")
+    queue.add(path)
+    (tmp_path / "batch_0.fastq").unlink()
+    assert queue.get(THRESHOLD * 2) is None
+    assert queue.stats()["pending"] == 0
@@ -8,16 +8,19 @@ import argparse
 import operator
 import threading
 import mappy as mp
+from multiprocessing.pool import ThreadPool
 from datetime import datetime
-from collections import deque
 from watchdog.observers import Observer
 from watchdog.events import PatternMatchingEventHandler
+from stable_file_queue import StableFileQueue
 
 count = 0
 read_count = 1
 read_mappings = []
 reference_names = []
+reference_indices = {}
 reference_lengths = {}
+barcode_indices = {}
 matched_counts = None
 unmatched_counts = None
 
@@ -25,6 +28,7 @@ def create_index(reference_file):
 	aligner = mp.Aligner(reference_file, best_n = 1)
 
 	for name, seq, qual in mp.fastx_read(reference_file, read_comment=False):
+		reference_indices.setdefault(name, len(reference_names))
 		reference_names.append(name)
 		reference_lengths[name] = len(seq)
 
@@ -43,7 +47,16 @@ def write_info_json(name):
 		json.dump(jsn, fh, indent=2)
 
 
-def map_to_reference(aligner, query_path, reads_per_file, destination_folder):
+# each mapping thread keeps its own mappy buffer
+thread_buffers = threading.local()
+
+def map_read(aligner, seq):
+	# the best hit of the read, or None if it doesn't map
+	if not hasattr(thread_buffers, "buffer"):
+		thread_buffers.buffer = mp.ThreadBuffer()
+	return next(aligner.map(seq, buf=thread_buffers.buffer), None)
+
+def map_to_reference(aligner, query_path, reads_per_file, destination_folder, pool=None):
 	global count
 	global read_count
 	global read_mappings
@@ -61,13 +74,22 @@ def map_to_reference(aligner, query_path, reads_per_file, destination_folder):
 
 	# barcode = default_barcode
 
-	for name, seq, qual, comment in mp.fastx_read(query_path, read_comment=True): # read one sequence
+	reads = list(mp.fastx_read(query_path, read_comment=True))
+	# mappy releases the GIL, so the reads are mapped by the pool's threads at the same time.
+	# The hits come back in the order of the reads
+	seqs = [seq for name, seq, qual, comment in reads]
+	if pool is None:
+		hits = map(lambda seq: map_read(aligner, seq), seqs)
+	else:
+		hits = pool.imap(lambda seq: map_read(aligner, seq), seqs, chunksize=64)
+
+	for (name, seq, qual, comment), h in zip(reads, hits):
 		read_time = re.search(r'start_time=([^\s]+)', comment).group(1)
 		# if default_barcode is None:
 		barcode = re.search(r'barcode=([^\s]+)', comment).group(1)
-		try:
-			barcode_index = barcodes.index(barcode)
-		except ValueError:
+		if barcode in barcode_indices:
+			barcode_index = barcode_indices[barcode]
+		else:
 			generic = re.match("^barcode(\d\d)$", barcode)
 			if generic:
 				barcode_index = int(generic[1])-1
@@ -80,12 +102,13 @@ def map_to_reference(aligner, query_path, reads_per_file, destination_folder):
 			count += 1
 			read_count += 1
 
-			h = next(aligner.map(seq))
+			if h is None:
+				raise LookupError(name + " unmatched")
 
 			start = h.r_st
 			end = h.r_en
 			identity = h.mlen / h.blen
-			reference_index = reference_names.index(h.ctg)
+			reference_index = reference_indices[h.ctg]
 
 			matched_counts[barcode_index] += 1
 
@@ -166,16 +189,17 @@ def map_to_reference(aligner, query_path, reads_per_file, destination_folder):
 	print("Finished mapping query file: " + query_file + " - " + str(i) + " reads, " + str(unmatched) + " unmatched")
 	#print("Read mappings: " + str(count) + " / " + str(reads_per_file));
 
-# This thread class watches the file deque and if there are two or more files
-# in it then it takes the oldest one and maps it (if there is only one file
-# in the deque then it may not have finished writing).
+# This thread class takes each file from the queue once it has finished writing
+# (its size has stopped changing) and maps it.
 class Mapper(threading.Thread):
-	def __init__(self, aligner, reads_per_file, destination_folder, file_queue, die_when_done):
+	def __init__(self, aligner, reads_per_file, destination_folder, file_queue, die_when_done, threads=1, idle_timeout=10):
 		self.aligner = aligner
+		self.pool = ThreadPool(threads) if threads > 1 else None
 		self.reads_per_file = reads_per_file
 		self.destination_folder = destination_folder
 		self.file_queue = file_queue
 		self.die_when_done = die_when_done
+		self.idle_timeout = idle_timeout
 
 		threading.Thread.__init__(self)
 		global matched_counts
@@ -185,20 +209,20 @@ class Mapper(threading.Thread):
 
 	def run (self):
 		while True:
-			# if there is more than one file in the deque then the first one must
-			# have finished writing so is ready to map
-			if len(file_queue) > 1:
-				try:
-					map_to_reference(aligner, file_queue.popleft(), reads_per_file, destination_folder)
-				except ValueError as err:
-					print(err)
-			elif self.die_when_done:
-				print("mapping thread terminating as there are no more reads in the deque & you have elected not to watch the folder.")
+			# waits for the next file, or if not watching the folder, gives up once the
+			# queue has been empty for idle_timeout seconds
+			query_path = self.file_queue.get(self.idle_timeout if self.die_when_done else None)
+			if query_path is None:
+				print("mapping thread terminating as there are no more reads in the queue & you have elected not to watch the folder.")
 				return;
-			time.sleep(0.1)
-
-# The Watcher watches the source folder and if a file is created then it pops
-# its name into the deque for the mapping thread to deal with.
+			try:
+				map_to_reference(aligner, query_path, reads_per_file, destination_folder, self.pool)
+			except ValueError as err:
+				print(err)
+			print(self.file_queue.format_stats())
+
+# The Watcher watches the source folder and if a file is created then it adds
+# it to the queue for the mapping thread to deal with.
 class Watcher(PatternMatchingEventHandler):
 	patterns = ["*.fastq", "*.fasta"]
 	file_queue = None
@@ -223,7 +247,12 @@ class Watcher(PatternMatchingEventHandler):
 		if event.event_type == 'created':
 			path = event.src_path.split("/")
 			print("Appending " + path[-1] + " to queue")
-			file_queue.append(event.src_path)
+			self.file_queue.add(event.src_path)
+		elif event.event_type == 'moved':
+			# written under another name and renamed when complete
+			path = event.dest_path.split("/")
+			print("Appending " + path[-1] + " to queue")
+			self.file_queue.add(event.dest_path)
 
 	def on_modified(self, event):
 		self.process(event)
@@ -231,14 +260,17 @@ class Watcher(PatternMatchingEventHandler):
 	def on_created(self, event):
 		self.process(event)
 
+	def on_moved(self, event):
+		self.process(event)
+
 def add_existing_files(source_folder, file_queue):
 	print("Scanning source folder for reads already present...")
-	for filename in glob.iglob(os.path.join(source_folder, "**", "*.fastq"), recursive=True):
+	for filename in sorted(glob.iglob(os.path.join(source_folder, "**", "*.fastq"), recursive=True)):
 		path = filename.split("/")
 
 		print("\tAppending " + path[-1] + " to queue")
 
-		file_queue.append(filename)
+		file_queue.add(filename)
 	print()
 
 if __name__ == '__main__':
@@ -247,6 +279,10 @@ if __name__ == '__main__':
 	parser.add_argument("-n", "--reads_per_file", help="the number of read mappings per output file", action="store", type=int, default=1000)
 	parser.add_argument("-t", "--title", required=True, help="Name of run", action="store")
 	parser.add_argument("-b", "--barcodes", required=True, help="the sample / barcode names. (if not multiplexed then this is a single string)", nargs="+", action="store")
+	parser.add_argument("-p", "--threads", help="number of threads mapping the reads of a file", action="store", type=int, default=1)
+	parser.add_argument(      "--stability_threshold", help="seconds a file's size must stay the same before it is mapped", action="store", type=float, default=5.0)
+	parser.add_argument(      "--max_queue", help="the most finished files queued for mapping, others wait until there is room (0 for no limit)", action="store", type=int, default=10)
+	parser.add_argument(      "--idle_timeout", help="with --dont_observe, stop once no file has been queued for this many seconds", action="store", type=float, default=10.0)
 	parser.add_argument(      "--dont_observe", help="Don't watch for new files, just map what's there", action="store_true")
 	parser.add_argument("-i", '--watch_directory', required=True, help='path to the reads folder to be watched')
 	parser.add_argument("-o", '--output_directory', required=True, help='path to the directory where read mapping files will be written')
@@ -256,6 +292,8 @@ if __name__ == '__main__':
 	reference_file = args.reference_file
 	reads_per_file = args.reads_per_file
 	barcodes = ["unused"] + args.barcodes;
+	for index, barcode_name in enumerate(barcodes):
+		barcode_indices.setdefault(barcode_name, index)
 	source_folder = args.watch_directory
 	destination_folder = args.output_directory
 	aligner = create_index(reference_file)
@@ -275,15 +313,16 @@ if __name__ == '__main__':
 	print(" output coords: " + reference_names[0])
 	print(" output length: " + str(reference_lengths[reference_names[0]]))
 	print("reads per JSON: " + str(reads_per_file))
+	print("   map threads: " + str(args.threads))
 	print()
 
 	write_info_json(args.title)
 
-	file_queue = deque([])
+	file_queue = StableFileQueue(args.stability_threshold, max_depth=args.max_queue)
 	add_existing_files(source_folder, file_queue)
 
 	# start the thread that processes files pulled from the stack
-	mapper = Mapper(aligner, reads_per_file, destination_folder, file_queue, args.dont_observe)
+	mapper = Mapper(aligner, reads_per_file, destination_folder, file_queue, args.dont_observe, args.threads, args.idle_timeout)
 	mapper.start()
 
 	if not args.dont_observe:
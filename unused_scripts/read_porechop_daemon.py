@@ -6,10 +6,10 @@ import argparse
 import datetime
 import threading
 import subprocess
-from collections import deque
 
 from watchdog.observers import Observer
 from watchdog.events import PatternMatchingEventHandler
+from stable_file_queue import StableFileQueue
 
 barcodes = [ "barcode01", "barcode03", "barcode04" ]
 
@@ -33,9 +33,8 @@ def chop_and_barcode(query_path, destination_folder):
 	return_code = subprocess.call(command, shell=True)
 
 
-# This thread class watches the file deque and if there are two or more files
-# in it then it takes the oldest one and maps it (if there is only one file
-# in the deque then it may not have finished writing).
+# This thread class takes each file from the queue once it has finished writing
+# (its size has stopped changing) and demultiplexes it.
 class Chopper(threading.Thread):
 	destination_folder = ""
 	file_queue = None
@@ -48,14 +47,11 @@ class Chopper(threading.Thread):
 
 	def run (self):
 		while True:
-			# if there is more than one file in the deque then the first one must
-			# have finished writing so is ready to map
-			if len(file_queue) > 1:
-				chop_and_barcode(file_queue.popleft(), destination_folder)
-			time.sleep(0.1)
-
-# The Watcher watches the source folder and if a file is created then it pops
-# its name into the deque for the mapping thread to deal with.
+			chop_and_barcode(self.file_queue.get(), self.destination_folder)
+			print(self.file_queue.format_stats())
+
+# The Watcher watches the source folder and if a file is created then it adds
+# it to the queue for the demultiplexing thread to deal with.
 class Watcher(PatternMatchingEventHandler):
 	patterns = ["*.fastq", "*.fasta"]
 	file_queue = None
@@ -79,7 +75,10 @@ class Watcher(PatternMatchingEventHandler):
 
 		if event.event_type == 'created':
 			#print("Appending " + event.src_path + " to queue")
-			file_queue.append(event.src_path)
+			self.file_queue.add(event.src_path)
+		elif event.event_type == 'moved':
+			# written under another name and renamed when complete
+			self.file_queue.add(event.dest_path)
 
 	def on_modified(self, event):
 		self.process(event)
@@ -87,17 +86,22 @@ class Watcher(PatternMatchingEventHandler):
 	def on_created(self, event):
 		self.process(event)
 
+	def on_moved(self, event):
+		self.process(event)
+
 def push_existing_files(source_folder, file_queue):
-	for filename in os.listdir(source_folder):
+	for filename in sorted(os.listdir(source_folder)):
 		if filename.endswith(".fastq"):
 			print("Existing file: " + filename)
-			file_queue.append(source_folder + "/" + filename)
+			file_queue.add(source_folder + "/" + filename)
 
 if __name__ == '__main__':
 
 	parser = argparse.ArgumentParser(description='A daemon process for trimming and de-multiplexing guppy reads.')
 	parser.add_argument('watch_directory', help='path to the reads folder to be watched')
 	parser.add_argument('output_directory', help='path to the directory where read mapping files will be written')
+	parser.add_argument('--stability_threshold', help="seconds a file's size must stay the same before it is demultiplexed", type=float, default=5.0)
+	parser.add_argument('--max_queue', help='the most finished files queued for porechop, others wait until there is room (0 for no limit)', type=int, default=10)
 	args = parser.parse_args()
 
 	source_folder = args.watch_directory
@@ -108,7 +112,7 @@ if __name__ == '__main__':
 	print("   destination: " + destination_folder)
 	print()
 
-	file_queue = deque([])
+	file_queue = StableFileQueue(args.stability_threshold, max_depth=args.max_queue)
 
 	push_existing_files(source_folder, file_queue)
 
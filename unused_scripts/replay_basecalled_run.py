@@ -0,0 +1,230 @@
+import sys, os
+import argparse
+import gzip
+import math
+import re
+import shutil
+import time
+from datetime import datetime
+
+# Re-emits the FASTQs of a finished run into a folder RAMPART watches (its basecalledPath) at a
+# chosen rate, to find the sustained rate at which the annotation pipeline falls behind.
+#
+# The pace is set in reads per second, either fixed (--rate), following a profile of
+# "seconds:reads_per_second" points (--profile, stepped or ramped between points, the last rate
+# is kept) or following the reads' own start_times sped up by a factor (--speedup). A file is
+# emitted once the reads it holds are due. Files are written to a hidden temporary name (which
+# RAMPART's watcher ignores) and renamed into place, so each appears complete, as from MinKNOW.
+#
+# Each emitted file is logged (--log, tab separated) with the time it was due and the time it
+# appeared, in epoch seconds, to compare with when its annotation was written.
+
+FASTQ_EXTENSIONS = (".fastq", ".fastq.gz")
+
+start_time_pattern = re.compile(rb'start_time=([^\s]+)')
+
+# epoch seconds of each start_time seen, many reads share one
+start_times = {}
+
+def find_fastqs(indir):
+    # the FASTQs under indir, in the order MinKNOW wrote them (by name, numbers compared as numbers)
+    fastqs = []
+    for root, dirs, files in os.walk(indir):
+        for f in files:
+            if f.endswith(FASTQ_EXTENSIONS) and not f.startswith("."):
+                fastqs.append(os.path.join(root, f))
+    natural = lambda path: [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", path)]
+    return sorted(fastqs, key=natural)
+
+def open_fastq(path, mode="rb"):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+def start_time(header):
+    # epoch seconds of the read's start_time, None if it has none
+    match = start_time_pattern.search(header)
+    if not match:
+        return None
+    value = match.group(1)
+    if value not in start_times:
+        start_times[value] = datetime.strptime(value.decode(), "%Y-%m-%dT%H:%M:%SZ").timestamp()
+    return start_times[value]
+
+def scan_fastq(path):
+    # the number of reads in the file and the latest start_time
+    reads = 0
+    latest = None
+    with open_fastq(path) as fh:
+        for i, line in enumerate(fh):
+            if i % 4 == 0:
+                reads += 1
+                seconds = start_time(line)
+                if seconds is not None and (latest is None or seconds > latest):
+                    latest = seconds
+    return reads, latest
+
+def source_files(indir, fastqs):
+    # yields (output name, source path, None, reads, latest start_time) of each FASTQ, emitted as it is
+    for path in fastqs:
+        reads, latest = scan_fastq(path)
+        yield os.path.relpath(path, indir), path, None, reads, latest
+
+def rechunked_files(fastqs, reads_per_file, extension):
+    # yields (output name, None, data, reads, latest start_time) of files of reads_per_file reads
+    number = 0
+    records = []
+    latest = None
+    for path in fastqs:
+        with open_fastq(path) as fh:
+            for lines in zip(fh, fh, fh, fh):
+                records.append(b"".join(lines))
+                seconds = start_time(lines[0])
+                if seconds is not None and (latest is None or seconds > latest):
+                    latest = seconds
+                if len(records) == reads_per_file:
+                    yield "replay_{}{}".format(number, extension), None, b"".join(records), len(records), latest
+                    number += 1
+                    records = []
+                    latest = None
+    if records:
+        yield "replay_{}{}".format(number, extension), None, b"".join(records), len(records), latest
+
+def parse_profile(profile):
+    # "0:100,600:2000" -> [(0.0, 100.0), (600.0, 2000.0)]
+    points = []
+    for point in profile.split(","):
+        seconds, rate = point.split(":")
+        points.append((float(seconds), float(rate)))
+    points.sort()
+    if points[0][0] > 0:
+        points.insert(0, (0.0, points[0][1]))
+    return points
+
+class RateSchedule:
+    # the time (seconds into the replay) by which a given total number of reads is due. The reads
+    # by a time are the integral of the rate: whole segments (between two profile points) are
+    # added up, and the time within the last one is solved for, a quadratic if the rate is ramped
+
+    def __init__(self, points, ramp):
+        self.points = points
+        self.ramp = ramp
+        # the segment reached by the last call, and the reads due by its start
+        self.segment = 0
+        self.reads = 0.0
+
+    def due(self, total_reads, latest):
+        while True:
+            t0, r0 = self.points[self.segment]
+            if self.segment + 1 == len(self.points):
+                # the last rate is kept
+                if r0 <= 0:
+                    if total_reads <= self.reads:
+                        return t0
+                    raise ValueError("the profile's rate drops to 0 reads/s before all reads are emitted")
+                return t0 + (total_reads - self.reads) / r0
+
+            t1, r1 = self.points[self.segment + 1]
+            if not self.ramp:
+                r1 = r0
+            needed = total_reads - self.reads
+            if needed <= (r0 + r1) / 2 * (t1 - t0):
+                break
+            self.reads += (r0 + r1) / 2 * (t1 - t0)
+            self.segment += 1
+
+        if needed <= 0:
+            return t0
+        # reads(x) = r0 * x + a * x^2 over the segment, solved for reads(x) = needed in the form
+        # that doesn't lose precision when a is small (or 0, a constant rate)
+        a = (r1 - r0) / (2 * (t1 - t0))
+        x = 2 * needed / (r0 + math.sqrt(max(r0 * r0 + 4 * a * needed, 0.0)))
+        return t0 + min(x, t1 - t0)
+
+class SpeedupSchedule:
+    # the time a file is due going by the start_time of its reads, sped up by `speedup`
+
+    def __init__(self, speedup):
+        self.speedup = speedup
+        self.first = None
+        self.seconds = 0.0
+
+    def due(self, total_reads, latest):
+        if latest is not None:
+            if self.first is None:
+                self.first = latest
+            # never earlier than the previous file, in case the files overlap in time
+            self.seconds = max(self.seconds, (latest - self.first) / self.speedup)
+        return self.seconds
+
+def emit(outdir, name, source, data):
+    # written under a hidden name (ignored by the watcher) and moved into place once complete
+    path = os.path.join(outdir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = os.path.join(os.path.dirname(path), "." + os.path.basename(path) + ".tmp")
+    if source is not None:
+        shutil.copyfile(source, temporary)
+    else:
+        # compressed by the final name, the temporary name doesn't end in .gz
+        with (gzip.open(temporary, "wb") if path.endswith(".gz") else open(temporary, "wb")) as fh:
+            fh.write(data)
+    os.replace(temporary, path)
+    return path
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay the FASTQs of a finished run into a watched folder at a given rate')
+    parser.add_argument("indir", help="Directory with the FASTQs of the run (searched recursively)")
+    parser.add_argument("outdir", help="Directory where the FASTQs are written, RAMPART's basecalledPath")
+    pace = parser.add_mutually_exclusive_group(required=True)
+    pace.add_argument("--rate", type=float, help="reads per second")
+    pace.add_argument("--profile", help="reads per second over time as seconds:rate points, e.g. 0:200,300:400,600:800")
+    pace.add_argument("--speedup", type=float, help="replay at this many times the speed the reads were sequenced (by their start_time)")
+    parser.add_argument("--ramp", action="store_true", help="change the rate linearly between the --profile points rather than in steps")
+    parser.add_argument("--reads_per_file", type=int, default=0,
+                        help="regroup the reads into files of this many reads (default: emit the run's files as they are)")
+    parser.add_argument("--gzip", action="store_true", help="gzip the regrouped files")
+    parser.add_argument("--log", help="tab separated log of each emitted file (default: stdout only)")
+    args = parser.parse_args()
+
+    fastqs = find_fastqs(args.indir)
+    if not fastqs:
+        print("No FASTQs found in", args.indir)
+        sys.exit(2)
+    os.makedirs(args.outdir, exist_ok=True)
+
+    if args.reads_per_file:
+        files = rechunked_files(fastqs, args.reads_per_file, ".fastq.gz" if args.gzip else ".fastq")
+    else:
+        files = source_files(args.indir, fastqs)
+
+    if args.speedup:
+        schedule = SpeedupSchedule(args.speedup)
+    else:
+        schedule = RateSchedule(parse_profile(args.profile or "0:{}".format(args.rate)), args.ramp)
+
+    log = open(args.log, "w") if args.log else None
+    columns = ["file", "reads", "total_reads", "due", "emitted", "late"]
+    if log:
+        log.write("\t".join(columns) + "\n")
+
+    print("Replaying {} FASTQs from {} into {}".format(len(fastqs), args.indir, args.outdir))
+    started = time.time()
+    total_reads = 0
+    for name, source, data, reads, latest in files:
+        total_reads += reads
+        due = started + schedule.due(total_reads, latest)
+        if due > time.time():
+            time.sleep(due - time.time())
+        emit(args.outdir, name, source, data)
+        emitted = time.time()
+        row = [name, reads, total_reads, "{:.3f}".format(due), "{:.3f}".format(emitted), "{:.3f}".format(emitted - due)]
+        if log:
+            log.write("\t".join(map(str, row)) + "\n")
+            log.flush()
+        elapsed = emitted - started
+        print("\r{:.0f}s: emitted {} ({} reads, {:.0f} reads/s overall)   ".format(
+            elapsed, name, reads, total_reads / elapsed if elapsed else 0), end="", flush=True)
+
+    if log:
+        log.close()
+    print("\nEmitted {} reads in {:.0f}s".format(total_reads, time.time() - started))
@@ -1,71 +1,122 @@
 import os
 import sys
 import argparse
+import gzip
+import heapq
+import tempfile
 from datetime import datetime
+from operator import itemgetter
 import re
 
 lines_per_read = 4
 
+start_time_pattern = re.compile(rb'start_time=([^\s]+)')
+
+# Reads are sorted by start_time with an external merge sort, so the input can be much larger
+# than memory: reads are collected until they take up --memory_mb, sorted and spilled to a
+# temporary file, then the sorted spill files are merged (reads with the same start_time keep
+# their input order) and written out in chunks of --reads_per_file as they come.
+
+def open_file(path, mode):
+	if path.endswith(".gz"):
+		return gzip.open(path, mode)
+	return open(path, mode)
+
+def read_records(path):
+	# yields each fastq record (its four lines) as bytes
+	with open_file(path, "rb") as ins:
+		for lines in zip(*[ins] * lines_per_read):
+			yield b"".join(lines)
+
+def start_times():
+	# returns a function giving the start_time of a record in epoch seconds. Many reads start
+	# in the same second, so each start_time is parsed once
+	times = {}
+	def start_time(record):
+		value = start_time_pattern.search(record, 0, record.index(b"\n")).group(1)
+		if value not in times:
+			times[value] = datetime.strptime(value.decode(), "%Y-%m-%dT%H:%M:%SZ").timestamp()
+		return times[value]
+	return start_time
+
+def sorted_runs(records, start_time, memory_budget, spill_directory):
+	# returns the records as sorted runs, spilled to files each time the reads held in memory
+	# reach memory_budget bytes. The last run is kept in memory
+	runs = []
+	run = []
+	size = 0
+	for record in records:
+		run.append((start_time(record), record))
+		# the tuple, the float and the bytes object each add to the record
+		size += len(record) + 120
+		if size >= memory_budget:
+			runs.append(spill(run, spill_directory, len(runs)))
+			run = []
+			size = 0
+	run.sort(key=itemgetter(0))
+	runs.append(run)
+	return runs
+
+def spill(run, spill_directory, number):
+	run.sort(key=itemgetter(0))
+	file_name = os.path.join(spill_directory, "run_" + str(number).zfill(4) + ".fastq")
+	with open(file_name, "wb") as out:
+		out.writelines(record for time, record in run)
+	print("Spilled", len(run), "reads to", file_name)
+	return file_name
+
+def read_run(run, start_time):
+	# yields (start_time, record) of a spilled run, in order
+	for record in read_records(run):
+		yield start_time(record), record
+
+def write_chunks(records, destination_folder, reads_per_file, extension):
+	# writes the records to files of reads_per_file reads, returns the number of reads and files
+	file_number = 0
+	count = 0
+	file = None
+	for record in records:
+		if file is None:
+			file_name = destination_folder + "/fastq_" + str(file_number).zfill(3) + extension
+			file = open_file(file_name, "wb")
+			#print("Writing file:", file_name)
+		file.write(record)
+		count += 1
+		if count % reads_per_file == 0:
+			file.close()
+			file = None
+			file_number += 1
+	if file is not None:
+		file.close()
+		file_number += 1
+	return count, file_number
+
 if __name__ == '__main__':
 
 	parser = argparse.ArgumentParser(description='A simple script to divide up a fastq dile into multiple fastq files.')
-	parser.add_argument("-i", "--input_file", required=True, help="path to the input fastq file", action="store")
+	parser.add_argument("-i", "--input_file", required=True, help="path to the input fastq file (may be gzipped)", action="store")
 	parser.add_argument("-o", "--output_directory", required=True, help="path to the directory where the files will be written", action="store")
 	parser.add_argument("-n", "--reads_per_file", help="number of reads in each output file", action="store", type=int, default=1000)
+	parser.add_argument("-m", "--memory_mb", help="memory for holding reads while sorting, in megabytes", action="store", type=int, default=1024)
+	parser.add_argument("-t", "--temp_directory", help="where to write the sorted runs (default: the output directory)", action="store")
+	parser.add_argument("-z", "--gzip", help="gzip the output files", action="store_true")
 	args = parser.parse_args()
 
 	source_file = args.input_file
 	destination_folder = args.output_directory
 	reads_per_file = args.reads_per_file
+	extension = ".fastq.gz" if args.gzip else ".fastq"
 
-	reads = []
-
-	with open(source_file, "r") as ins:
-		count = 0
-		read = {
-			"lines": []
-		}
-
-		for line in ins:
-			read["lines"].append(line)
-			count += 1
-			if count == lines_per_read:
-				header = re.search(r'start_time=([^\s]+)', read["lines"][0])
-				read["time"] = datetime.strptime(header.group(1), "%Y-%m-%dT%H:%M:%SZ").timestamp()
-				reads.append(read)
-				count = 0
-				read = {
-					"lines": []
-				}
-	print("Read", len(reads), "reads from", source_file)
-
-	print("Sorting...")
-	reads.sort(key=lambda x: x["time"])
+	start_time = start_times()
 
+	with tempfile.TemporaryDirectory(dir=args.temp_directory or destination_folder) as spill_directory:
+		runs = sorted_runs(read_records(source_file), start_time, args.memory_mb * 1024 * 1024, spill_directory)
 
+		print("Merging", len(runs), "sorted runs...")
+		# heapq.merge takes equal keys from the earlier run first, so the sort is stable
+		merged = heapq.merge(*[read_run(run, start_time) if isinstance(run, str) else run for run in runs], key=itemgetter(0))
 
-	file_number = 0
-	count = 0
-	
-	file_name = destination_folder + "/fastq_" + str(file_number).zfill(3) + ".fastq"
-	file = open(file_name, "w") 
-	#print("Writing file:", file_name)
-
-	for read in reads:
-		for line in read["lines"]:
-			file.write(line)
-
-		count += 1
-
-		if count == reads_per_file:
-			file.close()
-
-			count = 0
-			file_number += 1
-			file_name = destination_folder + "/fastq_" + str(file_number).zfill(3) + ".fastq"
-			file = open(file_name, "w") 
-			#print("Writing file:", file_name)
-	
-	file.close()
-	print("Written", file_number + 1, "files")
+		count, files = write_chunks((record for time, record in merged), destination_folder, reads_per_file, extension)
 
+	print("Read", count, "reads from", source_file)
+	print("Written", files, "files")
@@ -0,0 +1,132 @@
+import os
+import time
+import threading
+from collections import deque
+
+# A queue of files being written by MinKNOW, shared by the read daemons. The watcher adds each
+# file when it is created and the file is handed out by get() once its size and modification
+# time haven't changed for stability_threshold seconds (as chokidar's awaitWriteFinish does for
+# the server), so the last file of a run is processed too, seconds after it was written.
+#
+# At most max_depth stable files are queued: beyond that files are left pending until the
+# consumer catches up, and the time the queue spends full is counted as backpressure. stats()
+# reports the queue depth, how long files waited and how long the queue was full.
+
+class StableFileQueue:
+	def __init__(self, stability_threshold=5.0, poll_interval=1.0, max_depth=0):
+		self.stability_threshold = stability_threshold
+		self.poll_interval = poll_interval
+		self.max_depth = max_depth
+
+		self.condition = threading.Condition()
+		# path -> [size, mtime, unchanged since, added], in the order the files were added
+		self.pending = {}
+		# (path, added, stable at)
+		self.ready = deque()
+		# the paths pending or ready, so a file is only queued once until it is handed out
+		self.seen = set()
+
+		self.taken = 0
+		self.total_wait = 0.0
+		self.max_wait = 0.0
+		self.max_ready = 0
+		self.full_since = None
+		self.full_seconds = 0.0
+
+		checker = threading.Thread(target=self._check_pending)
+		checker.daemon = True
+		checker.start()
+
+	def add(self, path):
+		with self.condition:
+			if path in self.seen:
+				return
+			self.seen.add(path)
+			self.pending[path] = [None, None, None, time.time()]
+			self.condition.notify_all()
+
+	def _check_pending(self):
+		while True:
+			with self.condition:
+				# sleeps until a file is added, polls its size while any are pending
+				while not self.pending:
+					self.condition.wait()
+			self.check()
+			time.sleep(self.poll_interval)
+
+	def check(self):
+		# one pass over the pending files, queueing those which have become stable
+		now = time.time()
+		with self.condition:
+			full = False
+			for path, state in list(self.pending.items()):
+				try:
+					stat = os.stat(path)
+				except OSError:
+					# removed (or renamed) before it was finished
+					del self.pending[path]
+					self.seen.discard(path)
+					continue
+				if (stat.st_size, stat.st_mtime) != (state[0], state[1]):
+					state[0], state[1], state[2] = stat.st_size, stat.st_mtime, now
+				elif now - state[2] >= self.stability_threshold and not full:
+					if self.max_depth and len(self.ready) >= self.max_depth:
+						# left pending (in order) until the consumer takes a file
+						full = True
+						continue
+					del self.pending[path]
+					self.ready.append((path, state[3], now))
+					self.max_ready = max(self.max_ready, len(self.ready))
+			self._set_full(full, now)
+			if self.ready:
+				self.condition.notify_all()
+
+	def _set_full(self, full, now):
+		if full and self.full_since is None:
+			self.full_since = now
+		elif not full and self.full_since is not None:
+			self.full_seconds += now - self.full_since
+			self.full_since = None
+
+	def get(self, idle_timeout=None):
+		# the oldest stable file, waiting for one if there is none yet. Returns None once nothing
+		# has been queued or pending for idle_timeout seconds (never if it is None)
+		with self.condition:
+			idle_since = time.time()
+			while not self.ready:
+				if self.pending:
+					idle_since = time.time()
+				if idle_timeout is None:
+					self.condition.wait()
+					continue
+				remaining = idle_since + idle_timeout - time.time()
+				if remaining <= 0:
+					return None
+				self.condition.wait(min(remaining, self.poll_interval))
+
+			path, added, stable = self.ready.popleft()
+			self.seen.discard(path)
+			waited = time.time() - added
+			self.taken += 1
+			self.total_wait += waited
+			self.max_wait = max(self.max_wait, waited)
+			return path
+
+	def stats(self):
+		with self.condition:
+			now = time.time()
+			full_seconds = self.full_seconds + (now - self.full_since if self.full_since is not None else 0.0)
+			return {
+				"ready": len(self.ready),
+				"pending": len(self.pending),
+				"max_ready": self.max_ready,
+				"taken": self.taken,
+				"mean_wait": self.total_wait / self.taken if self.taken else 0.0,
+				"max_wait": self.max_wait,
+				"full_seconds": full_seconds
+			}
+
+	def format_stats(self):
+		stats = self.stats()
+		return "queue: {ready} ready, {pending} pending (max {max_ready} ready), {taken} taken, " \
+			"waited {mean_wait:.1f}s on average ({max_wait:.1f}s max), full for {full_seconds:.1f}s".format(**stats)